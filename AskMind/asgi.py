@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AskMind.settings')
 
 application = get_asgi_application()
+
+# Only server processes import this module: load the models before the first request
+from question_answer.apps import warm_models  # noqa: E402
+
+warm_models()
@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'question_answer.middleware.InstrumentationMiddleware',
 ]
 
 ROOT_URLCONF = 'AskMind.urls'
@@ -120,6 +121,120 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 
+# Question answering
+# These resources are loaded once per process by question_answer.registry
+
+SEARCH_BACKEND = 'elasticsearch'  # 'elasticsearch', or 'sqlite' for an embedded FTS5 index (no external service)
+SQLITE_SEARCH_DB = BASE_DIR / 'cache' / 'search.sqlite3'  # Used by the 'sqlite' search backend
+ELASTICSEARCH_HOST = 'http://localhost:9200'
+ELASTICSEARCH_CONNECTIONS = 10  # Size of the shared connection pool
+
+# Indices built before 'engine' became the default use 'python': rebuild them with index_corpus --recreate
+TEXT_ANALYSIS = 'engine'  # 'engine': the search backend analyzes the raw text; 'python': spaCy and NLTK do it first
+SPACY_MODEL = 'fr_core_news_sm'  # Used by the 'python' text analysis
+ANALYZER_CACHE_SIZE = 100000  # Lemmas whose stems are memoized by the text analyzer
+ANALYZER_BATCH_SIZE = 64  # Texts per spaCy nlp.pipe batch
+
+QA_MODEL_NAME = 'bert-large-uncased-whole-word-masking-finetuned-squad'
+QA_USE_DISTILLED_MODEL = False  # Use the smaller distilbert-base-cased-distilled-squad checkpoint instead
+QA_BACKEND = 'torch'  # 'torch', 'torch-int8' (dynamic quantization) or 'onnx' (ONNX Runtime, needs optimum[onnxruntime])
+QA_MODEL_CACHE_DIR = None  # Hugging Face cache directory; None uses the default one
+QA_LOCAL_FILES_ONLY = False  # Never download checkpoints, NLTK data or spaCy models: fill the caches with prepare_models
+QA_ONNX_DIR = BASE_DIR / 'cache' / 'onnx'  # Where the 'onnx' backend keeps its exported models
+QA_ANSWER_MODE = 'batched'  # 'batched' answers every retrieved file in one pipeline call, 'threaded' uses a thread per file
+QA_BATCH_SIZE = 8  # Contexts per forward pass in batched mode
+QA_TORCH_THREADS = None  # Intra-op threads of the torch backends; None uses one per core
+QA_TORCH_INTEROP_THREADS = None  # Inter-op threads of the torch backends; None uses the torch default
+
+QA_INFERENCE_ADDRESS = None  # Answer in the run_inference_worker process at this socket path or 'host:port'; None answers in each web process
+QA_INFERENCE_TIMEOUT = 60  # Seconds a web worker waits for the answers of the inference worker
+QA_INFERENCE_MAX_QUEUE = 64  # Pairs waiting in the inference worker past which new requests are refused as busy
+QA_INFERENCE_BATCH_WINDOW = 0.01  # Seconds the inference worker waits for more pairs to batch with the first one...
+QA_INFERENCE_MAX_BATCH = 32  # ...unless this many pairs are already waiting
+
+QA_WARM_ON_STARTUP = True  # Servers (wsgi.py, asgi.py) load every model at startup instead of on the first question
+
+INDEXING_WORKERS = 2  # Background threads running queued indexing jobs
+INDEXING_REFRESH_SECONDS = 300  # Questions re-scan their directory at most this often (the indexing API always does)
+INDEXING_EXTRACTION_WORKERS = None  # Processes extracting and analyzing files; None uses every core, 0 runs in-process
+INDEXING_MAX_PENDING_FILES = None  # Files in flight in the extraction pool; None is 4 per worker
+INDEXING_BULK_CHUNK_SIZE = 500  # Documents per Elasticsearch bulk request at first, then adapted...
+INDEXING_BULK_TARGET_SECONDS = 1.0  # ...so each request takes about this long...
+INDEXING_BULK_MAX_BYTES = 10 * 1024 ** 2  # ...without exceeding this payload
+INDEXING_BULK_MAX_RETRIES = 8  # Retries, with exponential backoff, of the documents a busy cluster rejects
+INDEXING_CHECKPOINT_FILES = 1000  # Indexed files recorded in the manifest at once, where interrupted runs resume
+INDEX_CORPUS_STATE_FILE = BASE_DIR / 'cache' / 'index_corpus.json'  # Index settings to restore after an index_corpus crash
+
+WATCHED_DIRECTORIES = []  # Kept indexed by the watch_directories command; questions about them queue no re-scan
+WATCH_DEBOUNCE_SECONDS = 2.0  # Quiet time before a burst of file changes is indexed...
+WATCH_MAX_DELAY_SECONDS = 30.0  # ...but changes never wait longer than this while more keep coming
+
+EXTRACTION_CACHE_DIR = BASE_DIR / 'cache' / 'extraction'  # Compressed passages keyed by file content hash
+EXTRACTION_CACHE_MAX_BYTES = 2 * 1024 ** 3  # Least recently used entries are evicted past this size
+EXTRACTION_MAX_FILE_BYTES = 512 * 1024 ** 2  # Larger files are not indexed; None for no limit
+EXTRACTION_MAX_PAGES = 5000  # PDF pages extracted per file, the rest is dropped with a warning; None for no limit
+EXTRACTION_MAX_CELLS = 1000000  # Spreadsheet cells extracted per file; None for no limit
+EXTRACTION_MAX_PASSAGES = 100000  # Passages extracted per file, whatever the format; None for no limit
+EXTRACTION_PDF_PAGES_PER_TASK = 100  # Larger PDFs are extracted in page ranges by several workers; None never splits
+
+RESULT_CACHE_BACKEND = 'memory'  # 'memory' (per process) or 'file' (RESULT_CACHE_DIR, shared by the host's processes)
+RESULT_CACHE_DIR = BASE_DIR / 'cache' / 'results'
+RESULT_CACHE_MAX_ENTRIES = 10000  # Least recently used entries are evicted past this count
+RESULT_CACHE_TTL = 24 * 60 * 60  # Seconds
+INDEX_GENERATION_DIR = BASE_DIR / 'cache' / 'index_generations'  # A marker per directory, replaced when it changes
+
+PASSAGE_CANDIDATES_PER_FILE = 50  # Matching passages of each retrieved file fetched for the BM25 pre-ranker
+PASSAGES_PER_FILE = 5  # Best ranked passages of each file given to the QA model...
+QA_CONTEXT_TOKEN_BUDGET = 1024  # ...as long as they fit in this many model tokens
+QA_MAX_SEQ_LEN = 384  # Model tokens per QA window
+QA_DOC_STRIDE = 128  # Overlap between consecutive QA windows
+
+DENSE_RETRIEVAL = False  # Also retrieve files and passages by sentence embedding, fused with the lexical rankings
+DENSE_MODEL_NAME = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'  # Cached with the QA models
+DENSE_BATCH_SIZE = 32  # Passages per encoder forward pass when indexing
+DENSE_INDEX_DIR = BASE_DIR / 'cache' / 'vectors'  # Memory-mapped passage vectors
+DENSE_DTYPE = 'float16'  # 'float16', or 'int8' (half the size, scaled per vector)
+DENSE_IVF_LISTS = None  # Cluster the vectors in this many lists and only scan the closest ones; None scans them all
+DENSE_IVF_PROBES = 8  # Lists scanned per question
+DENSE_CANDIDATES = 100  # Closest passages retrieved per question when searching the files
+DENSE_MIN_SIMILARITY = 0.3  # Cosine similarity below which a passage is not retrieved by embedding
+DENSE_FUSION_CANDIDATES = 20  # Files retrieved lexically per question before fusing with the dense ranking
+
+API_DEFAULT_TOP_K = 4  # Files searched per question by the batch question API
+API_MAX_TOP_K = 20
+API_DEFAULT_PAGE_SIZE = 50  # Questions answered per batch API request
+API_MAX_PAGE_SIZE = 200
+
+REQUEST_PROFILING = False  # Profile requests carrying a ?profile query parameter (see question_answer.middleware)
+
+
+# Logging
+# Structured (one JSON object per line) records of the requests, pipeline stages and indexing runs
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'question_answer.instrumentation.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'question_answer': {
+            'handlers': ['console'],
+            'level': 'INFO',  # DEBUG also logs every span
+            'propagate': False,
+        },
+    },
+}
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -5,6 +5,12 @@ from django.views.generic.base import RedirectView
 
 urlpatterns = [
     path('', views.search_question, name='ask_question'),
+    path('ask/stream/', views.stream_question, name='ask_question_stream'),
+    path('api/questions/', views.answer_questions, name='answer_questions'),
+    path('index/', views.enqueue_indexing, name='enqueue_indexing'),
+    path('index/status/', views.indexing_status, name='indexing_status'),
+    path('index/status/<str:job_id>/', views.indexing_status, name='indexing_job_status'),
+    path('metrics/', views.metrics_view, name='metrics'),
     # Add this URL pattern for the favicon
     path(
         "favicon.ico",
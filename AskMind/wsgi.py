@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AskMind.settings')
 
 application = get_wsgi_application()
+
+# Only server processes import this module: load the models before the first request
+from question_answer.apps import warm_models  # noqa: E402
+
+warm_models()
@@ -0,0 +1,215 @@
+"""
+Elasticsearch bulk indexing with an adaptive chunk size and retries.
+
+elasticsearch.helpers.parallel_bulk sends chunks of a fixed number of actions
+and only reports the rejected ones. bulk_index() instead:
+
+- sizes every chunk with a ChunkSizer, which grows the number of actions while
+  bulk requests stay well under `target_seconds`, shrinks it in proportion when
+  they take longer, halves it when the cluster rejects documents, and never lets
+  a chunk exceed `max_bytes` of payload;
+- retries the documents rejected by a busy cluster (HTTP 429) and the chunks of
+  failed requests (connection errors, 429, 502, 503, 504) with an exponential
+  backoff, up to `max_retries` times, before reporting them as failed;
+- keeps `thread_count` bulk requests in flight.
+"""
+import heapq
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+RETRYABLE_STATUSES = frozenset([429, 502, 503, 504])
+
+
+class ChunkSizer:
+    """Number of actions of the next bulk request, adapted to the response time and payload size of the last ones."""
+
+    def __init__(self, initial=500, minimum=50, maximum=10000, max_bytes=10 * 1024 ** 2, target_seconds=1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.size = max(minimum, min(maximum, initial))
+        self._lock = threading.Lock()
+
+    def observe(self, actions, payload_bytes, seconds, rejected):
+        """Adjust the chunk size after a bulk request of `actions` actions, of which `rejected` were refused."""
+        with self._lock:
+            if rejected:
+                size = self.size // 2
+            elif seconds > 1.5 * self.target_seconds:
+                size = int(self.size * self.target_seconds / seconds)
+            elif seconds < self.target_seconds / 2 and actions >= self.size:
+                size = int(self.size * 1.5)
+            else:
+                return
+
+            # A full chunk of actions this large would not fit in max_bytes anyway
+            if actions and payload_bytes:
+                size = min(size, int(self.max_bytes * actions / payload_bytes))
+
+            self.size = max(self.minimum, min(self.maximum, size))
+
+
+class BulkStats:
+    """Thread-safe counters of the actions, payload bytes, retries and failures sent by bulk_index()."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            self._counts.update(counts)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class _Entry:
+    # One action, serialized once, and the number of times it was sent
+    __slots__ = ("action", "lines", "size", "attempts")
+
+    def __init__(self, action):
+        action = dict(action)
+        op_type = action.pop("_op_type", "index")
+        header = {key.lstrip("_"): action.pop(key) for key in ("_index", "_id") if key in action}
+        source = action.pop("_source", action)
+        self.action = {"_op_type": op_type, "_index": header.get("index"), "_id": header.get("id")}
+        self.lines = [json.dumps({op_type: header})]
+
+        if op_type != "delete":
+            self.lines.append(json.dumps(source, ensure_ascii=False))
+
+        self.size = sum(len(line.encode("utf-8")) + 1 for line in self.lines)
+        self.attempts = 0
+
+
+def _client_errors():
+    # The request errors of the Elasticsearch client, none when it is not installed (e.g. a stand-in client)
+    try:
+        from elasticsearch import ApiError, TransportError
+    except ImportError:
+        return ()
+
+    return ApiError, TransportError
+
+
+def _send(es, entries):
+    # Send one bulk request; returns (per-entry outcome, seconds) with "ok", "retry" or an error
+    start_time = time.perf_counter()
+
+    try:
+        response = es.bulk(operations=[line for entry in entries for line in entry.lines])
+    except _client_errors() as e:
+        status = getattr(e, "status_code", None)
+        outcome = "retry" if status is None or status in RETRYABLE_STATUSES else str(e)
+        return [outcome] * len(entries), time.perf_counter() - start_time
+
+    outcomes = []
+
+    for entry, item in zip(entries, response["items"]):
+        result = item[entry.action["_op_type"]]
+        status = result.get("status", 500)
+
+        if status < 300 or (status == 404 and entry.action["_op_type"] == "delete"):
+            outcomes.append("ok")
+        elif status == 429:
+            outcomes.append("retry")
+        else:
+            outcomes.append(result.get("error") or f"HTTP {status}")
+
+    return outcomes, time.perf_counter() - start_time
+
+
+def bulk_index(es, actions, sizer=None, thread_count=4, max_retries=8, initial_backoff=1.0, max_backoff=60.0,
+               stats=None):
+    """
+    Send the actions (in the parallel_bulk format) to Elasticsearch, yielding (action, error) once each one
+    is stored, error being None, or failed for good.
+
+    The yielded action only keeps the "_op_type", "_index" and "_id" of the original one.
+    """
+    sizer = sizer or ChunkSizer()
+    stats = stats or BulkStats()
+    source = iter(actions)
+    exhausted = False
+    retries = []  # Heap of (due time, sequence number, entries) waiting for their backoff
+    sequence = itertools.count()
+    in_flight = {}
+
+    def next_chunk():
+        # Entries due for a retry go first, then fresh actions up to the chunk size or max_bytes
+        nonlocal exhausted
+
+        if retries and retries[0][0] <= time.monotonic():
+            return heapq.heappop(retries)[2]
+
+        chunk, payload_bytes = [], 0
+
+        while not exhausted and len(chunk) < sizer.size:
+            action = next(source, None)
+
+            if action is None:
+                exhausted = True
+                break
+
+            entry = _Entry(action)
+            chunk.append(entry)
+            payload_bytes += entry.size
+
+            if payload_bytes >= sizer.max_bytes:
+                break
+
+        return chunk
+
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        while True:
+            while len(in_flight) < thread_count:
+                chunk = next_chunk()
+
+                if not chunk:
+                    break
+
+                for entry in chunk:
+                    entry.attempts += 1
+
+                in_flight[executor.submit(_send, es, chunk)] = chunk
+
+            if not in_flight:
+                if exhausted and not retries:
+                    return
+
+                time.sleep(max(0.0, retries[0][0] - time.monotonic()) if retries else 0.01)
+                continue
+
+            timeout = max(0.0, retries[0][0] - time.monotonic()) if retries else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                chunk = in_flight.pop(future)
+                outcomes, seconds = future.result()
+                retry = [entry for entry, outcome in zip(chunk, outcomes) if outcome == "retry"]
+                payload_bytes = sum(entry.size for entry in chunk)
+                sizer.observe(len(chunk), payload_bytes, seconds, len(retry))
+                stats.add(requests=1, actions=len(chunk) - len(retry), bytes=payload_bytes, retries=len(retry))
+
+                for entry, outcome in zip(chunk, outcomes):
+                    if outcome == "ok":
+                        yield entry.action, None
+                    elif outcome != "retry":
+                        stats.add(failed=1)
+                        yield entry.action, outcome
+                    elif entry.attempts > max_retries:
+                        stats.add(failed=1)
+                        yield entry.action, f"Still rejected by Elasticsearch after {max_retries} retries"
+
+                retry = [entry for entry in retry if entry.attempts <= max_retries]
+
+                if retry:
+                    backoff = min(max_backoff, initial_backoff * 2 ** (retry[0].attempts - 1))
+                    heapq.heappush(retries, (time.monotonic() + backoff, next(sequence), retry))
@@ -1,4 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def warm_models():
+    """
+    Load every model up front when QA_WARM_ON_STARTUP is set.
+
+    Called by the server entrypoints (AskMind/wsgi.py and AskMind/asgi.py, which runserver
+    loads through WSGI_APPLICATION in its serving process) rather than from ready(), so
+    management commands, tests, scripts and shells never load the models they do not use.
+    """
+    if settings.QA_WARM_ON_STARTUP:
+        from .registry import registry
+        registry.warm()
 
 
 class QuestionAnswerConfig(AppConfig):
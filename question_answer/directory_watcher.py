@@ -0,0 +1,175 @@
+"""
+Filesystem watching for live incremental re-indexing (see the watch_directories command).
+
+watchdog reports the create, modify, move and delete events under the watched
+directories, through inotify on Linux. Saving or copying a single document emits
+a burst of events, so ChangeBatcher coalesces them per path and only releases a
+batch once the directories were quiet for `debounce` seconds, or `max_delay`
+seconds after its first event while changes keep coming.
+"""
+import os
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from .extractors import SUPPORTED_EXTENSIONS
+
+
+def _is_under(path, directory):
+    return path == directory or path.startswith(os.path.join(directory, ""))
+
+
+def _outermost(directories):
+    # Drop the directories nested in another one of the list, which already covers them
+    kept = []
+
+    for directory in sorted(directories):
+        if not kept or not _is_under(directory, kept[-1]):
+            kept.append(directory)
+
+    return kept
+
+
+class ChangeBatcher:
+    """
+    Debounces and coalesces the changed paths reported under a set of root directories.
+
+    Each path is attributed to the innermost root containing it. Changed files are
+    only kept when they have a supported extension; directories that were created,
+    moved or deleted as a whole are kept separately, since the events of their
+    content are not all reported (e.g. a directory moved in from outside).
+    """
+
+    def __init__(self, roots, debounce=2.0, max_delay=30.0):
+        self.roots = sorted((os.path.abspath(root) for root in roots), key=len, reverse=True)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._files = {}  # Root -> changed file paths
+        self._directories = {}  # Root -> changed directories
+        self._first_event = None
+        self._last_event = None
+        self._condition = threading.Condition()
+
+    def _root(self, path):
+        for root in self.roots:
+            if _is_under(path, root):
+                return root
+
+        return None
+
+    def _add(self, pending, path):
+        root = self._root(path)
+
+        if root is None:
+            return
+
+        now = time.monotonic()
+
+        with self._condition:
+            pending.setdefault(root, set()).add(path)
+
+            if self._first_event is None:
+                self._first_event = now
+
+            self._last_event = now
+            self._condition.notify()
+
+    def add_file(self, path):
+        if path.endswith(SUPPORTED_EXTENSIONS):
+            self._add(self._files, path)
+
+    def add_directory(self, path):
+        self._add(self._directories, path)
+
+    def wait(self, timeout=None):
+        """
+        Block until a batch is due and return it, or None when `timeout` seconds passed first.
+
+        Returns:
+            dict: Root directory -> (file_paths, directories). Files under one of the
+            directories are left out, since the directory is re-scanned as a whole.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait_time = None
+
+                if self._first_event is not None:
+                    due = min(self._last_event + self.debounce, self._first_event + self.max_delay)
+
+                    if now >= due:
+                        return self._take()
+
+                    wait_time = due - now
+
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+
+                    wait_time = deadline - now if wait_time is None else min(wait_time, deadline - now)
+
+                self._condition.wait(wait_time)
+
+    def _take(self):
+        # Return the pending changes and start a new batch; called with the condition held
+        batch = {}
+
+        for root in set(self._files) | set(self._directories):
+            directories = _outermost(self._directories.get(root, ()))
+            file_paths = sorted(
+                file_path for file_path in self._files.get(root, ())
+                if not any(_is_under(file_path, directory) for directory in directories)
+            )
+            batch[root] = (file_paths, directories)
+
+        self._files = {}
+        self._directories = {}
+        self._first_event = self._last_event = None
+        return batch
+
+
+class _EventHandler(FileSystemEventHandler):
+    # Feeds the watchdog events to a ChangeBatcher
+    EVENT_TYPES = ("created", "modified", "moved", "deleted")
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def on_any_event(self, event):
+        if event.event_type not in self.EVENT_TYPES:
+            return
+
+        paths = [event.src_path]
+
+        if event.event_type == "moved":
+            paths.append(event.dest_path)
+
+        for path in map(os.fsdecode, paths):
+            if not event.is_directory:
+                self.batcher.add_file(path)
+            elif event.event_type != "modified":
+                # A directory is "modified" whenever one of its entries changes, which is reported on its own
+                self.batcher.add_directory(path)
+
+
+class DirectoryWatcher:
+    """Watches the given root directories recursively and batches their changes in `batcher`."""
+
+    def __init__(self, roots, debounce=2.0, max_delay=30.0):
+        self.batcher = ChangeBatcher(roots, debounce, max_delay)
+        self._observer = Observer()
+        handler = _EventHandler(self.batcher)
+
+        for root in self.batcher.roots:
+            self._observer.schedule(handler, root, recursive=True)
+
+    def start(self):
+        self._observer.start()
+
+    def stop(self):
+        self._observer.stop()
+        self._observer.join()
@@ -1,355 +1,502 @@
+import logging
+import math
 import os
-import re
 import time
-import nltk
-import spacy
-from PyPDF2 import PdfReader
-from docx import Document
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import parallel_bulk
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer
-from nltk.tokenize import word_tokenize
-from openpyxl import load_workbook
-from pptx import Presentation
 
-class DocumentSearcher:
-    def __init__(self, data_directory):
-        self.config = {
-            "data_directory": data_directory,
-            "elasticsearch_host": "http://localhost:9200"
-        }
-        self.es = Elasticsearch(self.config["elasticsearch_host"])
-        self.nlp = spacy.load("fr_core_news_sm")
-        self._download_stopwords()
-        self._download_punkt()
+from .extraction_pipeline import ExtractionPipeline, analyze_file
+from .extractors import SUPPORTED_EXTENSIONS
+from .extraction_cache import ExtractionCache
+from .instrumentation import BULK_FAILURES, BYTES, FILES, PASSAGES, record_stage, span
+from .manifest import IndexManifest
+from .model_resources import ensure_nltk_data, nltk_packages
+from .passage_ranker import PassageRanker, reciprocal_rank_fusion
+from .search_backends import ElasticsearchBackend
+from .text_analyzer import EngineAnalyzer, TextAnalyzer
 
-    def _download_stopwords(self):
-        # Download French stopwords if not available
-        try:
-            stopwords.words("french")
-        except LookupError:
-            nltk.download('stopwords')
+logger = logging.getLogger(__name__)
 
-    def _download_punkt(self):
-        # Download Punkt tokenizer if not available
-        try:
-            nltk.data.find('tokenizers/punkt')
-        except LookupError:
-            nltk.download('punkt')
 
-    def preprocess_text(self, text):
-        # Clean the text by removing HTML tags and non-alphanumeric characters
-        clean_text = re.sub('<.*?>', '', text)
-        clean_text = re.sub('[^\w\s]', '', clean_text)
+class IndexingProgress:
+    """Receives per-file progress from collect_data; see indexing_jobs.IndexingJob."""
 
-        # Lemmatize the text using spaCy
-        doc = self.nlp(clean_text)
-        lemmatized_tokens = [token.lemma_ if token.lemma_ != "-PRON-" else token.text for token in doc]
+    def start(self, total):
+        pass
 
-        # Tokenize the lemmatized text and perform stemming
-        tokens = word_tokenize(" ".join(lemmatized_tokens))
-        stemmed_tokens = [SnowballStemmer("french").stem(token) for token in tokens]
+    def file_done(self, file_path):
+        pass
 
-        # Filter out stopwords from the stemmed tokens
-        filtered_tokens = [token for token in stemmed_tokens if token not in stopwords.words("french")]
-        processed_text = " ".join(filtered_tokens)
+    def file_failed(self, file_path, error):
+        logger.warning("Failed to index document %s: %s", file_path, error, extra={"file_path": file_path})
 
-        return processed_text
 
-    def _get_indexed_files(self):
-        # Retrieve the set of already indexed file paths from Elasticsearch
-        if not self.es.indices.exists(index="documents"):
-            return set()
+class _CountingProgress(IndexingProgress):
+    # Forwards the progress of collect_data while counting the indexed and failed files
+    def __init__(self, progress):
+        self.progress = progress
 
-        query = {
-            "query": {"match_all": {}},
-            "size": 10000  # Adjust the size to retrieve all indexed documents if necessary
-        }
+    def start(self, total):
+        self.progress.start(total)
 
-        response = self.es.search(index="documents", body=query)
-        hits = response["hits"]["hits"]
+    def file_done(self, file_path):
+        FILES.inc(outcome="indexed")
+        self.progress.file_done(file_path)
 
-        indexed_files = set()
+    def file_failed(self, file_path, error):
+        FILES.inc(outcome="failed")
+        self.progress.file_failed(file_path, error)
 
-        for hit in hits:
-            source = hit["_source"]
-            indexed_files.add(source["file_path"])
 
-        return indexed_files
+class _ManifestCheckpoint(IndexingProgress):
+    # Forwards the progress of an indexing run while recording the indexed files in the manifest every `every`
+    # files, so a run that is interrupted resumes after its last checkpoint instead of from the start
+    def __init__(self, progress, manifest, files, every):
+        self.progress = progress
+        self.manifest = manifest
+        self.files = files  # Path -> (file_path, size, mtime, content_hash)
+        self.every = every
+        self.pending = []
 
-    def collect_data(self):
-        # Collect and index the data from the specified directory
-        file_paths = self._get_file_paths(self.config["data_directory"])
-        indexed_files = self._get_indexed_files()
+    def start(self, total):
+        self.progress.start(total)
 
-        documents = self._generate_documents(file_paths, indexed_files)
+    def file_done(self, file_path):
+        self.pending.append(self.files[file_path])
 
-        start_time = time.time()  # Start measuring the processing time
-
-        self.index_documents(documents)
-        end_time = time.time()  # Stop measuring the processing time
-        processing_time = end_time - start_time
+        if len(self.pending) >= self.every:
+            self.flush()
 
-        if processing_time > 0:
-            message = f"Indexing completed. Total time: {processing_time:.2f} seconds."
-        else:
-            message = "No documents were indexed."
+        self.progress.file_done(file_path)
 
-        return message, processing_time
+    def file_failed(self, file_path, error):
+        self.progress.file_failed(file_path, error)
 
-    def _get_file_paths(self, directory):
-        # Recursively retrieve all file paths within the specified directory
-        file_paths = []
+    def flush(self):
+        if self.pending:
+            self.manifest.record(self.pending)
+            BYTES.inc(sum(size for _, size, _, _ in self.pending))
+            self.pending = []
 
-        for root, _, files in os.walk(directory):
-            for file in files:
-                file_paths.append(os.path.join(root, file))
 
-        return file_paths
+class DocumentSearcher:
+    # Below this many changed files, update_paths() extracts in-process: starting the worker pool,
+    # where every process loads its own spaCy model, costs more than extracting a few files
+    IN_PROCESS_MAX_FILES = 8
+
+    def __init__(self, data_directory, search_backend=None, es=None, nlp=None, analyzer=None, extraction_cache=None,
+                 result_cache=None, passage_ranker=None, spacy_model="fr_core_news_sm", extraction_workers=None,
+                 extraction_max_pending=None, pdf_pages_per_task=None, bulk_chunk_size=500, passage_candidates=50,
+                 text_analysis="engine", vector_index=None, encoder=None, dense_candidates=100,
+                 dense_min_similarity=0.3, fusion_candidates=20, checkpoint_files=1000):
+        # The search backend (or just its Elasticsearch client), spaCy model, analyzer and extraction cache
+        # can be shared between searchers (see registry.py); only build our own when none were provided.
+        # The result cache, when given, is told about every change of the index.
+        # text_analysis is "engine" to index the raw text and let the search backend analyze it, or "python"
+        # to analyze it with spaCy and NLTK first (see text_analyzer.py).
+        # Dense retrieval is enabled by giving both a vector index and a sentence encoder: passages are then
+        # embedded when they are indexed, and searches fuse the lexical and embedding rankings.
+        self.config = {
+            "data_directory": data_directory,
+            "elasticsearch_host": "http://localhost:9200",
+            "extraction_cache_directory": os.path.join("cache", "extraction"),
+            "extraction_cache_max_bytes": 2 * 1024 ** 3,
+            "spacy_model": spacy_model,
+            "extraction_workers": extraction_workers,  # None uses every core, 0 extracts in-process
+            "extraction_max_pending": extraction_max_pending,
+            "pdf_pages_per_task": pdf_pages_per_task,  # Larger PDFs are extracted in page ranges, None never splits
+            "bulk_chunk_size": bulk_chunk_size,
+            "passage_candidates": passage_candidates,  # Passages of each file fetched for the passage ranker
+            "text_analysis": text_analysis,
+            "dense_candidates": dense_candidates,  # Passages retrieved by embedding when searching the files
+            "dense_min_similarity": dense_min_similarity,  # Less similar passages are not retrieved by embedding
+            "fusion_candidates": fusion_candidates,  # Files retrieved lexically before fusing with the dense ranking
+            "checkpoint_files": checkpoint_files  # Indexed files recorded in the manifest at once during a run
+        }
+        if search_backend is None:
+            from elasticsearch import Elasticsearch
 
-    def _extract_text_from_docx(self, file_path):
-        # Extract text content from a DOCX file
-        doc = Document(file_path)
-        text = ""
-
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-
-        return text.strip()
-
-    def _extract_text_from_xlsx(self, file_path):
-        # Extract text content from an XLSX file
-        wb = load_workbook(filename=file_path, read_only=True)
-        text = ""
-
-        for sheet in wb.sheetnames:
-            ws = wb[sheet]
-
-            for row in ws.iter_rows(values_only=True):
-                for cell in row:
-                    if cell:
-                        text += str(cell) + "\n"
-
-        return text.strip()
-
-    def _extract_text_from_pptx(self, file_path):
-        # Extract text content from a PPTX file
-        prs = Presentation(file_path)
-        text = ""
-
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + "\n"
-
-        return text.strip()
-
-    def _extract_text_from_pdf(self, file_path):
-        # Extract text content from a PDF file
-        with open(file_path, "rb") as file:
-            pdf = PdfReader(file)
-            text = ""
-
-            for page in pdf.pages:
-                text += page.extract_text()
-
-        return text.strip()
-
-    def _generate_documents(self, file_paths, indexed_files):
-        # Generate documents from file paths by extracting their text content
-        for file_path in file_paths:
-            if file_path not in indexed_files:
-                if file_path.endswith(".docx"):
-                    document = self._extract_text_from_docx(file_path)
-                    yield (file_path, document)
-                elif file_path.endswith(".xlsx"):
-                    document = self._extract_text_from_xlsx(file_path)
-                    yield (file_path, document)
-                elif file_path.endswith(".pptx"):
-                    document = self._extract_text_from_pptx(file_path)
-                    yield (file_path, document)
-                elif file_path.endswith(".pdf"):
-                    document = self._extract_text_from_pdf(file_path)
-                    yield (file_path, document)
-                else:
-                    print(f"Unsupported file format: {file_path}")
-            else:
-                print(f"Skipping already indexed file: {file_path}")
-
-    def index_documents(self, documents):
-        # Index the extracted documents in Elasticsearch
-        actions = [
-            {
-                "_op_type": "index",
-                "_index": "documents",
-                "_id": i,
-                "_source": {
-                    "file_path": file_path,
-                    "processed_text": self.preprocess_text(text)
-                }
-            }
-            for i, (file_path, text) in enumerate(documents)
-        ]
-
-        for success, info in parallel_bulk(self.es, actions, index="documents"):
-            if not success:
-                print(f"Failed to index document: {info}")
+            search_backend = ElasticsearchBackend(
+                es if es is not None else Elasticsearch(self.config["elasticsearch_host"]),
+                chunk_size=self.config["bulk_chunk_size"], text_analysis=text_analysis)
+        self.search_backend = search_backend
 
-    def preprocess_query(self, query):
-        # Preprocess the query by tokenizing, stemming, and filtering out stopwords
-        tokens = word_tokenize(query)
-        stemmed_tokens = [SnowballStemmer("french").stem(token) for token in tokens]
-        filtered_tokens = [token for token in stemmed_tokens if token not in stopwords.words("french")]
-        processed_query = " ".join(filtered_tokens)
-        return processed_query
-
-    def search_files(self, query):
-        # Search for files matching the processed query in Elasticsearch
-        search_query = {
-            "query": {
-                "match": {
-                    "processed_text": query
-                }
-            },
-            "size": 4,  # Adjust the size to retrieve the desired number of results
-            "sort": [
-                {
-                    "_score": {
-                        "order": "desc"  # Sort by descending score to get the most relevant results first
-                    }
-                }
-            ]
-        }
+        if analyzer is None:
+            ensure_nltk_data(nltk_packages(text_analysis))
 
-        response = self.es.search(index="documents", body=search_query)
+            if text_analysis == "engine":
+                analyzer = EngineAnalyzer()
+            else:
+                if nlp is None:
+                    import spacy
+
+                    nlp = spacy.load(self.config["spacy_model"])
+                analyzer = TextAnalyzer(nlp)
+        self.nlp = nlp
+        self.analyzer = analyzer
+        self.extraction_cache = extraction_cache if extraction_cache is not None else ExtractionCache(
+            self.config["extraction_cache_directory"], self.config["extraction_cache_max_bytes"])
+        self.result_cache = result_cache
+        self.passage_ranker = passage_ranker if passage_ranker is not None else PassageRanker()
+        self.vector_index = vector_index
+        self.encoder = encoder
+
+    @property
+    def dense_retrieval(self):
+        return self.vector_index is not None and self.encoder is not None
 
-        hits = response["hits"]["hits"]
-        results = []
+    def preprocess_text(self, text):
+        # Clean, lemmatize, stem and filter the stopwords of the given text
+        return self.analyzer.preprocess_text(text)
 
-        for hit in hits:
-            source = hit["_source"]
-            result = {
-                "file_path": source["file_path"],
-                "score": hit["_score"]
-            }
-            results.append(result)
+    def _get_indexed_files(self):
+        # Load the indexing manifest of the data directory (path -> size, mtime and content hash)
+        return IndexManifest(self.config["data_directory"])
+
+    def _check_data_directory(self):
+        # os.walk() yields nothing for a missing or unmounted directory: scanning it would purge all its files
+        if not os.path.isdir(self.config["data_directory"]):
+            raise FileNotFoundError(f"{self.config['data_directory']} is not an existing directory: its indexed "
+                                    f"files were left alone.")
+
+    def collect_data(self, progress=None):
+        # Collect and index the new or changed files of the specified directory, and purge the deleted ones
+        self._check_data_directory()
+        progress = _CountingProgress(progress or IndexingProgress())
+        start_time = time.time()  # Start measuring the processing time
 
-        return results
+        with span("walk", directory=self.config["data_directory"]):
+            file_paths = [
+                file_path for file_path in self._get_file_paths(self.config["data_directory"])
+                if file_path.endswith(SUPPORTED_EXTENSIONS)
+            ]
+            manifest = self._get_indexed_files()
+            changed, deleted = manifest.scan(file_paths)
 
-    def paragraphs_containing_answer(self, file_path, query):
-        # Returns the paragraphs, cells, shapes, or pages that contain the answer to the query in the given file, along with the processing time as a tuple of (matching_content, processing_time)
+        return self._apply_changes(manifest, changed, deleted, progress, start_time)
 
-        try:
-            processed_query = self.preprocess_query(query)
-            processed_query_tokens = processed_query.split()  # Split the processed query into tokens
+    def update_paths(self, file_paths=(), directories=(), progress=None):
+        # Index or purge only the given files, and every file under the given directories (created, moved or
+        # deleted as a whole), instead of walking the whole data directory; see the watch_directories command
+        self._check_data_directory()
+        progress = _CountingProgress(progress or IndexingProgress())
+        start_time = time.time()  # Start measuring the processing time
+        file_paths = list(file_paths)
+        directories = list(directories)
+
+        with span("walk", directory=self.config["data_directory"], files=len(file_paths),
+                  directories=len(directories)):
+            existing = [
+                file_path for file_path in file_paths
+                if file_path.endswith(SUPPORTED_EXTENSIONS) and os.path.isfile(file_path)
+            ]
 
-            if file_path.endswith(".docx"):
-                # Search for paragraphs containing the answer in a DOCX file
-                doc = Document(file_path)
-                matching_paragraphs = []
-                max_matching_tokens = 0  # Variable to keep track of the maximum number of matching tokens
+            for directory in directories:
+                existing.extend(file_path for file_path in self._get_file_paths(directory)
+                                if file_path.endswith(SUPPORTED_EXTENSIONS))
 
-                start_time = time.time()  # Start measuring the processing time
+            manifest = IndexManifest(self.config["data_directory"], file_paths=file_paths,
+                                     subdirectories=directories)
+            changed, deleted = manifest.scan(dict.fromkeys(existing))
 
-                for paragraph in doc.paragraphs:
-                    processed_text = self.preprocess_text(paragraph.text.lower())  # Convert processed text to lowercase
-                    processed_text_tokens = processed_text.split()  # Split the processed text into tokens
+        return self._apply_changes(manifest, changed, deleted, progress, start_time,
+                                   in_process=len(changed) < self.IN_PROCESS_MAX_FILES)
 
-                    # Find the number of query tokens present in the paragraph
-                    num_matching_tokens = sum(token in processed_text_tokens for token in processed_query_tokens)
+    def _apply_changes(self, manifest, changed, deleted, progress, start_time, in_process=False):
+        # Index the (file_path, size, mtime, content_hash) changed files, purge the deleted ones and
+        # return (message, processing_time)
+        progress.start(len(changed))
 
-                    if num_matching_tokens > max_matching_tokens:
-                        max_matching_tokens = num_matching_tokens
-                        matching_paragraphs = [paragraph.text]
-                    elif num_matching_tokens == max_matching_tokens:
-                        matching_paragraphs.append(paragraph.text)
+        if deleted:
+            self.delete_documents(deleted)
+            manifest.forget(deleted)
+            FILES.inc(len(deleted), outcome="deleted")
 
-                end_time = time.time()  # Stop measuring the processing time
-                processing_time = end_time - start_time
+        if changed:
+            files = {file_path: (file_path, size, mtime, file_hash) for file_path, size, mtime, file_hash in changed}
 
-                matching_paragraphs_str = "\n\n-------------------------\n\n".join(matching_paragraphs)
-                return matching_paragraphs_str, processing_time
+            # A modified file may now have fewer passages, so drop the old ones before re-indexing it
+            self.delete_passages(file_path for file_path in files if file_path in manifest.entries)
 
-            elif file_path.endswith(".xlsx"):
-                # Search for cells containing the answer in an XLSX file
-                wb = load_workbook(filename=file_path, read_only=True)
-                matching_cells = []
+            checkpoint = _ManifestCheckpoint(progress, manifest, files, self.config["checkpoint_files"])
+            documents = self._generate_documents(
+                [(file_path, file_hash) for file_path, _, _, file_hash in changed], checkpoint, in_process)
 
-                start_time = time.time()
+            try:
+                self.index_documents(documents, checkpoint)
+            finally:
+                checkpoint.flush()  # Keep what was indexed before a failure
 
-                for sheet in wb.sheetnames:
-                    ws = wb[sheet]
+        if (changed or deleted) and self.dense_retrieval:
+            with span("vector_maintenance"):
+                self.vector_index.maintain()
 
-                    for row in ws.iter_rows(values_only=True):
-                        for cell in row:
-                            if cell:
-                                processed_text = self.preprocess_text(str(cell).lower())
-                                processed_text_tokens = processed_text.split()
+        if (changed or deleted) and self.result_cache is not None:
+            self.result_cache.index_changed([file_path for file_path, _, _, _ in changed] + list(deleted))
 
-                                num_matching_tokens = sum(
-                                    token in processed_text_tokens for token in processed_query_tokens)
+        end_time = time.time()  # Stop measuring the processing time
+        processing_time = end_time - start_time
 
-                                if num_matching_tokens > 0:
-                                    matching_cells.append(str(cell))
+        if changed or deleted:
+            message = (f"Indexing completed: {len(changed)} new or changed, {len(deleted)} removed. "
+                       f"Total time: {processing_time:.2f} seconds.")
+        else:
+            message = "No documents were indexed."
 
-                end_time = time.time()
-                processing_time = end_time - start_time
+        return message, processing_time
 
-                matching_cells_str = "\n\n-------------------------\n\n".join(matching_cells)
-                return matching_cells_str, processing_time
+    def _get_file_paths(self, directory):
+        # Recursively retrieve all file paths within the specified directory
+        file_paths = []
 
-            elif file_path.endswith(".pptx"):
-                # Search for shapes containing the answer in a PPTX file
-                prs = Presentation(file_path)
-                matching_shapes = []
+        for root, _, files in os.walk(directory):
+            for file in files:
+                file_paths.append(os.path.join(root, file))
 
-                start_time = time.time()
+        return file_paths
 
-                for slide in prs.slides:
-                    for shape in slide.shapes:
-                        if hasattr(shape, "text"):
-                            processed_text = self.preprocess_text(shape.text.lower())
-                            processed_text_tokens = processed_text.split()
+    def _generate_documents(self, files, progress=None, in_process=False):
+        # Generate (file_path, processed_text, passages) documents by extracting and analyzing the
+        # (file_path, content_hash) files, reporting the files that could not be read instead of aborting the run
+        progress = progress or IndexingProgress()
+
+        if in_process or self.config["extraction_workers"] == 0:
+            # In-process extraction, for debugging and small updates
+            for file_path, file_hash in files:
+                timings = {}
+
+                try:
+                    document = analyze_file(self.analyzer, self.extraction_cache, file_path, file_hash, timings)
+                except Exception as e:
+                    progress.file_failed(file_path, e)
+                    continue
+
+                for stage, duration in timings.items():
+                    record_stage(stage, duration)
+
+                yield document
+            return
+
+        # Without a spaCy model, the workers only extract the text
+        spacy_model = self.config["spacy_model"] if self.config["text_analysis"] == "python" else None
+        pipeline = ExtractionPipeline(spacy_model, self.extraction_cache,
+                                      workers=self.config["extraction_workers"],
+                                      max_pending=self.config["extraction_max_pending"],
+                                      pdf_pages_per_task=self.config["pdf_pages_per_task"])
+        yield from pipeline.run(files, progress)
+
+    def index_documents(self, documents, progress=None):
+        # Store the (file_path, processed_text, passages) documents in the search backend and return the paths
+        # that were indexed successfully. Documents are consumed lazily, so only a few are held in memory.
+        progress = progress or IndexingProgress()
+        indexed = []
+        waiting = 0.0  # Seconds spent waiting for the next document to be extracted, analyzed (and embedded)
+        vectors = {}  # File paths -> (positions, texts, vectors) embedded, stored once the file is indexed
+
+        if self.dense_retrieval:
+            documents = self._embed_documents(documents, vectors)
+
+        def timed_documents():
+            nonlocal waiting
+            iterator = iter(documents)
+
+            while True:
+                wait_start = time.perf_counter()
+                document = next(iterator, None)
+                waiting += time.perf_counter() - wait_start
+
+                if document is None:
+                    return
+
+                PASSAGES.inc(len(document[2]))
+                yield document
+
+        start_time = time.perf_counter()
+
+        for file_path, error in self.search_backend.index(timed_documents()):
+            file_vectors = vectors.pop(file_path, None)
+
+            if error is not None:
+                BULK_FAILURES.inc()
+                progress.file_failed(file_path, error)
+            else:
+                if file_vectors is not None:
+                    self.vector_index.add(file_path, *file_vectors)
+
+                indexed.append(file_path)
+                progress.file_done(file_path)
+
+        # The backend overlaps its writes with the extraction, so "bulk" is the part of the run not spent waiting
+        record_stage("bulk", max(0.0, time.perf_counter() - start_time - waiting))
+        return indexed
+
+    def _embed_documents(self, documents, vectors):
+        # Embed the passages of the documents before passing them on, the passages of consecutive small documents
+        # together so the encoder runs full batches. Their vectors are left in `vectors` for index_documents()
+        # to store once the search backend has indexed the file.
+        batch = []
+        passages = 0
+
+        for document in documents:
+            batch.append(document)
+            passages += len(document[2])
+
+            if passages >= self.encoder.batch_size:
+                self._embed_batch(batch, vectors)
+                yield from batch
+                batch = []
+                passages = 0
+
+        if batch:
+            self._embed_batch(batch, vectors)
+            yield from batch
+
+    def _embed_batch(self, documents, vectors):
+        # Embed the passages of the (file_path, processed_text, passages) documents into
+        # vectors[file_path] = (positions, texts, vectors)
+        with span("embed", documents=len(documents)):
+            embeddings = self.encoder.encode(passage.text for _, _, passages in documents for passage, _ in passages)
+
+        offset = 0
+
+        for file_path, _, passages in documents:
+            vectors[file_path] = ([passage.position for passage, _ in passages],
+                                  [passage.text for passage, _ in passages], embeddings[offset:offset + len(passages)])
+            offset += len(passages)
+
+    def recreate_index(self):
+        # Rebuild empty indices with the current settings (e.g. another TEXT_ANALYSIS mode) and forget every
+        # indexed file. The indices are shared by all the directories, so the returned paths of every directory
+        # must be indexed again.
+        self.search_backend.recreate_indices()
+        file_paths = IndexManifest.clear()
+
+        if self.vector_index is not None:
+            self.vector_index.delete(file_paths)
+
+        if self.result_cache is not None:
+            self.result_cache.index_changed()
 
-                            num_matching_tokens = sum(
-                                token in processed_text_tokens for token in processed_query_tokens)
+        return file_paths
 
-                            if num_matching_tokens > 0:
-                                matching_shapes.append(shape.text)
+    def delete_documents(self, file_paths):
+        # Remove the documents and passages of the given file paths from the search backend (and their vectors)
+        file_paths = list(file_paths)
+        self.search_backend.delete(file_paths)
 
-                end_time = time.time()
-                processing_time = end_time - start_time
+        if self.vector_index is not None:
+            self.vector_index.delete(file_paths)
 
-                matching_shapes_str = "\n\n-------------------------\n\n".join(matching_shapes)
-                return matching_shapes_str, processing_time
+    def delete_passages(self, file_paths):
+        # Remove the passages of the given file paths from the search backend (and their vectors)
+        file_paths = list(file_paths)
+        self.search_backend.delete_passages(file_paths)
 
-            elif file_path.endswith(".pdf"):
-                # Search for pages containing the answer in a PDF file
-                with open(file_path, "rb") as file:
-                    pdf = PdfReader(file)
-                    matching_pages = []
+        if self.vector_index is not None:
+            self.vector_index.delete(file_paths)
 
-                    start_time = time.time()
+    def preprocess_query(self, query):
+        # Preprocess the query by tokenizing, stemming, and filtering out stopwords
+        return self.analyzer.preprocess_query(query)
+
+    def search_files(self, query, size=4, filters=None, question=None):
+        # Search for the `size` files matching the processed query in the search backend, most relevant first,
+        # optionally restricted to a "directory" and to a list of "extensions". With dense retrieval, the files
+        # whose passages are closest to the embedding of the raw `question` are fused in.
+        if question is None or not self.dense_retrieval:
+            with span("search"):
+                return self.search_backend.search(query, size=size, filters=filters)
+
+        with span("search"):
+            files = self.search_backend.search(query, size=max(size, self.config["fusion_candidates"]),
+                                               filters=filters)
+
+        return self._fuse_files(files, question, size, filters)
+
+    def search_files_many(self, queries, size=4, filters=None, questions=None):
+        # Search the files matching each of the processed queries, in a single round trip when possible
+        if questions is None or not self.dense_retrieval:
+            with span("search", queries=len(queries)):
+                return self.search_backend.search_many(queries, size=size, filters=filters)
+
+        with span("search", queries=len(queries)):
+            results = self.search_backend.search_many(queries, size=max(size, self.config["fusion_candidates"]),
+                                                      filters=filters)
+
+        return [self._fuse_files(files, question, size, filters) for files, question in zip(results, questions)]
+
+    def _fuse_files(self, files, question, size, filters):
+        # Fuse the lexical ranking of the files with the ranking of their best passages by embedding similarity
+        with span("dense_search"):
+            hits = self.vector_index.search(self.encoder.encode_query(question), self.config["dense_candidates"],
+                                            filters=filters)
+
+        similarities = {}
+
+        for file_path, _, _, score in hits:  # Best first, so each file keeps the score of its best passage
+            if score < self.config["dense_min_similarity"]:
+                break
+
+            if file_path not in similarities:
+                similarities[file_path] = score
+
+        lexical = {file["file_path"]: file["score"] for file in files}
+        file_paths = list(dict.fromkeys(list(lexical) + list(similarities)))
+        scores = reciprocal_rank_fusion([[lexical.get(file_path, math.nan) for file_path in file_paths],
+                                         [similarities.get(file_path, math.nan) for file_path in file_paths]])
+        best = sorted(range(len(file_paths)), key=lambda i: -scores[i])[:size]
+        return [{"file_path": file_paths[i], "score": float(scores[i])} for i in best]
+
+    def _add_dense_passages(self, file_path, query, passages, processed_passages):
+        # Add the passages of the file closest to the query embedding to the lexical candidates, and return
+        # (passages, processed_passages, similarities) with NaN for the passages found lexically only
+        with span("dense_search"):
+            hits = self.vector_index.search(self.encoder.encode_query(query), self.config["passage_candidates"],
+                                            file_path=file_path)
+
+        similarities = {text: score for _, _, text, score in hits if score >= self.config["dense_min_similarity"]}
+        known = set(passages)
+        added = [text for text in similarities if text not in known]
+        passages = passages + added
+        processed_passages = processed_passages + self.analyzer.analyze_batch(added)
+        return passages, processed_passages, [similarities.get(text, math.nan) for text in passages]
+
+    def passages_containing_answer(self, file_path, query):
+        # Returns the passages of the given file that best match the query, most relevant first and within the
+        # token budget of the passage ranker, along with the processing time as a tuple of (passages, processing_time)
+        start_time = time.time()  # Start measuring the processing time
 
-                    for page in pdf.pages:
-                        processed_text = self.preprocess_text(page.extract_text().lower())
-                        processed_text_tokens = processed_text.split()
+        with span("passage_match"):
+            processed_query = self.preprocess_query(query)
+            hits = self.search_backend.search_passages(file_path, processed_query, self.config["passage_candidates"])
+
+            if hits:
+                passages = [text for text, _ in hits]
+                processed_passages = [processed_text for _, processed_text in hits]
+            elif not self.search_backend.has_passages(file_path):
+                # The file was indexed without its passages: rank them from the extraction cache instead
+                passages = [passage.text for passage in self.extraction_cache.passages(file_path)]
+                processed_passages = self.analyzer.analyze_batch(passages)
+            else:
+                passages = processed_passages = []
 
-                        num_matching_tokens = sum(
-                            token in processed_text_tokens for token in processed_query_tokens)
+            similarities = None
 
-                        if num_matching_tokens > 0:
-                            matching_pages.append(page.extract_text())
+            if self.dense_retrieval:
+                passages, processed_passages, similarities = self._add_dense_passages(
+                    file_path, query, passages, processed_passages)
 
-                    end_time = time.time()
-                    processing_time = end_time - start_time
+            # Raw texts (with TEXT_ANALYSIS = 'engine') are only analyzed for the ranker, and only these few
+            passages = self.passage_ranker.select(self.analyzer.ranking_text(processed_query).split(), passages,
+                                                  [self.analyzer.ranking_text(text) for text in processed_passages],
+                                                  dense_scores=similarities)
 
-                    matching_pages_str = "\n\n-------------------------\n\n".join(matching_pages)
-                    return matching_pages_str, processing_time
+        end_time = time.time()  # Stop measuring the processing time
+        return passages, end_time - start_time
 
-            else:
-                return "Unsupported file format.", None
+    def paragraphs_containing_answer(self, file_path, query):
+        # Returns the paragraphs, cells, shapes, or pages that contain the answer to the query in the given file, along with the processing time as a tuple of (matching_content, processing_time)
+        try:
+            passages, processing_time = self.passages_containing_answer(file_path, query)
+            return "\n\n-------------------------\n\n".join(passages), processing_time
 
         except Exception as e:
             return str(e), None
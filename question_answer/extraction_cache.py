@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+
+from .extractors import EXTRACTOR_VERSION, NO_LIMITS, Passage, extract_passages
+from .utils import content_hash as file_content_hash
+
+
+class ExtractionCache:
+    """
+    Persistent, compressed cache of the passages extracted from files.
+
+    Entries are keyed by the content hash of the file and EXTRACTOR_VERSION, so a
+    file is parsed at most once per extractor version wherever it lives, and
+    bumping the version invalidates every entry. Each entry stores the text of the
+    file once, plus the kind, location and (start, end) offsets of its passages.
+    Files are extracted within `limits` (an ExtractionLimits), which are part of
+    the key when set, since they change what is extracted.
+
+    When the cache grows past `max_bytes`, the least recently used entries (by
+    modification time, refreshed on every hit) are evicted.
+    """
+
+    SUFFIX = ".json.z"
+
+    def __init__(self, directory, max_bytes, limits=NO_LIMITS):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.limits = limits
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None  # Measured on the first write, so read-only users never walk the cache
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _key(self, content_hash):
+        key = f"{content_hash}:{EXTRACTOR_VERSION}"
+
+        if self.limits != NO_LIMITS:
+            key += f":{tuple(self.limits)}"
+
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.SUFFIX)
+
+    def _entries(self):
+        # Yield (path, size, mtime) for every cache entry
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(self.SUFFIX):
+                    path = os.path.join(root, file)
+
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+
+                    yield path, stat.st_size, stat.st_mtime
+
+    def count(self, hit):
+        # Record a lookup made on our behalf, e.g. by an extraction worker process
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def contains(self, content_hash):
+        """Check whether the passages of the content with the given hash are cached, without reading them."""
+        return os.path.exists(self._path(self._key(content_hash)))
+
+    def get(self, content_hash):
+        """Return the cached passages of the content with the given hash, or None."""
+        path = self._path(self._key(content_hash))
+
+        try:
+            with open(path, "rb") as file:
+                entry = json.loads(zlib.decompress(file.read()))
+            os.utime(path)  # Mark the entry as recently used
+        except (OSError, ValueError, zlib.error):
+            return None
+
+        text = entry["text"]
+        return [
+            Passage(kind, position, location, text[start:end])
+            for position, (kind, location, start, end) in enumerate(entry["passages"])
+        ]
+
+    def put(self, content_hash, passages):
+        """Store the passages of the content with the given hash."""
+        parts = []
+        offsets = []
+        start = 0
+
+        for passage in passages:
+            end = start + len(passage.text)
+            parts.append(passage.text)
+            offsets.append((passage.kind, passage.location, start, end))
+            start = end + 1  # Passages are separated by a newline
+
+        data = zlib.compress(json.dumps({"text": "\n".join(parts), "passages": offsets}).encode("utf-8"))
+        path = self._path(self._key(content_hash))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data)
+
+            over_budget = self._size > self.max_bytes
+
+        if over_budget:
+            self.evict()
+
+    def passages(self, file_path, content_hash=None):
+        """
+        Return the passages of a file, from the cache when possible.
+
+        Args:
+            file_path (str): The file to extract.
+            content_hash (str): The content hash of the file, computed when not given.
+
+        Returns:
+            list: The Passage tuples of the file.
+        """
+        content_hash = content_hash or file_content_hash(file_path)
+        passages = self.get(content_hash)
+        self.count(passages is not None)
+
+        if passages is None:
+            passages = list(extract_passages(file_path, self.limits))
+            self.put(content_hash, passages)
+
+        return passages
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is back under 90% of max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target = self.max_bytes * 0.9
+
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            size -= entry_size
+
+        with self._lock:
+            self._size = size
+
+    def stats(self):
+        """Return the hit/miss counters and the current size of the cache."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._size}
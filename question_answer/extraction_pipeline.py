@@ -0,0 +1,204 @@
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .extraction_cache import ExtractionCache
+from .extractors import (ExtractionLimits, check_file_size, count_pdf_pages, extract_passages_from_pdf,
+                         truncate_passages)
+from .instrumentation import record_stage
+from .text_analyzer import EngineAnalyzer, TextAnalyzer
+
+logger = logging.getLogger(__name__)
+
+# Analyzer and extraction cache of the current worker process, built once by _init_worker
+_analyzer = None
+_cache = None
+
+
+def _init_worker(spacy_model, cache_directory, cache_max_bytes, limits):
+    # Without a spaCy model the text is left for the search backend to analyze (TEXT_ANALYSIS = 'engine')
+    global _analyzer, _cache
+
+    if spacy_model:
+        import spacy
+
+        _analyzer = TextAnalyzer(spacy.load(spacy_model))
+    else:
+        _analyzer = EngineAnalyzer()
+
+    _cache = ExtractionCache(cache_directory, cache_max_bytes, ExtractionLimits(*limits))
+
+
+def analyze_file(analyzer, cache, file_path, content_hash=None, timings=None):
+    """
+    Extract (through the extraction cache) and analyze the passages of a file.
+
+    When a `timings` dictionary is given, the seconds spent extracting and analyzing
+    are stored in it under "extract" and "analyze".
+
+    Returns:
+        tuple: (file_path, processed_text, [(passage, processed_passage), ...]), where
+        processed_text is the analyzed text of the whole file.
+    """
+    start_time = time.perf_counter()
+    passages = cache.passages(file_path, content_hash)
+    extracted_time = time.perf_counter()
+    processed_passages = analyzer.analyze_batch(passage.text for passage in passages)
+
+    if timings is not None:
+        timings["extract"] = extracted_time - start_time
+        timings["analyze"] = time.perf_counter() - extracted_time
+
+    return file_path, " ".join(processed_passages), list(zip(passages, processed_passages))
+
+
+def _process_file(file_path, content_hash):
+    # Extract and analyze one file inside a worker process, reporting whether the cache was hit
+    # and the time spent in each stage, since the metrics of the worker are not collected
+    hits = _cache.hits
+    timings = {}
+    result = analyze_file(_analyzer, _cache, file_path, content_hash, timings)
+    return result, _cache.hits > hits, timings
+
+
+def _process_pages(file_path, start, stop):
+    # Extract and analyze the [start, stop) pages of a large PDF inside a worker process
+    start_time = time.perf_counter()
+    passages = list(extract_passages_from_pdf(file_path, page_range=(start, stop)))
+    extracted_time = time.perf_counter()
+    processed_passages = _analyzer.analyze_batch(passage.text for passage in passages)
+    timings = {"extract": extracted_time - start_time, "analyze": time.perf_counter() - extracted_time}
+    return list(zip(passages, processed_passages)), timings
+
+
+class _SplitFile:
+    # A large PDF extracted as several page ranges, assembled once every range is done
+    def __init__(self, file_path, content_hash, parts):
+        self.file_path = file_path
+        self.content_hash = content_hash
+        self.parts = [None] * parts
+        self.remaining = parts
+        self.failed = False
+
+    def assemble(self, limits):
+        # Number the passages of every range in file order
+        pairs = truncate_passages((pair for part in self.parts for pair in part), limits, self.file_path)
+        return [(passage._replace(position=position), processed_passage)
+                for position, (passage, processed_passage) in enumerate(pairs)]
+
+
+class ExtractionPipeline:
+    """
+    Streams analyze_file() results out of a pool of worker processes.
+
+    Text extraction and preprocessing are CPU bound, so they run in `workers`
+    processes that each load their own spaCy model (when `spacy_model` is None,
+    the text is only extracted and the search backend analyzes it). At most `max_pending` tasks
+    are in flight at any time: results are yielded as soon as they complete and
+    the next files are only submitted once earlier ones were consumed, so memory
+    stays bounded however large the corpus is.
+
+    PDFs of more than `pdf_pages_per_task` pages that are not in the extraction
+    cache yet are split into ranges of that many pages, extracted in parallel by
+    the workers and reassembled (and cached) here, so one large PDF does not hold
+    up a single worker for the whole run.
+    """
+
+    def __init__(self, spacy_model, cache, workers=None, max_pending=None, pdf_pages_per_task=None):
+        self.spacy_model = spacy_model
+        self.cache = cache
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.pdf_pages_per_task = pdf_pages_per_task
+
+    def _page_ranges(self, file_path, content_hash):
+        # Return the page ranges of a PDF worth splitting, or None to extract the file as a whole
+        if (not self.pdf_pages_per_task or not file_path.endswith(".pdf") or content_hash is None
+                or self.cache.contains(content_hash)):
+            return None
+
+        check_file_size(file_path, self.cache.limits)
+        pages = count_pdf_pages(file_path)
+        max_pages = self.cache.limits.max_pages
+
+        if max_pages is not None and pages > max_pages:
+            logger.warning("Truncated %s after %d pages", file_path, max_pages, extra={"file_path": file_path})
+            pages = max_pages
+
+        if pages <= self.pdf_pages_per_task:
+            return None
+
+        return [(start, min(start + self.pdf_pages_per_task, pages))
+                for start in range(0, pages, self.pdf_pages_per_task)]
+
+    def _submit(self, executor, pending, file_path, content_hash):
+        # Submit the task(s) of one file; pending maps each future to (file_path, split file, part index)
+        page_ranges = self._page_ranges(file_path, content_hash)
+
+        if page_ranges is None:
+            pending[executor.submit(_process_file, file_path, content_hash)] = (file_path, None, None)
+            return
+
+        split = _SplitFile(file_path, content_hash, len(page_ranges))
+
+        for index, (start, stop) in enumerate(page_ranges):
+            pending[executor.submit(_process_pages, file_path, start, stop)] = (file_path, split, index)
+
+    def run(self, files, progress):
+        # Process the (file_path, content_hash) pairs of `files`
+        files = iter(files)
+        pending = {}
+        initargs = (self.spacy_model, self.cache.directory, self.cache.max_bytes, tuple(self.cache.limits))
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=initargs) as executor:
+            while True:
+                for file_path, content_hash in files:
+                    try:
+                        self._submit(executor, pending, file_path, content_hash)
+                    except Exception as e:
+                        progress.file_failed(file_path, e)
+                        continue
+
+                    if len(pending) >= self.max_pending:
+                        break
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    file_path, split, index = pending.pop(future)
+
+                    if split is not None and split.failed:
+                        continue
+
+                    try:
+                        if split is None:
+                            result, cache_hit, timings = future.result()
+                        else:
+                            result, timings = future.result()
+                    except Exception as e:
+                        if split is not None:
+                            split.failed = True
+
+                        progress.file_failed(file_path, e)
+                        continue
+
+                    for stage, duration in timings.items():
+                        record_stage(stage, duration)
+
+                    if split is None:
+                        self.cache.count(cache_hit)
+                        yield result
+                        continue
+
+                    split.parts[index] = result
+                    split.remaining -= 1
+
+                    if split.remaining == 0:
+                        passages = split.assemble(self.cache.limits)
+                        self.cache.count(False)
+                        self.cache.put(split.content_hash, [passage for passage, _ in passages])
+                        yield file_path, " ".join(processed for _, processed in passages), passages
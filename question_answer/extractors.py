@@ -0,0 +1,158 @@
+import logging
+import os
+from collections import namedtuple
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".docx", ".xlsx", ".pptx", ".pdf")
+
+# Bump whenever the passages produced for a file change, to invalidate the extraction cache
+EXTRACTOR_VERSION = 1
+
+# A paragraph, spreadsheet cell, slide shape or PDF page. `position` is the rank of
+# the passage in its file and `location` a human-readable reference to it.
+Passage = namedtuple("Passage", ["kind", "position", "location", "text"])
+
+# Per-file bounds on what is extracted, None meaning unlimited. Files larger than
+# max_file_bytes are refused; past max_pages PDF pages, max_cells spreadsheet cells
+# or max_passages passages, the rest of the file is dropped with a warning.
+ExtractionLimits = namedtuple("ExtractionLimits", ["max_file_bytes", "max_pages", "max_cells", "max_passages"],
+                              defaults=(None, None, None, None))
+
+NO_LIMITS = ExtractionLimits()
+
+
+class FileTooLarge(ValueError):
+    """Raised for files over ExtractionLimits.max_file_bytes, which are not extracted at all."""
+
+
+def extract_passages_from_docx(file_path):
+    # Extract the non-empty paragraphs of a DOCX file
+    from docx import Document  # The parsers are only imported once a file of their format is met
+
+    doc = Document(file_path)
+    position = 0
+
+    for number, paragraph in enumerate(doc.paragraphs, start=1):
+        if paragraph.text.strip():
+            yield Passage("paragraph", position, f"paragraph {number}", paragraph.text)
+            position += 1
+
+
+def extract_passages_from_xlsx(file_path, max_cells=None):
+    # Extract the non-empty cells of an XLSX file, streaming the rows of the read-only workbook
+    from openpyxl import load_workbook
+    from openpyxl.utils import get_column_letter
+
+    wb = load_workbook(filename=file_path, read_only=True)
+    position = 0
+
+    try:
+        for sheet in wb.sheetnames:
+            ws = wb[sheet]
+
+            for row_number, row in enumerate(ws.iter_rows(values_only=True), start=1):
+                for column_number, cell in enumerate(row, start=1):
+                    if cell:
+                        if max_cells is not None and position >= max_cells:
+                            logger.warning("Truncated %s after %d cells", file_path, max_cells,
+                                           extra={"file_path": file_path})
+                            return
+
+                        location = f"{sheet}!{get_column_letter(column_number)}{row_number}"
+                        yield Passage("cell", position, location, str(cell))
+                        position += 1
+    finally:
+        wb.close()  # Read-only workbooks keep their file open until closed
+
+
+def extract_passages_from_pptx(file_path):
+    # Extract the text shapes of a PPTX file
+    from pptx import Presentation
+
+    prs = Presentation(file_path)
+    position = 0
+
+    for slide_number, slide in enumerate(prs.slides, start=1):
+        for shape in slide.shapes:
+            if hasattr(shape, "text") and shape.text.strip():
+                yield Passage("shape", position, f"slide {slide_number}", shape.text)
+                position += 1
+
+
+def count_pdf_pages(file_path):
+    # Return the number of pages of a PDF file, without extracting their text
+    from PyPDF2 import PdfReader
+
+    with open(file_path, "rb") as file:
+        return len(PdfReader(file).pages)
+
+
+def extract_passages_from_pdf(file_path, max_pages=None, page_range=None):
+    # Extract the pages of a PDF file, or those of the (start, stop) range of 0-based page indices.
+    # Positions start at 0 within the range: callers extracting a file in several ranges renumber them.
+    from PyPDF2 import PdfReader
+
+    with open(file_path, "rb") as file:
+        pdf = PdfReader(file)
+        start, stop = page_range or (0, len(pdf.pages))
+
+        if max_pages is not None and stop > max_pages:
+            logger.warning("Truncated %s after %d pages", file_path, max_pages, extra={"file_path": file_path})
+            stop = max_pages
+
+        position = 0
+
+        for page_number in range(start + 1, stop + 1):
+            text = pdf.pages[page_number - 1].extract_text()
+
+            if text and text.strip():
+                yield Passage("page", position, f"page {page_number}", text)
+                position += 1
+
+
+def check_file_size(file_path, limits):
+    # Refuse the files over the size limit before opening them
+    if limits.max_file_bytes is not None:
+        size = os.path.getsize(file_path)
+
+        if size > limits.max_file_bytes:
+            raise FileTooLarge(f"{file_path} is {size} bytes, over the {limits.max_file_bytes} bytes limit.")
+
+
+def truncate_passages(passages, limits, file_path):
+    # Yield at most limits.max_passages passages, warning when the file had more
+    if limits.max_passages is None:
+        yield from passages
+        return
+
+    passages = iter(passages)
+    yield from islice(passages, limits.max_passages)
+
+    if next(passages, None) is not None:
+        logger.warning("Truncated %s after %d passages", file_path, limits.max_passages,
+                       extra={"file_path": file_path})
+
+
+def extract_passages(file_path, limits=NO_LIMITS):
+    # Extract the passages of a file according to its format, within the given limits
+    check_file_size(file_path, limits)
+
+    if file_path.endswith(".docx"):
+        passages = extract_passages_from_docx(file_path)
+    elif file_path.endswith(".xlsx"):
+        passages = extract_passages_from_xlsx(file_path, max_cells=limits.max_cells)
+    elif file_path.endswith(".pptx"):
+        passages = extract_passages_from_pptx(file_path)
+    elif file_path.endswith(".pdf"):
+        passages = extract_passages_from_pdf(file_path, max_pages=limits.max_pages)
+    else:
+        raise ValueError("Unsupported file format.")
+
+    return truncate_passages(passages, limits, file_path)
+
+
+def extract_text(file_path):
+    # Extract the whole text content of a file
+    return "\n".join(passage.text for passage in extract_passages(file_path)).strip()
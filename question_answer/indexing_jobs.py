@@ -0,0 +1,169 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .document_indexer import IndexingProgress
+from .registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+class IndexingJob(IndexingProgress):
+    """A directory waiting to be (or being) indexed, along with its progress."""
+
+    MAX_ERRORS = 100  # Only keep the first errors so a broken share cannot grow the job forever
+
+    def __init__(self, directory):
+        self.id = uuid.uuid4().hex
+        self.directory = directory
+        self.status = "queued"
+        self.message = ""
+        self.files_total = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.errors = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def start(self, total):
+        with self._lock:
+            self.files_total = total
+
+    def file_done(self, file_path):
+        with self._lock:
+            self.files_done += 1
+
+    def file_failed(self, file_path, error):
+        logger.warning("Failed to index %s: %s", file_path, error)
+
+        with self._lock:
+            self.files_failed += 1
+
+            if len(self.errors) < self.MAX_ERRORS:
+                self.errors.append({"file_path": file_path, "error": str(error)})
+
+    def as_dict(self):
+        """Return the job state as a JSON-serializable dictionary."""
+        with self._lock:
+            if self.started_at is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self.finished_at or time.time()) - self.started_at
+
+            return {
+                "id": self.id,
+                "directory": self.directory,
+                "status": self.status,
+                "message": self.message,
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "files_failed": self.files_failed,
+                "elapsed": round(elapsed, 2),
+                "files_per_second": round(self.files_done / elapsed, 2) if elapsed > 0 else 0.0,
+                "errors": list(self.errors),
+            }
+
+
+class IndexingQueue:
+    """
+    Runs collect_data() for queued directories on a pool of background threads,
+    so questions never wait for ingestion.
+    """
+
+    MAX_FINISHED_JOBS = 100  # Finished jobs kept for the status endpoint
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start_workers(self):
+        # Started on first use so that importing the module has no side effects
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"indexing-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, directory):
+        """
+        Queue `directory` for indexing and return its job.
+
+        A directory that is already queued or running is not queued twice: its
+        current job is returned instead.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.directory == directory and not job.finished:
+                    return job
+
+            finished = [job for job in self._jobs.values() if job.finished]
+            finished.sort(key=lambda job: job.created_at)
+
+            for job in finished[:max(0, len(finished) - self.MAX_FINISHED_JOBS)]:
+                del self._jobs[job.id]
+
+            job = IndexingJob(directory)
+            self._jobs[job.id] = job
+            self._start_workers()
+
+        self._queue.put(job)
+        return job
+
+    def refresh(self, directory, max_age):
+        """
+        Return the job keeping `directory` up to date: its queued or running job, or its last successful one
+        if it finished less than `max_age` seconds ago. Otherwise queue a new job.
+        """
+        now = time.time()
+
+        with self._lock:
+            for job in self._jobs.values():
+                if job.directory == directory and (
+                        not job.finished or (job.status == "done" and now - job.finished_at < max_age)):
+                    return job
+
+        return self.enqueue(directory)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+
+            try:
+                message, _ = registry.searcher(job.directory).collect_data(progress=job)
+                job.message = message
+                job.status = "done"
+            except Exception as e:
+                logger.exception("Indexing job %s failed", job.id)
+                job.message = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                close_old_connections()
+                self._queue.task_done()
+
+
+indexing_queue = IndexingQueue(settings.INDEXING_WORKERS)
@@ -0,0 +1,333 @@
+"""
+Question answering in a dedicated inference worker (see the run_inference_worker command).
+
+When every web worker runs the QA model itself, concurrent requests run several
+forward passes at once and their torch thread pools fight over the cores. With
+QA_INFERENCE_ADDRESS set, the web workers hand their (context, question) pairs
+to one long-lived worker process over a local socket instead:
+
+- InferenceServer queues the pairs of every connected client and answers them
+  in micro-batches: a batch starts `batch_window` seconds after its first pair
+  arrived, or as soon as `max_batch_size` pairs are waiting.
+- The queue is bounded: a request that would push it past `max_queue` pairs is
+  refused at once with a "busy" reply rather than waiting behind the others.
+- InferenceClient has the generate_answer()/generate_answers() interface of
+  QuestionAnswering and raises InferenceBusy on such replies. It only loads the
+  tokenizer of the model, used to count the tokens of the passages.
+
+Messages are pickled by multiprocessing.connection, which authenticates both
+ends with `authkey` before anything is unpickled.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceError(RuntimeError):
+    """The inference worker could not answer: unreachable, timed out or failed."""
+
+
+class InferenceBusy(InferenceError):
+    """The inference worker refused the request because its queue is full."""
+
+
+def parse_address(address):
+    """Return the multiprocessing.connection address of 'host:port' (TCP) or of a socket path (Unix socket)."""
+    if isinstance(address, (tuple, list)):
+        return tuple(address)
+
+    address = os.fspath(address)
+    host, separator, port = address.rpartition(":")
+
+    if separator and port.isdigit():
+        return host or "127.0.0.1", int(port)
+
+    return address
+
+
+class _Request:
+    # Pairs of one client request waiting in the queue of the server, and the future of their answers
+    __slots__ = ("pairs", "future", "arrival")
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+        self.future = Future()
+        self.arrival = time.monotonic()
+
+
+class InferenceServer:
+    """
+    Answers the (context, question) pairs sent by InferenceClients with one QuestionAnswering model.
+
+    A thread per connection receives the requests and waits for their answers, while a
+    single batching thread runs the model, so only one forward pass runs at a time.
+    """
+
+    def __init__(self, answering, address, authkey=None, max_queue=64, batch_window=0.01, max_batch_size=32,
+                 batch_size=8):
+        self.answering = answering
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.max_queue = max_queue
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.batch_size = batch_size
+        self._pending = collections.deque()
+        self._pending_pairs = 0
+        self._condition = threading.Condition()
+        self._listener = None
+        self._closed = threading.Event()
+        self._stats = collections.Counter()
+
+    def submit(self, pairs):
+        """Queue the pairs and return the Future of their answers, or None when the queue is full."""
+        request = _Request(pairs)
+
+        with self._condition:
+            # A request larger than the whole queue is still accepted when nothing else is waiting
+            if self._pending and self._pending_pairs + len(pairs) > self.max_queue:
+                self._stats["busy"] += 1
+                return None
+
+            self._pending.append(request)
+            self._pending_pairs += len(pairs)
+            self._stats["requests"] += 1
+            self._condition.notify()
+
+        return request.future
+
+    def stats(self):
+        """Return the request, rejection, batch and pair counts so far, with the current queue length."""
+        with self._condition:
+            stats = dict(self._stats)
+            stats["queued_pairs"] = self._pending_pairs
+
+        return stats
+
+    def _next_batch(self):
+        # Wait for the batching window of the oldest request, then take whole requests up to max_batch_size pairs
+        with self._condition:
+            while not self._closed.is_set():
+                if not self._pending:
+                    self._condition.wait(0.5)
+                    continue
+
+                due = self._pending[0].arrival + self.batch_window
+                now = time.monotonic()
+
+                if self._pending_pairs < self.max_batch_size and now < due:
+                    self._condition.wait(due - now)
+                    continue
+
+                batch = [self._pending.popleft()]
+                size = len(batch[0].pairs)
+
+                while self._pending and size + len(self._pending[0].pairs) <= self.max_batch_size:
+                    request = self._pending.popleft()
+                    batch.append(request)
+                    size += len(request.pairs)
+
+                self._pending_pairs -= size
+                return batch
+
+        return None
+
+    def _run_batches(self):
+        while True:
+            batch = self._next_batch()
+
+            if batch is None:
+                return
+
+            pairs = [pair for request in batch for pair in request.pairs]
+            start_time = time.monotonic()
+
+            try:
+                answers = self.answering.generate_answers(pairs, batch_size=self.batch_size)
+            except Exception as e:
+                logger.exception("Failed to answer a batch of %d pairs", len(pairs))
+
+                for request in batch:
+                    request.future.set_exception(e)
+
+                continue
+
+            logger.debug("Answered %d pairs of %d requests in %.3fs", len(pairs), len(batch),
+                         time.monotonic() - start_time)
+
+            with self._condition:
+                self._stats["batches"] += 1
+                self._stats["pairs"] += len(pairs)
+
+            offset = 0
+
+            for request in batch:
+                request.future.set_result(answers[offset:offset + len(request.pairs)])
+                offset += len(request.pairs)
+
+    def _serve_connection(self, connection):
+        # Answer the requests of one client, one at a time, until it disconnects
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+
+                if message.get("op") == "stats":
+                    reply = {"status": "ok", "stats": self.stats()}
+                else:
+                    future = self.submit([tuple(pair) for pair in message["pairs"]])
+
+                    if future is None:
+                        reply = {"status": "busy"}
+                    else:
+                        try:
+                            reply = {"status": "ok", "answers": future.result()}
+                        except Exception as e:
+                            reply = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+
+                try:
+                    connection.send(reply)
+                except OSError:
+                    return
+
+    def serve_forever(self):
+        """Accept clients until close() is called."""
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)  # Left behind by a previous worker
+
+        self._listener = Listener(self.address, authkey=self.authkey)
+        batcher = threading.Thread(target=self._run_batches, name="inference-batcher", daemon=True)
+        batcher.start()
+
+        try:
+            while not self._closed.is_set():
+                try:
+                    connection = self._listener.accept()
+                except OSError:
+                    if self._closed.is_set():
+                        break
+
+                    logger.exception("Failed to accept an inference client")
+                    continue
+
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+        finally:
+            self.close()
+            batcher.join()
+
+    def close(self):
+        self._closed.set()
+
+        with self._condition:
+            self._condition.notify_all()
+
+        if self._listener is not None:
+            self._listener.close()
+
+
+class InferenceClient:
+    """
+    Sends (context, question) pairs to the InferenceServer listening at `address`.
+
+    Connections are pooled and shared by the threads of the process, each request
+    borrowing an idle one. Requests wait at most `timeout` seconds for their answers.
+    """
+
+    def __init__(self, address, model_name, authkey=None, cache_dir=None, local_files_only=False, timeout=60):
+        from transformers import AutoTokenizer
+
+        self.address = parse_address(address)
+        self.model_name = model_name
+        self.authkey = authkey
+        self.timeout = timeout
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir=cache_dir,
+                                                       local_files_only=local_files_only)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def _request(self, message):
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+
+        # A pooled connection may have been closed by a restarted worker: retry once on a new one
+        for attempt in range(2):
+            fresh = connection is None
+
+            try:
+                if fresh:
+                    connection = Client(self.address, authkey=self.authkey)
+
+                connection.send(message)
+
+                if not connection.poll(self.timeout):
+                    connection.close()
+                    raise InferenceError(f"The inference worker did not answer within {self.timeout}s")
+
+                reply = connection.recv()
+                break
+            except (EOFError, OSError) as e:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+
+                if fresh or attempt:
+                    raise InferenceError(f"The inference worker at {self.address} is unreachable: {e}") from e
+
+        with self._lock:
+            self._idle.append(connection)
+
+        return reply
+
+    def generate_answers(self, pairs, batch_size=8):
+        """
+        Generate answers for several (context, question) pairs in the inference worker.
+
+        `batch_size` is ignored: the worker batches the pairs of every client together.
+        Raises InferenceBusy when the worker is overloaded, InferenceError when it failed.
+        """
+        if not pairs:
+            return []
+
+        try:
+            reply = self._request({"op": "answer", "pairs": list(pairs)})
+        except InferenceError:
+            self._stats["error"] += 1
+            raise
+
+        self._stats[reply["status"]] += 1
+
+        if reply["status"] == "busy":
+            raise InferenceBusy("The inference worker is busy, try again shortly")
+
+        if reply["status"] != "ok":
+            raise InferenceError(reply["error"])
+
+        return reply["answers"]
+
+    def generate_answer(self, context, question):
+        """Generate an answer to the question from the context, see QuestionAnswering.generate_answer()."""
+        return self.generate_answers([(context, question)])[0]
+
+    def server_stats(self):
+        """Return the counters of the inference worker, see InferenceServer.stats()."""
+        return self._request({"op": "stats"})["stats"]
+
+    def stats(self):
+        """Return the number of requests of this process answered ("ok"), refused ("busy") or failed ("error")."""
+        return dict(self._stats)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection in idle:
+            connection.close()
@@ -0,0 +1,243 @@
+"""
+Lightweight instrumentation: counters, histograms and timed spans.
+
+Metrics are kept in the process-wide `metrics` registry and served in the
+Prometheus text format by the /metrics/ view. Each process (web worker,
+management command) has its own values, so scrape every web worker.
+
+span() times a named pipeline stage: the duration is observed in the
+askmind_stage_seconds histogram, logged as a structured record and, while a
+request is traced (see middleware.InstrumentationMiddleware), added to the
+stage breakdown of that request, and of any trace enclosing it.
+"""
+import bisect
+import contextvars
+import datetime
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    """A monotonically increasing value per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        # Yield (name, [(label, value)], value) for every series
+        with self._lock:
+            values = dict(self._values)
+
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.labels, key)), value
+
+
+class Histogram:
+    """Observations counted in cumulative buckets, with their sum and count, per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # Label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(key)
+
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+
+        for key, values in sorted(series.items()):
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + [("le", "+Inf" if bound == float("inf") else repr(bound))], \
+                    cumulative
+
+            yield f"{self.name}_sum", labels, values[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """The metrics of the process, plus collectors reporting values owned by other objects at render time."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, documentation, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, labels, **kwargs)
+
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._get_or_create(Counter, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labels, buckets=buckets)
+
+    def register_collector(self, collector):
+        """
+        Register a callable returning (name, type, documentation, [(labels_dict, value)]) tuples,
+        called on every render, for values that are already counted elsewhere (e.g. cache statistics).
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{_format_labels(labels)} {value}" for name, labels, value in metric.samples())
+
+        for collector in collectors:
+            try:
+                collected = list(collector())
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+                continue
+
+            for name, metric_type, documentation, series in collected:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(f"{name}{_format_labels(sorted(labels.items()))} {value}" for labels, value in series)
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram("askmind_stage_seconds", "Duration of each pipeline stage.", ["stage"])
+REQUEST_SECONDS = metrics.histogram("askmind_request_seconds", "Duration of the HTTP requests, until the response "
+                                                               "headers for streamed responses.",
+                                    ["view", "method", "status"])
+FILES = metrics.counter("askmind_files_total", "Files handled by the indexer, by outcome "
+                                               "(indexed, failed or deleted).", ["outcome"])
+BYTES = metrics.counter("askmind_indexed_bytes_total", "Size of the files indexed successfully.")
+PASSAGES = metrics.counter("askmind_indexed_passages_total", "Passages sent to the search backend.")
+BULK_FAILURES = metrics.counter("askmind_bulk_failures_total", "Files the search backend failed to store.")
+
+# Traces collecting the stages of the current context, as lists of (stage, seconds). Traces nest: a load
+# test tracing the requests it sends sees the same stages as the middleware tracing each request.
+_traces = contextvars.ContextVar("askmind_traces", default=())
+
+
+def start_trace():
+    """Start collecting the spans of the current context (request); returns (trace, token)."""
+    trace = []
+    return trace, _traces.set(_traces.get() + (trace,))
+
+
+def end_trace(token):
+    _traces.reset(token)
+
+
+def record_stage(stage, duration, **fields):
+    """Record a stage that was timed by other means than span() (e.g. in a worker process)."""
+    STAGE_SECONDS.observe(duration, stage=stage)
+
+    for trace in _traces.get():
+        trace.append((stage, duration))
+
+    logger.debug("%s took %.1f ms", stage, duration * 1000,
+                 extra={"span": stage, "duration_ms": round(duration * 1000, 3), **fields})
+
+
+@contextmanager
+def span(stage, **fields):
+    """Time the enclosed block as `stage`; `fields` are added to its log record."""
+    start_time = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start_time, **fields)
+
+
+def summarize_trace(trace):
+    # Total milliseconds per stage, in the order the stages first appeared
+    totals = {}
+
+    for stage, duration in trace:
+        totals[stage] = totals.get(stage, 0.0) + duration
+
+    return {stage: round(total * 1000, 3) for stage, total in totals.items()}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line, including the `extra` fields they were logged with."""
+
+    STANDARD_ATTRIBUTES = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in self.STANDARD_ATTRIBUTES)
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
@@ -0,0 +1,362 @@
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from question_answer.extractors import extract_passages
+from question_answer.registry import registry
+from question_answer.search_backends import SQLiteBackend
+from question_answer.synthetic_corpus import FORMATS, VOCABULARIES, generate_corpus, generate_questions
+from question_answer.text_analyzer import TextAnalyzer
+
+from .compare_qa_backends import percentile
+
+STAGES = ("startup", "extraction", "preprocess", "indexing", "search", "answer")
+
+# Imports the web application as a server process would, without the models that wsgi.py and asgi.py warm up
+STARTUP_SCRIPT = "import django; django.setup(); import AskMind.urls, question_answer.views"
+STARTUP_RUNS = 5
+
+
+def latency_stats(latencies):
+    # Summarize a list of durations in seconds as milliseconds
+    return {
+        "count": len(latencies),
+        "mean_ms": round(1000 * statistics.mean(latencies), 3),
+        "p50_ms": round(1000 * percentile(latencies, 0.5), 3),
+        "p95_ms": round(1000 * percentile(latencies, 0.95), 3),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 3),
+    }
+
+
+def flatten_metrics(stages, prefix=""):
+    # {"search": {"p50_ms": 1.2}} -> {"search.p50_ms": 1.2}
+    metrics = {}
+
+    for name, value in stages.items():
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)):
+            metrics[f"{prefix}{name}"] = value
+
+    return metrics
+
+
+def compare_metrics(current, previous, tolerance):
+    # Yield (name, previous, current, relative change, regressed) for the metrics of both flattened reports
+    # that have a direction: durations ("_ms", lower is better) and rates ("_per_second", higher is better)
+    for name in sorted(current.keys() & previous.keys()):
+        if name.endswith("_ms"):
+            lower_is_better = True
+        elif name.endswith("_per_second"):
+            lower_is_better = False
+        else:
+            continue
+
+        if not previous[name]:
+            continue
+
+        change = (current[name] - previous[name]) / previous[name]
+        regressed = (change > tolerance) if lower_is_better else (change < -tolerance)
+        yield name, previous[name], current[name], change, regressed
+
+
+def compare_with_baseline(command, report, baseline_path, section, tolerance):
+    # Print the relative change of every metric of report[section] against the same section of the report saved
+    # at baseline_path, on the output of the management command, and return (baseline, regressed metric names)
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)
+
+    current = flatten_metrics(report[section])
+    previous = flatten_metrics(baseline.get(section, {}))
+    regressions = []
+    command.stdout.write(f"\nCompared with {baseline.get('commit') or baseline_path}:")
+
+    for name, before, after, change, regressed in compare_metrics(current, previous, tolerance):
+        line = f"{name}: {before} -> {after} ({change:+.1%})"
+
+        if regressed:
+            regressions.append(name)
+            command.stdout.write(command.style.ERROR(f"{line} REGRESSION"))
+        else:
+            command.stdout.write(line)
+
+    return baseline, regressions
+
+
+def import_times(report):
+    # Parse the stderr of python -X importtime: module -> cumulative import time in microseconds
+    times = {}
+
+    for line in report.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            _, cumulative, module = line.split("|")
+
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+
+    return times
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Time each stage of the pipeline (startup imports, extraction per format, text analysis, bulk indexing "
+            "into an embedded SQLite index, search and answer latency) on a reproducible synthetic corpus.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", help="Directory of the synthetic corpus. Generated in a temporary "
+                                             "directory by default; reused when it already contains files.")
+        parser.add_argument("--files-per-format", type=int, default=10)
+        parser.add_argument("--paragraphs", type=int, default=50, help="Paragraphs of each file.")
+        parser.add_argument("--language", default="fr", choices=list(VOCABULARIES))
+        parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS))
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--questions", type=int, default=20, help="Questions used for search and answering.")
+        parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES),
+                            help="Stages to run; each one needs the stages before it, which are run anyway.")
+        parser.add_argument("--json", dest="json_output", help="Write the results to this JSON file.")
+        parser.add_argument("--compare", help="Results of a previous run (JSON) to compare with.")
+        parser.add_argument("--tolerance", type=float, default=0.1,
+                            help="Relative slowdown reported as a regression by --compare (default 10%%).")
+        parser.add_argument("--fail-on-regression", action="store_true",
+                            help="Exit with an error when --compare finds a regression.")
+
+    def handle(self, *args, **options):
+        stages = set(options["stages"])
+        last_stage = max(STAGES.index(stage) for stage in stages)
+
+        with tempfile.TemporaryDirectory() as work_directory:
+            corpus_directory = options["corpus"] or os.path.join(work_directory, "corpus")
+            paths = self._corpus(corpus_directory, options)
+            questions = generate_questions(options["questions"], options["language"], options["seed"])
+            results = {}
+
+            if "startup" in stages:
+                self._bench_startup(results)
+
+            if last_stage >= STAGES.index("extraction"):
+                passages = self._bench_extraction(paths, results)
+
+            if last_stage >= STAGES.index("preprocess"):
+                analyzer, documents = self._bench_preprocess(passages, results)
+
+            if last_stage >= STAGES.index("indexing"):
+                backend = SQLiteBackend(os.path.join(work_directory, "search.sqlite3"),
+                                        chunk_size=settings.INDEXING_BULK_CHUNK_SIZE)
+                self._bench_indexing(backend, documents, results)
+
+            if last_stage >= STAGES.index("search"):
+                contexts = self._bench_search(backend, analyzer, questions, results)
+
+            if "answer" in stages:
+                self._bench_answer(contexts, results)
+
+            if last_stage >= STAGES.index("indexing"):
+                backend.close()
+
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "spacy_model": settings.SPACY_MODEL,
+                "qa_backend": settings.QA_BACKEND,
+            },
+            "corpus": {
+                "files": len(paths),
+                "files_per_format": options["files_per_format"],
+                "paragraphs_per_file": options["paragraphs"],
+                "language": options["language"],
+                "seed": options["seed"],
+            },
+            "stages": {stage: results[stage] for stage in STAGES if stage in stages},
+        }
+
+        for name, value in sorted(flatten_metrics(report["stages"]).items()):
+            self.stdout.write(f"{name}: {value}")
+
+        if options["json_output"]:
+            with open(options["json_output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+
+        if options["compare"]:
+            _, regressions = compare_with_baseline(self, report, options["compare"], "stages", options["tolerance"])
+
+            if regressions and options["fail_on_regression"]:
+                raise CommandError(f"{len(regressions)} metric(s) regressed: {', '.join(regressions)}")
+
+    def _corpus(self, directory, options):
+        # Reuse the files of an existing corpus directory, or generate them
+        if os.path.isdir(directory) and os.listdir(directory):
+            return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                          if name.endswith(tuple(f".{file_format}" for file_format in options["formats"])))
+
+        start_time = time.time()
+        paths = generate_corpus(directory, files_per_format=options["files_per_format"],
+                                paragraphs_per_file=options["paragraphs"], language=options["language"],
+                                formats=options["formats"], seed=options["seed"])
+        self.stdout.write(f"Generated {len(paths)} files in {directory} in {time.time() - start_time:.2f} seconds")
+        return paths
+
+    def _bench_startup(self, results):
+        # Import the application in fresh interpreters and report the slowest top-level packages of the last one
+        process_times, import_ms, times = [], [], {}
+
+        for _ in range(STARTUP_RUNS):
+            start_time = time.perf_counter()
+            process = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT], capture_output=True,
+                                     text=True, cwd=settings.BASE_DIR)
+            process_times.append(time.perf_counter() - start_time)
+
+            if process.returncode:
+                raise CommandError(f"Failed to import the application:\n{process.stderr[-2000:]}")
+
+            times = import_times(process.stderr)
+            import_ms.append(times.get("question_answer.views", 0) / 1000)
+
+        packages = sorted((module for module in times if "." not in module), key=times.get, reverse=True)
+        results["startup"] = {
+            "process_ms": round(1000 * statistics.median(process_times), 3),
+            "import_views_ms": round(statistics.median(import_ms), 3),
+            "slowest_imports": {package: round(times[package] / 1000, 3) for package in packages[:10]},
+        }
+
+    def _bench_extraction(self, paths, results):
+        # Extract every file, timing each format separately
+        passages = {}
+        results["extraction"] = {}
+
+        for file_format in sorted({os.path.splitext(path)[1][1:] for path in paths}):
+            format_paths = [path for path in paths if path.endswith(f".{file_format}")]
+            latencies = []
+            count = 0
+
+            for path in format_paths:
+                start_time = time.perf_counter()
+                passages[path] = list(extract_passages(path))
+                latencies.append(time.perf_counter() - start_time)
+                count += len(passages[path])
+
+            total_bytes = sum(os.path.getsize(path) for path in format_paths)
+            results["extraction"][file_format] = {
+                **latency_stats(latencies),
+                "passages": count,
+                "files_per_second": round(len(format_paths) / sum(latencies), 2),
+                "mb_per_second": round(total_bytes / 1024 ** 2 / sum(latencies), 2),
+            }
+
+        return passages
+
+    def _bench_preprocess(self, passages, results):
+        # Analyze every passage with a cold analyzer (batched, as the indexer does), then time
+        # preprocess_text() one passage at a time with the lemma cache warmed up
+        registry.get("nltk")
+        analyzer = TextAnalyzer(registry.nlp, cache_size=settings.ANALYZER_CACHE_SIZE,
+                                batch_size=settings.ANALYZER_BATCH_SIZE)
+        texts = [passage.text for file_passages in passages.values() for passage in file_passages]
+
+        start_time = time.perf_counter()
+        processed = analyzer.analyze_batch(texts)
+        batch_time = time.perf_counter() - start_time
+
+        latencies = []
+
+        for text in texts[:200]:
+            start_time = time.perf_counter()
+            analyzer.preprocess_text(text)
+            latencies.append(time.perf_counter() - start_time)
+
+        results["preprocess"] = {
+            "analyze_batch": {
+                "passages": len(texts),
+                "passages_per_second": round(len(texts) / batch_time, 2),
+                "chars_per_second": round(sum(len(text) for text in texts) / batch_time, 2),
+            },
+            "preprocess_text": latency_stats(latencies),
+        }
+
+        documents = []
+        offset = 0
+
+        for path, file_passages in passages.items():
+            file_processed = processed[offset:offset + len(file_passages)]
+            offset += len(file_passages)
+            documents.append((path, " ".join(file_processed), list(zip(file_passages, file_processed))))
+
+        return analyzer, documents
+
+    def _bench_indexing(self, backend, documents, results):
+        start_time = time.perf_counter()
+        failures = [error for _, error in backend.index(iter(documents)) if error is not None]
+        elapsed = time.perf_counter() - start_time
+        passage_count = sum(len(passages) for _, _, passages in documents)
+
+        if failures:
+            raise CommandError(f"{len(failures)} document(s) failed to index: {failures[0]}")
+
+        results["indexing"] = {
+            "backend": "sqlite",
+            "documents": len(documents),
+            "documents_per_second": round(len(documents) / elapsed, 2),
+            "passages_per_second": round(passage_count / elapsed, 2),
+        }
+
+    def _bench_search(self, backend, analyzer, questions, results):
+        # Time the file search and the passage search of the best file, as answering a question does
+        file_latencies = []
+        passage_latencies = []
+        contexts = []
+
+        for question in questions:
+            processed_query = analyzer.preprocess_query(question)
+
+            start_time = time.perf_counter()
+            hits = backend.search(processed_query, size=4)
+            file_latencies.append(time.perf_counter() - start_time)
+
+            if not hits:
+                continue
+
+            start_time = time.perf_counter()
+            passages = backend.search_passages(hits[0]["file_path"], processed_query, settings.PASSAGES_PER_FILE)
+            passage_latencies.append(time.perf_counter() - start_time)
+            contexts.append((" ".join(text for text, _ in passages), question))
+
+        results["search"] = {"search_files": latency_stats(file_latencies)}
+
+        if passage_latencies:
+            results["search"]["search_passages"] = latency_stats(passage_latencies)
+
+        return contexts
+
+    def _bench_answer(self, contexts, results):
+        if not contexts:
+            raise CommandError("No question matched the corpus, nothing to answer.")
+
+        answering = registry.answering
+        answering.generate_answer(*contexts[0])  # Warm-up
+        latencies = []
+
+        for context, question in contexts:
+            start_time = time.perf_counter()
+            answering.generate_answer(context, question)
+            latencies.append(time.perf_counter() - start_time)
+
+        results["answer"] = {"generate_answer": latency_stats(latencies)}
@@ -0,0 +1,133 @@
+import gc
+import json
+import re
+import statistics
+import string
+import time
+from collections import Counter
+
+import psutil
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from question_answer.inference_backends import BACKENDS
+from question_answer.question_answering import DISTILLED_MODEL_NAME, QuestionAnswering
+
+
+def load_examples(path):
+    # Read (context, question, answers) examples from a SQuAD-style file or a plain JSON list
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+
+    if isinstance(data, dict) and "data" in data:
+        return [
+            (paragraph["context"], qa["question"], [answer["text"] for answer in qa["answers"]])
+            for article in data["data"]
+            for paragraph in article["paragraphs"]
+            for qa in paragraph["qas"]
+            if qa.get("answers")
+        ]
+
+    return [(example["context"], example["question"], example["answers"]) for example in data]
+
+
+def normalize_answer(text):
+    # Lowercase, and remove punctuation, articles and extra whitespace (SQuAD evaluation rules)
+    text = "".join(char for char in text.lower() if char not in set(string.punctuation))
+    text = re.sub(r"\b(a|an|the|le|la|les|un|une|des)\b", " ", text)
+    return " ".join(text.split())
+
+
+def f1_score(prediction, truth):
+    prediction_tokens = normalize_answer(prediction).split()
+    truth_tokens = normalize_answer(truth).split()
+    common = Counter(prediction_tokens) & Counter(truth_tokens)
+    num_same = sum(common.values())
+
+    if num_same == 0:
+        return 0.0
+
+    precision = num_same / len(prediction_tokens)
+    recall = num_same / len(truth_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = "Compare the accuracy and latency of the question answering inference backends."
+
+    def add_arguments(self, parser):
+        parser.add_argument("examples", help="SQuAD-style JSON file, or a JSON list of "
+                                             "{context, question, answers} objects.")
+        parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+        parser.add_argument("--model", default=settings.QA_MODEL_NAME)
+        parser.add_argument("--distilled", action="store_true",
+                            help=f"Also measure every backend with {DISTILLED_MODEL_NAME}.")
+        parser.add_argument("--limit", type=int, default=200, help="Maximum number of examples to run.")
+        parser.add_argument("--json", dest="json_output", help="Also write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        examples = load_examples(options["examples"])[:options["limit"]]
+
+        if not examples:
+            raise CommandError("No examples with answers were found.")
+
+        models = [options["model"]] + ([DISTILLED_MODEL_NAME] if options["distilled"] else [])
+        process = psutil.Process()
+        reports = []
+
+        for model_name in models:
+            for backend in options["backends"]:
+                rss_before = process.memory_info().rss
+                start_time = time.time()
+
+                try:
+                    answering = QuestionAnswering(model_name, backend=backend, cache_dir=settings.QA_MODEL_CACHE_DIR,
+                                                  local_files_only=settings.QA_LOCAL_FILES_ONLY,
+                                                  export_dir=settings.QA_ONNX_DIR)
+                except ImportError as e:
+                    self.stderr.write(f"Skipping {backend}: {e}")
+                    continue
+
+                load_time = time.time() - start_time
+                latencies = []
+                exact_matches = 0
+                f1_total = 0.0
+
+                for context, question, answers in examples:
+                    start_time = time.time()
+                    answer, _ = answering.generate_answer(context, question)
+                    latencies.append(time.time() - start_time)
+
+                    exact_matches += any(normalize_answer(answer) == normalize_answer(truth) for truth in answers)
+                    f1_total += max(f1_score(answer, truth) for truth in answers)
+
+                report = {
+                    "model": model_name,
+                    "backend": backend,
+                    "examples": len(examples),
+                    "exact_match": round(100 * exact_matches / len(examples), 2),
+                    "f1": round(100 * f1_total / len(examples), 2),
+                    "load_seconds": round(load_time, 2),
+                    "latency_mean_ms": round(1000 * statistics.mean(latencies), 1),
+                    "latency_p50_ms": round(1000 * percentile(latencies, 0.5), 1),
+                    "latency_p95_ms": round(1000 * percentile(latencies, 0.95), 1),
+                    "rss_delta_mb": round((process.memory_info().rss - rss_before) / 1024 ** 2, 1),
+                }
+                reports.append(report)
+                self.stdout.write(
+                    f"{model_name} [{backend}]: EM {report['exact_match']} F1 {report['f1']} | "
+                    f"p50 {report['latency_p50_ms']} ms p95 {report['latency_p95_ms']} ms | "
+                    f"load {report['load_seconds']} s | +{report['rss_delta_mb']} MB"
+                )
+
+                del answering
+                gc.collect()
+
+        if options["json_output"]:
+            with open(options["json_output"], "w", encoding="utf-8") as file:
+                json.dump(reports, file, indent=2)
@@ -0,0 +1,187 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from question_answer.document_indexer import IndexingProgress
+from question_answer.registry import registry
+
+# Index settings during the load: no periodic refresh, and no replica to copy every document to
+BULK_LOAD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+
+class LoadProgress(IndexingProgress):
+    # Counts the files of the load for the periodic report
+    def __init__(self):
+        self.total = None
+        self.done = 0
+        self.failed = 0
+
+    def start(self, total):
+        self.total = total
+
+    def file_done(self, file_path):
+        self.done += 1
+
+    def file_failed(self, file_path, error):
+        self.failed += 1
+        super().file_failed(file_path, error)
+
+
+class Command(BaseCommand):
+    help = ("Index a large directory for the first time, or resume such a load after a crash. The index settings "
+            "are tuned for the load (no refresh, no replicas) and restored afterwards, bulk requests are resized "
+            "to the cluster's response time and rejected documents retried, and the throughput is reported as it "
+            "goes. The indexed files are checkpointed in the indexing manifest, so running the command again "
+            "after a crash only indexes the files that were not. With --recreate, the indices are rebuilt empty first, "
+            "e.g. after changing TEXT_ANALYSIS.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory to index recursively.")
+        parser.add_argument("--force-merge", action="store_true",
+                            help="Merge the index segments once the load is over, for faster searches.")
+        parser.add_argument("--max-segments", type=int, default=1, help="Segments per shard left by --force-merge.")
+        parser.add_argument("--keep-settings", action="store_true",
+                            help="Do not disable the refresh and the replicas during the load.")
+        parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between progress reports.")
+        parser.add_argument("--restore-settings", action="store_true",
+                            help="Only restore the index settings left behind by a crashed load, without resuming it.")
+        parser.add_argument("--recreate", action="store_true",
+                            help="Delete the indices and the indexing manifest and rebuild them with the current "
+                                 "settings before the load. The files indexed from other directories must then be "
+                                 "indexed again.")
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options["directory"])
+
+        if not os.path.isdir(directory):
+            raise CommandError(f"{directory} is not a directory.")
+
+        searcher = registry.searcher(directory)
+        backend = searcher.search_backend
+        state = self.load_state()
+
+        if options["restore_settings"]:
+            if state is None:
+                self.stdout.write("No interrupted load: nothing to restore.")
+            else:
+                self.restore(backend, state)
+
+            return
+
+        if options["recreate"]:
+            if state is not None:
+                raise CommandError(f"The load of {state['directory']} was interrupted: finish it or run the command "
+                                   f"with --restore-settings before recreating the indices.")
+
+            forgotten = searcher.recreate_index()
+            self.stdout.write(f"Recreated the indices, {len(forgotten)} indexed files forgotten")
+            others = sum(not file_path.startswith(os.path.join(directory, "")) for file_path in forgotten)
+
+            if others:
+                self.stdout.write(f"{others} of these files lie outside {directory}: index their directories again")
+
+        if state is not None:
+            if state["directory"] != directory:
+                # The saved settings belong to that load, which must not be left half done
+                raise CommandError(f"The load of {state['directory']} started at {state['started_at']} was "
+                                   f"interrupted: finish it with 'index_corpus {state['directory']}', or run the "
+                                   f"command with --restore-settings first.")
+
+            self.stdout.write(f"Resuming the load of {state['directory']} started at {state['started_at']}")
+        elif not options["keep_settings"]:
+            # Saved before changing anything, so a crash at any point leaves the original settings behind
+            state = {
+                "directory": directory,
+                "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                "index_settings": backend.index_settings(),
+            }
+            self.save_state(state)
+
+        if state is not None and state["index_settings"]:
+            backend.update_index_settings({name: BULK_LOAD_SETTINGS for name in state["index_settings"]})
+
+        progress = LoadProgress()
+        stop = threading.Event()
+        reporter = threading.Thread(target=self.report_progress, daemon=True,
+                                    args=(backend, progress, stop, options["report_interval"]))
+        reporter.start()
+
+        try:
+            message, _ = searcher.collect_data(progress)
+        finally:
+            stop.set()
+            reporter.join()
+
+            if state is not None:
+                self.restore(backend, state)
+
+        self.stdout.write(message)
+
+        if options["force_merge"]:
+            start_time = time.time()
+            backend.optimize(options["max_segments"])
+            self.stdout.write(f"Merged the index segments in {time.time() - start_time:.1f} seconds")
+
+    def report_progress(self, backend, progress, stop, interval):
+        # Print the files done and the throughput since the start and over the last interval, until stopped,
+        # and a last time then
+        start_time = previous_time = time.time()
+        previous_actions = 0
+        stopped = False
+
+        while not stopped:
+            stopped = stop.wait(interval)
+            now = time.time()
+            stats = backend.bulk_stats()
+            actions = stats.get("actions", 0)
+
+            if progress.total is None:
+                line = "Scanning the directory for new and changed files"
+            else:
+                line = (f"{progress.done}/{progress.total} files ({progress.failed} failed), "
+                        f"{progress.done / (now - start_time):.1f} files/s")
+
+            if stats:
+                line += (f", {actions / (now - start_time):.0f} docs/s "
+                         f"({(actions - previous_actions) / (now - previous_time):.0f} docs/s over the last "
+                         f"{now - previous_time:.0f}s), {stats.get('bytes', 0) / 1024 ** 2 / (now - start_time):.2f} "
+                         f"MB/s, {stats['chunk_size']} docs per bulk request, {stats.get('retries', 0)} retries")
+
+            self.stdout.write(line)
+            previous_time, previous_actions = now, actions
+
+    def restore(self, backend, state):
+        # Put the settings of before the load back, keeping the state file if the cluster refused them
+        try:
+            backend.update_index_settings(state["index_settings"])
+        except Exception as e:
+            self.stderr.write(f"Failed to restore the index settings ({e}): run the command again with "
+                              f"--restore-settings")
+            return
+
+        os.remove(settings.INDEX_CORPUS_STATE_FILE)
+
+        if state["index_settings"]:
+            self.stdout.write("Restored the index settings")
+
+    def load_state(self):
+        try:
+            with open(settings.INDEX_CORPUS_STATE_FILE, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def save_state(self, state):
+        # Written to a temporary file first, so a crash never leaves a truncated state behind
+        os.makedirs(os.path.dirname(settings.INDEX_CORPUS_STATE_FILE), exist_ok=True)
+        temporary_path = f"{settings.INDEX_CORPUS_STATE_FILE}.tmp"
+
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(state, file, indent=2)
+
+        os.replace(temporary_path, settings.INDEX_CORPUS_STATE_FILE)
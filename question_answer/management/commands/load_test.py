@@ -0,0 +1,385 @@
+import asyncio
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from question_answer.extraction_cache import ExtractionCache
+from question_answer.extraction_pipeline import analyze_file
+from question_answer.extractors import SUPPORTED_EXTENSIONS
+from question_answer.instrumentation import end_trace, start_trace, summarize_trace
+from question_answer.registry import registry
+from question_answer.result_cache import MemoryBackend, ResultCache
+from question_answer.search_backends import SQLiteBackend
+from question_answer.synthetic_corpus import VOCABULARIES, generate_corpus, generate_questions
+
+from .benchmark import compare_with_baseline, git_commit, latency_stats
+
+# Endpoint -> URL name: the search form, its streamed variant and the JSON batch API
+ENDPOINTS = {"form": "ask_question", "stream": "ask_question_stream", "api": "answer_questions"}
+
+# Report fields a baseline must share for its latencies to be comparable
+COMPARABLE = ("endpoint", "qa", "stub_qa_ms", "result_cache")
+
+
+class StubTokenizer:
+    # Counts words as tokens, for the token budget of the passage ranker
+    def tokenize(self, text):
+        return text.split()
+
+
+class StubAnswering:
+    """
+    Stands in for QuestionAnswering without a model: every forward pass of up to `batch_size`
+    pairs sleeps `latency` seconds, then each context is answered with its first words.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.tokenizer = StubTokenizer()
+
+    def generate_answers(self, pairs, batch_size=8):
+        if not pairs:
+            return []
+
+        time.sleep(self.latency * math.ceil(len(pairs) / batch_size))
+        return [(" ".join(context.split()[:5]), 0.5) for context, _ in pairs]
+
+    def generate_answer(self, context, question):
+        return self.generate_answers([(context, question)])[0]
+
+
+class Command(BaseCommand):
+    help = ("Load test the question endpoints in-process: send a mix of questions from several concurrent clients, "
+            "at each concurrency level, against an embedded SQLite index of a synthetic corpus and a stub (or the "
+            "configured) QA model, and report the latency percentiles, the throughput and the time spent in each "
+            "stage of the pipeline. Compare with a stored baseline to catch capacity regressions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", help="Directory of the corpus to index. A synthetic corpus is generated in a "
+                                             "temporary directory by default; reused when it already contains files.")
+        parser.add_argument("--files-per-format", type=int, default=5)
+        parser.add_argument("--paragraphs", type=int, default=50, help="Paragraphs of each synthetic file.")
+        parser.add_argument("--language", default="fr", choices=list(VOCABULARIES))
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus, the questions and their mix.")
+        parser.add_argument("--questions", type=int, default=50, help="Distinct synthetic questions of the mix.")
+        parser.add_argument("--question-file", help="Text file of questions, one per line, to use instead of the "
+                                                    "synthetic ones (with your own --corpus).")
+        parser.add_argument("--endpoint", default="form", choices=list(ENDPOINTS),
+                            help="'form' posts the search form, 'stream' reads the streamed answers of /ask/stream/, "
+                                 "'api' posts to the JSON batch API.")
+        parser.add_argument("--api-batch", type=int, default=1, help="Questions per request with --endpoint api.")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                            help="Concurrent clients of each level, each sending its next request as soon as the "
+                                 "previous one is answered.")
+        parser.add_argument("--requests", type=int, default=100, help="Requests sent at each concurrency level.")
+        parser.add_argument("--warmup", type=int, default=5, help="Requests sent before measuring, not reported.")
+        parser.add_argument("--qa", default="stub", choices=["stub", "model"],
+                            help="'stub' answers without a model after --stub-qa-ms, 'model' uses the configured "
+                                 "QA model (QA_BACKEND, QA_INFERENCE_ADDRESS).")
+        parser.add_argument("--stub-qa-ms", type=float, default=50.0,
+                            help="Duration of each forward pass of the stub QA model.")
+        parser.add_argument("--with-cache", action="store_true",
+                            help="Keep the results of repeated questions, as the result cache of a server does.")
+        parser.add_argument("--json", dest="json_output", help="Write the results to this JSON file.")
+        parser.add_argument("--compare", help="Results of a previous run (JSON) to compare with.")
+        parser.add_argument("--tolerance", type=float, default=0.1,
+                            help="Relative slowdown reported as a regression by --compare (default 10%%).")
+        parser.add_argument("--fail-on-regression", action="store_true",
+                            help="Exit with an error when --compare finds a regression.")
+
+    def handle(self, *args, **options):
+        if min(options["concurrency"]) < 1 or options["requests"] < 1 or options["api_batch"] < 1:
+            raise CommandError("--concurrency, --requests and --api-batch must be at least 1.")
+
+        with tempfile.TemporaryDirectory() as work_directory:
+            corpus_directory = os.path.abspath(options["corpus"] or os.path.join(work_directory, "corpus"))
+            paths = self._corpus(corpus_directory, options)
+            questions = self._questions(options)
+            backend = SQLiteBackend(os.path.join(work_directory, "search.sqlite3"),
+                                    chunk_size=settings.INDEXING_BULK_CHUNK_SIZE,
+                                    text_analysis=settings.TEXT_ANALYSIS, analyzer=registry.analyzer)
+
+            try:
+                self._index(backend, paths, work_directory)
+                levels = self._run(backend, corpus_directory, questions, work_directory, options)
+            finally:
+                backend.close()
+
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "qa_backend": settings.QA_BACKEND,
+                "qa_answer_mode": settings.QA_ANSWER_MODE,
+            },
+            "settings": {
+                "endpoint": options["endpoint"],
+                "api_batch": options["api_batch"],
+                "qa": options["qa"],
+                "stub_qa_ms": options["stub_qa_ms"] if options["qa"] == "stub" else None,
+                "result_cache": options["with_cache"],
+                "requests": options["requests"],
+                "questions": len(questions),
+            },
+            "corpus": {
+                "directory": options["corpus"],
+                "files": len(paths),
+                "seed": options["seed"],
+            },
+            "levels": levels,
+        }
+
+        for level, results in levels.items():
+            self._print_level(level, results)
+
+        if options["json_output"]:
+            with open(options["json_output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+
+        if options["compare"]:
+            regressions = self._compare(report, options["compare"], options["tolerance"])
+
+            if regressions and options["fail_on_regression"]:
+                raise CommandError(f"{len(regressions)} metric(s) regressed: {', '.join(regressions)}")
+
+    def _corpus(self, directory, options):
+        # Reuse the files of an existing corpus directory, or generate a synthetic one
+        if os.path.isdir(directory) and os.listdir(directory):
+            return sorted(os.path.join(root, name) for root, _, files in os.walk(directory) for name in files
+                          if name.endswith(SUPPORTED_EXTENSIONS))
+
+        paths = generate_corpus(directory, files_per_format=options["files_per_format"],
+                                paragraphs_per_file=options["paragraphs"], language=options["language"],
+                                seed=options["seed"])
+        self.stdout.write(f"Generated {len(paths)} files in {directory}")
+        return paths
+
+    def _questions(self, options):
+        if not options["question_file"]:
+            return generate_questions(options["questions"], options["language"], options["seed"])
+
+        with open(options["question_file"], encoding="utf-8") as file:
+            questions = [line.strip() for line in file if line.strip()]
+
+        if not questions:
+            raise CommandError(f"{options['question_file']} contains no question.")
+
+        return questions
+
+    def _index(self, backend, paths, work_directory):
+        # Extract and analyze the corpus in this process, through a private extraction cache, into the test index
+        if not paths:
+            raise CommandError("The corpus contains no supported file.")
+
+        cache = ExtractionCache(os.path.join(work_directory, "extraction"), settings.EXTRACTION_CACHE_MAX_BYTES)
+        analyzer = registry.analyzer
+        start_time = time.time()
+        documents = (analyze_file(analyzer, cache, path) for path in paths)
+        failures = [error for _, error in backend.index(documents) if error is not None]
+
+        if failures:
+            raise CommandError(f"{len(failures)} document(s) failed to index: {failures[0]}")
+
+        self.stdout.write(f"Indexed {len(paths)} files in {time.time() - start_time:.2f} seconds")
+
+    def _run(self, backend, corpus_directory, questions, work_directory, options):
+        # Serve the test index, the QA model and a private result cache through the registry, and run each level
+        if options["qa"] == "stub":
+            answering = StubAnswering(options["stub_qa_ms"] / 1000)
+            tokenizer = answering.tokenizer
+        else:
+            answering, tokenizer = registry.answering, registry.tokenizer
+
+        # Without --with-cache nothing is kept, but concurrent identical requests still share one computation
+        max_entries = settings.RESULT_CACHE_MAX_ENTRIES if options["with_cache"] else 0
+        result_cache = ResultCache(MemoryBackend(max_entries, settings.RESULT_CACHE_TTL),
+                                   os.path.join(work_directory, "index_generations"))
+
+        # The corpus is declared watched so the questions queue no indexing of it, and dense retrieval is off
+        # since the vector index does not hold it
+        overrides = {
+            "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],
+            "WATCHED_DIRECTORIES": [corpus_directory],
+            "DENSE_RETRIEVAL": False,
+        }
+        rng = random.Random(options["seed"])
+        levels = {}
+
+        # The record the middleware logs for every request would drown the report
+        request_logger = logging.getLogger("question_answer.middleware")
+        level = request_logger.level
+        request_logger.setLevel(logging.WARNING)
+
+        try:
+            with override_settings(**overrides), registry.replaced(search_backend=backend, answering=answering,
+                                                                   tokenizer=tokenizer, result_cache=result_cache):
+                if options["warmup"]:
+                    self._run_level(corpus_directory, questions, rng, 1, options["warmup"], options)
+
+                for concurrency in options["concurrency"]:
+                    levels[f"concurrency_{concurrency}"] = self._run_level(corpus_directory, questions, rng,
+                                                                           concurrency, options["requests"], options)
+        finally:
+            request_logger.setLevel(level)
+
+        return levels
+
+    def _run_level(self, corpus_directory, questions, rng, concurrency, count, options):
+        # Send `count` requests from `concurrency` threads, each one sending its next request as soon as the previous
+        # one is answered, and summarize them
+        mix = [[rng.choice(questions) for _ in range(options["api_batch"])] for _ in range(count)]
+        pending = iter(mix)
+        samples = []
+        lock = threading.Lock()
+
+        def client_loop():
+            client = Client(raise_request_exception=False)
+
+            while True:
+                with lock:
+                    request_questions = next(pending, None)
+
+                if request_questions is None:
+                    return
+
+                sample = self._send(client, options["endpoint"], corpus_directory, request_questions)
+
+                with lock:
+                    samples.append(sample)
+
+        threads = [threading.Thread(target=client_loop, daemon=True) for _ in range(concurrency)]
+        start_time = time.perf_counter()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return self._summarize(samples, time.perf_counter() - start_time, options)
+
+    def _send(self, client, endpoint, corpus_directory, questions):
+        # Send one request, read its whole response, and return its latency, stages and outcome
+        path = reverse(ENDPOINTS[endpoint])
+
+        if endpoint == "stream":
+            return asyncio.run(self._send_stream(path, corpus_directory, questions[0]))
+
+        trace, token = start_trace()
+        start_time = time.perf_counter()
+
+        try:
+            if endpoint == "api":
+                payload = {"questions": questions, "filters": {"directory": corpus_directory}}
+                response = client.post(path, json.dumps(payload), content_type="application/json")
+            else:
+                response = client.post(path, {"documents_path": corpus_directory, "question": questions[0]})
+        finally:
+            latency = time.perf_counter() - start_time
+            end_trace(token)
+
+        return {"latency": latency, "first_result": None, "stages": summarize_trace(trace),
+                "error": response.status_code != 200}
+
+    async def _send_stream(self, path, corpus_directory, question):
+        # The streamed answers are read through the ASGI handler, which is what streams them
+        client = AsyncClient(raise_request_exception=False)
+        trace, token = start_trace()
+        start_time = time.perf_counter()
+        first_result = None
+
+        try:
+            response = await client.post(path, {"documents_path": corpus_directory, "question": question})
+            error = response.status_code != 200
+
+            if response.streaming:
+                async for chunk in response.streaming_content:
+                    for line in chunk.decode("utf-8").splitlines():
+                        event = json.loads(line)
+
+                        if event["event"] == "result" and first_result is None:
+                            first_result = time.perf_counter() - start_time
+
+                        error = error or event["event"] == "error"
+        finally:
+            latency = time.perf_counter() - start_time
+            end_trace(token)
+
+        return {"latency": latency, "first_result": first_result, "stages": summarize_trace(trace), "error": error}
+
+    def _summarize(self, samples, elapsed, options):
+        # Latency percentiles and throughput of a level, and the time each stage took per request (stages a
+        # request did not go through count as zero)
+        stages = list(dict.fromkeys(stage for sample in samples for stage in sample["stages"]))
+        first_results = [sample["first_result"] for sample in samples if sample["first_result"] is not None]
+        results = {
+            "requests": len(samples),
+            "errors": sum(sample["error"] for sample in samples),
+            "elapsed_seconds": round(elapsed, 3),
+            "requests_per_second": round(len(samples) / elapsed, 2),
+            "latency": latency_stats([sample["latency"] for sample in samples]),
+            "stages": {
+                stage: latency_stats([sample["stages"].get(stage, 0.0) / 1000 for sample in samples])
+                for stage in stages
+            },
+        }
+
+        if options["endpoint"] == "api":
+            results["questions_per_second"] = round(len(samples) * options["api_batch"] / elapsed, 2)
+
+        if first_results:
+            results["first_result"] = latency_stats(first_results)
+
+        return results
+
+    def _print_level(self, level, results):
+        latency = results["latency"]
+        self.stdout.write(f"{level}: {results['requests_per_second']} requests/s, p50 {latency['p50_ms']} ms, "
+                          f"p95 {latency['p95_ms']} ms, p99 {latency['p99_ms']} ms, {results['errors']} error(s)")
+
+        if "first_result" in results:
+            self.stdout.write(f"  first result: p50 {results['first_result']['p50_ms']} ms, "
+                              f"p95 {results['first_result']['p95_ms']} ms")
+
+        for stage, stats in results["stages"].items():
+            self.stdout.write(f"  {stage}: mean {stats['mean_ms']} ms, p50 {stats['p50_ms']} ms, "
+                              f"p95 {stats['p95_ms']} ms")
+
+    def _compare(self, report, baseline_path, tolerance):
+        # Print the relative change of every metric against a previous run and return the regressed ones,
+        # counting new errors at a level as a regression
+        baseline, regressions = compare_with_baseline(self, report, baseline_path, "levels", tolerance)
+
+        baseline_settings = baseline.get("settings", {})
+        differences = [name for name in COMPARABLE
+                       if name in baseline_settings and baseline_settings[name] != report["settings"][name]]
+
+        if differences:
+            self.stderr.write(f"The baseline was run with other {', '.join(differences)}: its latencies may not be "
+                              f"comparable.")
+
+        for level, results in report["levels"].items():
+            previous_errors = baseline.get("levels", {}).get(level, {}).get("errors", 0)
+
+            if results["errors"] > previous_errors:
+                regressions.append(f"{level}.errors")
+                self.stdout.write(self.style.ERROR(f"{level}.errors: {previous_errors} -> {results['errors']} "
+                                                   f"REGRESSION"))
+
+        return regressions
@@ -0,0 +1,91 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from question_answer.model_resources import ensure_nltk_data, ensure_spacy_model, nltk_packages
+from question_answer.question_answering import QuestionAnswering
+from question_answer.registry import registry
+
+RESOURCES = ("nltk", "spacy", "qa", "dense")
+
+SAMPLE_CONTEXT = "AskMind indexe les documents Word, Excel, PowerPoint et PDF d'un répertoire."
+SAMPLE_QUESTION = "Quels documents AskMind indexe-t-il ?"
+
+
+class Command(BaseCommand):
+    help = ("Download the NLTK data, the spaCy model, the QA checkpoint and the sentence encoder this configuration "
+            "uses into their local caches, and check that each one loads, so the server and workers never reach "
+            "the network (set QA_LOCAL_FILES_ONLY = True on air-gapped hosts).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true",
+                            help="Only check that everything is already available locally, without downloading.")
+        parser.add_argument("--all", action="store_true",
+                            help="Also prepare the spaCy model and the sentence encoder when TEXT_ANALYSIS and "
+                                 "DENSE_RETRIEVAL do not use them.")
+        parser.add_argument("--skip", nargs="+", default=[], choices=RESOURCES, help="Resources not to prepare.")
+
+    def handle(self, *args, **options):
+        download = not options["check"]
+        steps = {
+            "nltk": self.prepare_nltk,
+            "spacy": self.prepare_spacy,
+            "qa": self.prepare_qa,
+            "dense": self.prepare_dense,
+        }
+        wanted = {
+            "nltk": True,
+            "spacy": options["all"] or settings.TEXT_ANALYSIS == 'python',
+            "qa": True,
+            "dense": options["all"] or settings.DENSE_RETRIEVAL,
+        }
+        failures = []
+
+        for name in RESOURCES:
+            if not wanted[name] or name in options["skip"]:
+                continue
+
+            start_time = time.time()
+
+            try:
+                description = steps[name](download, options["all"])
+            except Exception as e:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: {type(e).__name__}: {e}"))
+            else:
+                self.stdout.write(f"{name}: {description} ({time.time() - start_time:.1f} seconds)")
+
+        if failures:
+            raise CommandError(f"Not ready: {', '.join(failures)}")
+
+        self.stdout.write(self.style.SUCCESS("Every resource is available locally."))
+
+    def prepare_nltk(self, download, everything):
+        packages = nltk_packages('python' if everything else settings.TEXT_ANALYSIS)
+        ensure_nltk_data(packages, download=download)
+        return f"NLTK packages {', '.join(packages)}"
+
+    def prepare_spacy(self, download, everything):
+        import spacy
+
+        ensure_spacy_model(settings.SPACY_MODEL, download=download)
+        nlp = spacy.load(settings.SPACY_MODEL)
+        return f"spaCy model {settings.SPACY_MODEL} ({', '.join(nlp.pipe_names)})"
+
+    def prepare_qa(self, download, everything):
+        # Load the checkpoint through the configured backend (which exports it once for 'onnx'), then answer once
+        model_name = registry.answering_model_name()
+        answering = QuestionAnswering(model_name, backend=settings.QA_BACKEND, cache_dir=settings.QA_MODEL_CACHE_DIR,
+                                      local_files_only=not download, export_dir=settings.QA_ONNX_DIR,
+                                      max_seq_len=settings.QA_MAX_SEQ_LEN, doc_stride=settings.QA_DOC_STRIDE)
+        answer, _ = answering.generate_answer(SAMPLE_CONTEXT, SAMPLE_QUESTION)
+        return f"QA model {model_name} on {settings.QA_BACKEND}, sample answer {answer!r}"
+
+    def prepare_dense(self, download, everything):
+        from question_answer.sentence_encoder import SentenceEncoder
+
+        encoder = SentenceEncoder(settings.DENSE_MODEL_NAME, cache_dir=settings.QA_MODEL_CACHE_DIR,
+                                  local_files_only=not download)
+        encoder.encode([SAMPLE_QUESTION])
+        return f"sentence encoder {settings.DENSE_MODEL_NAME} ({encoder.dimension} dimensions)"
@@ -0,0 +1,48 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from question_answer.inference_server import InferenceServer
+from question_answer.registry import registry
+
+
+class Command(BaseCommand):
+    help = ("Run the inference worker answering the questions of every web worker in micro-batches, so only one "
+            "process runs the QA model. Web workers use it when QA_INFERENCE_ADDRESS is set.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--address", default=settings.QA_INFERENCE_ADDRESS,
+                            help="Socket path or host:port to listen on. Defaults to QA_INFERENCE_ADDRESS.")
+        parser.add_argument("--max-queue", type=int, default=settings.QA_INFERENCE_MAX_QUEUE,
+                            help="Pairs waiting past which new requests are refused as busy.")
+        parser.add_argument("--batch-window", type=float, default=settings.QA_INFERENCE_BATCH_WINDOW,
+                            help="Seconds to wait for more pairs to batch with the first one.")
+        parser.add_argument("--max-batch", type=int, default=settings.QA_INFERENCE_MAX_BATCH,
+                            help="Pairs per batch; a batch starts at once when this many are waiting.")
+        parser.add_argument("--threads", type=int, default=settings.QA_TORCH_THREADS,
+                            help="Torch intra-op threads. Defaults to QA_TORCH_THREADS (one per core when unset).")
+        parser.add_argument("--interop-threads", type=int, default=settings.QA_TORCH_INTEROP_THREADS,
+                            help="Torch inter-op threads. Defaults to QA_TORCH_INTEROP_THREADS.")
+
+    def handle(self, *args, **options):
+        if not options["address"]:
+            raise CommandError("No address to listen on: pass --address or set QA_INFERENCE_ADDRESS.")
+
+        answering = registry.load_answering_model(options["threads"], options["interop_threads"])
+        server = InferenceServer(answering, options["address"], authkey=settings.SECRET_KEY.encode(),
+                                 max_queue=options["max_queue"], batch_window=options["batch_window"],
+                                 max_batch_size=options["max_batch"], batch_size=settings.QA_BATCH_SIZE)
+
+        # Stop as on Ctrl+C when the process manager terminates the worker
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        self.stdout.write(f"Answering with {answering.model_name} on {options['address']}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+
+        self.stdout.write(f"Stopped: {server.stats()}")
@@ -0,0 +1,76 @@
+import logging
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from question_answer.directory_watcher import DirectoryWatcher
+from question_answer.registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Watch directories and re-index only the files that are created, modified, moved or deleted, as soon "
+            "as they change, so questions about them never need a full walk of the directory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("directories", nargs="*",
+                            help="Directories to watch recursively. Defaults to the WATCHED_DIRECTORIES setting.")
+        parser.add_argument("--debounce", type=float, default=settings.WATCH_DEBOUNCE_SECONDS,
+                            help="Seconds without any change before a burst of changes is indexed.")
+        parser.add_argument("--max-delay", type=float, default=settings.WATCH_MAX_DELAY_SECONDS,
+                            help="Seconds after which changes are indexed even if more keep coming.")
+        parser.add_argument("--skip-initial-scan", action="store_true",
+                            help="Do not walk the directories once at startup to catch up with the changes made "
+                                 "while they were not watched.")
+
+    def handle(self, *args, **options):
+        directories = [os.path.abspath(directory)
+                       for directory in options["directories"] or settings.WATCHED_DIRECTORIES]
+
+        if not directories:
+            raise CommandError("No directories to watch: pass them as arguments or set WATCHED_DIRECTORIES.")
+
+        for directory in directories:
+            if not os.path.isdir(directory):
+                raise CommandError(f"{directory} is not a directory.")
+
+        watcher = DirectoryWatcher(directories, debounce=options["debounce"], max_delay=options["max_delay"])
+
+        # Watch before the initial scan so the changes made while it runs are not missed
+        watcher.start()
+        self.stdout.write(f"Watching {', '.join(directories)}")
+
+        try:
+            if not options["skip_initial_scan"]:
+                for directory in directories:
+                    message, _ = registry.searcher(directory).collect_data()
+                    self.stdout.write(f"{directory}: {message}")
+
+            while True:
+                for root, (file_paths, changed_directories) in watcher.batcher.wait().items():
+                    self.update(watcher, root, file_paths, changed_directories)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.stop()
+
+    def update(self, watcher, root, file_paths, directories):
+        # Index one batch of changes of a root directory, queueing them again if the index could not be updated
+        try:
+            message, _ = registry.searcher(root).update_paths(file_paths, directories)
+        except Exception:
+            logger.exception("Failed to update the index of %s, retrying with the next batch", root,
+                             extra={"directory": root})
+
+            for file_path in file_paths:
+                watcher.batcher.add_file(file_path)
+
+            for directory in directories:
+                watcher.batcher.add_directory(directory)
+        else:
+            self.stdout.write(f"{root}: {message}")
+        finally:
+            close_old_connections()
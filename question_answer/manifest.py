@@ -0,0 +1,124 @@
+import os
+
+from .models import IndexedFile
+from .utils import content_hash, document_id
+
+
+class IndexManifest:
+    """
+    Persistent record of the files indexed under a directory.
+
+    Each entry keeps the size, modification time and content hash of the file
+    when it was indexed, so a re-scan only needs a stat() per file and hashes
+    the ones whose size or mtime moved.
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, directory, file_paths=None, subdirectories=None):
+        # Load every entry under directory, or only those of file_paths and of the files under subdirectories
+        # when either is given, so updating a few files does not read the manifest of a whole share
+        # path__startswith is a LIKE on SQLite, which ignores the case: the prefix is checked again here, so the
+        # entries of /data/docs never count as deleted files of /data/Docs
+        self.directory = os.path.join(directory, "")
+
+        if file_paths is None and subdirectories is None:
+            self.entries = {
+                entry.path: entry
+                for entry in IndexedFile.objects.filter(path__startswith=self.directory)
+                if entry.path.startswith(self.directory)
+            }
+            return
+
+        self.entries = {}
+        file_paths = list(file_paths or ())
+
+        for start in range(0, len(file_paths), self.BATCH_SIZE):
+            for entry in IndexedFile.objects.filter(path__in=file_paths[start:start + self.BATCH_SIZE]):
+                self.entries[entry.path] = entry
+
+        for subdirectory in subdirectories or ():
+            prefix = os.path.join(subdirectory, "")
+
+            for entry in IndexedFile.objects.filter(path__startswith=prefix):
+                if entry.path.startswith(prefix):
+                    self.entries[entry.path] = entry
+
+    def scan(self, file_paths):
+        """
+        Compare the given files against the manifest.
+
+        Every loaded entry missing from file_paths counts as deleted, so file_paths must
+        list all the existing files of the loaded scope.
+
+        Returns:
+            changed (list): (file_path, size, mtime, content_hash) for every new or modified file.
+            deleted (list): Paths recorded in the manifest that no longer exist.
+        """
+        changed = []
+        touched = []
+        seen = set()
+
+        for file_path in file_paths:
+            seen.add(file_path)
+
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+
+            entry = self.entries.get(file_path)
+
+            if entry is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+                continue
+
+            file_hash = content_hash(file_path)
+
+            if entry is not None and entry.content_hash == file_hash:
+                # Only the metadata moved (e.g. the file was copied back in place)
+                entry.size = stat.st_size
+                entry.mtime = stat.st_mtime
+                touched.append(entry)
+            else:
+                changed.append((file_path, stat.st_size, stat.st_mtime, file_hash))
+
+        if touched:
+            IndexedFile.objects.bulk_update(touched, ["size", "mtime"], batch_size=self.BATCH_SIZE)
+
+        deleted = [path for path in self.entries if path not in seen]
+        return changed, deleted
+
+    def record(self, files):
+        """Store or refresh the entries of the given (file_path, size, mtime, content_hash) tuples."""
+        entries = [
+            IndexedFile(path=file_path, document_id=document_id(file_path),
+                        size=size, mtime=mtime, content_hash=file_hash)
+            for file_path, size, mtime, file_hash in files
+        ]
+        IndexedFile.objects.bulk_create(
+            entries,
+            batch_size=self.BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["path"],
+            update_fields=["document_id", "size", "mtime", "content_hash", "indexed_at"],
+        )
+
+        for entry in entries:
+            self.entries[entry.path] = entry
+
+    def forget(self, file_paths):
+        """Remove the entries of the given paths."""
+        file_paths = list(file_paths)
+
+        for start in range(0, len(file_paths), self.BATCH_SIZE):
+            IndexedFile.objects.filter(path__in=file_paths[start:start + self.BATCH_SIZE]).delete()
+
+        for file_path in file_paths:
+            self.entries.pop(file_path, None)
+
+    @staticmethod
+    def clear():
+        """Remove the entries of every directory and return their paths."""
+        file_paths = list(IndexedFile.objects.values_list("path", flat=True))
+        IndexedFile.objects.all().delete()
+        return file_paths
@@ -0,0 +1,103 @@
+import cProfile
+import io
+import logging
+import pstats
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .instrumentation import REQUEST_SECONDS, end_trace, start_trace, summarize_trace
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentationMiddleware:
+    """
+    Times every request into askmind_request_seconds and logs one structured record
+    per request with the time spent in each pipeline stage.
+
+    With REQUEST_PROFILING enabled, requests carrying a `profile` query parameter
+    are also run under cProfile: the hottest functions are logged and the stage
+    breakdown is returned in a Server-Timing header, which browsers show in their
+    developer tools. Streamed responses are measured until their headers are sent.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        # Under ASGI, await the views instead of having Django run this middleware in a thread
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        profiler = self._profiler(request)
+        trace, token = start_trace()
+        start_time = time.perf_counter()
+
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start_time
+            end_trace(token)
+
+        return self._record(request, response, trace, duration, profiler)
+
+    async def __acall__(self, request):
+        profiler = self._profiler(request)
+        trace, token = start_trace()
+        start_time = time.perf_counter()
+
+        # The profiler also sees the other tasks the event loop runs in the meantime
+        if profiler is not None:
+            profiler.enable()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+
+            duration = time.perf_counter() - start_time
+            end_trace(token)
+
+        return self._record(request, response, trace, duration, profiler)
+
+    @staticmethod
+    def _profiler(request):
+        if settings.REQUEST_PROFILING and "profile" in request.GET:
+            return cProfile.Profile()
+
+        return None
+
+    @staticmethod
+    def _record(request, response, trace, duration, profiler):
+        # Observe and log the request, and add the profile when it was profiled
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else "unmatched"
+        REQUEST_SECONDS.observe(duration, view=view, method=request.method, status=response.status_code)
+
+        stages = summarize_trace(trace)
+        logger.info("%s %s %s in %.1f ms", request.method, request.path, response.status_code, duration * 1000,
+                    extra={"view": view, "status": response.status_code, "duration_ms": round(duration * 1000, 3),
+                           "stages": stages})
+
+        if profiler is not None:
+            response["Server-Timing"] = ", ".join(
+                [f"{stage};dur={milliseconds:.1f}" for stage, milliseconds in stages.items()]
+                + [f"total;dur={duration * 1000:.1f}"])
+
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(30)
+            logger.info("Profile of %s %s", request.method, request.path, extra={"profile": output.getvalue()})
+
+        return response
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.6 on 2026-10-18 12:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('document_id', models.CharField(max_length=40)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
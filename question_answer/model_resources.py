@@ -0,0 +1,65 @@
+"""
+Data and models fetched from the network on first use: NLTK data and the spaCy model.
+
+Both are looked up locally first. When missing, they are downloaded, unless
+`download` is False (QA_LOCAL_FILES_ONLY), in which case MissingResource says
+how to fetch them ahead of time with the prepare_models command, so air-gapped
+hosts fail fast instead of waiting on the network in the middle of a request.
+"""
+import importlib
+import os
+
+# NLTK package -> resource path checked by nltk.data.find()
+NLTK_PACKAGES = {
+    "stopwords": "corpora/stopwords",
+    "punkt": "tokenizers/punkt",
+}
+
+
+class MissingResource(LookupError):
+    """A model or data package is not available locally and may not be downloaded."""
+
+
+def nltk_packages(text_analysis):
+    """Return the NLTK packages the given TEXT_ANALYSIS needs: the stopwords, and Punkt for the Python analysis."""
+    return ["stopwords", "punkt"] if text_analysis == "python" else ["stopwords"]
+
+
+def ensure_nltk_data(packages, download=True):
+    """
+    Make sure the NLTK packages are available, downloading the missing ones when allowed.
+
+    They are looked up and downloaded in the default NLTK data directories (or NLTK_DATA),
+    which the extraction worker processes search too.
+    """
+    import nltk
+
+    for package in packages:
+        try:
+            nltk.data.find(NLTK_PACKAGES[package])
+        except LookupError:
+            if not download:
+                raise MissingResource(f"The NLTK package {package!r} is not installed: "
+                                      f"run 'python manage.py prepare_models' on a host with network access")
+
+            if not nltk.download(package, quiet=True):
+                raise MissingResource(f"Failed to download the NLTK package {package!r}")
+
+
+def ensure_spacy_model(name, download=True):
+    """
+    Make sure the spaCy model is available, installing its package with pip (spacy download) when allowed.
+
+    `name` may also be the path of a model directory, which is only checked.
+    """
+    import spacy
+
+    if os.path.isdir(name) or spacy.util.is_package(name):
+        return
+
+    if not download:
+        raise MissingResource(f"The spaCy model {name!r} is not installed: "
+                              f"run 'python manage.py prepare_models' on a host with network access")
+
+    spacy.cli.download(name)
+    importlib.invalidate_caches()  # So this process finds the package pip just installed
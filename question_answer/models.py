@@ -1,3 +1,15 @@
 from django.db import models
 
-# Create your models here.
+
+class IndexedFile(models.Model):
+    """Manifest entry for a file whose content is currently in the search index."""
+
+    path = models.CharField(max_length=1024, unique=True)
+    document_id = models.CharField(max_length=40)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    content_hash = models.CharField(max_length=64)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path
@@ -0,0 +1,122 @@
+import math
+
+import numpy as np
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several scorings of the same items by reciprocal rank.
+
+    Each ranking contributes 1 / (k + rank) to the items it retrieved, so scores
+    on different scales (BM25, cosine similarity) can be combined without
+    calibrating them against each other.
+
+    Args:
+        rankings (list): One array of scores per ranking, aligned on the same items;
+            NaN marks the items a ranking did not retrieve.
+        k (int): Damping of the top ranks.
+
+    Returns:
+        numpy.ndarray: The fused score of every item, 0 for items no ranking retrieved.
+    """
+    fused = np.zeros(len(rankings[0]))
+
+    for scores in rankings:
+        scores = np.asarray(scores, dtype=np.float64)
+        retrieved = ~np.isnan(scores)
+        ranks = np.empty(len(scores))
+        ranks[np.argsort(-np.where(retrieved, scores, -np.inf), kind="stable")] = np.arange(1, len(scores) + 1)
+        fused += np.where(retrieved, 1.0 / (k + ranks), 0.0)
+
+    return fused
+
+
+def approximate_token_count(text):
+    # About 4 word pieces for every 3 words of French text with an English vocabulary
+    return math.ceil(len(text.split()) * 4 / 3)
+
+
+class PassageRanker:
+    """
+    Lexical (BM25) pre-ranker deciding which passages of a file reach the QA model.
+
+    Passages are scored against the analyzed query, then the best ones are kept
+    as long as they fit in `token_budget` model tokens (and at most `top_k` of
+    them), so the QA cost of a file is bounded however large the document is.
+    With dense retrieval, the BM25 ranking is fused with the embedding one first.
+    """
+
+    def __init__(self, token_budget=1024, top_k=5, k1=1.2, b=0.75, count_tokens=approximate_token_count):
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self.k1 = k1
+        self.b = b
+        self.count_tokens = count_tokens
+
+    def score(self, query_terms, passage_terms):
+        """
+        Return the BM25 score of every passage, the corpus being the given passages.
+
+        Args:
+            query_terms (list): The analyzed query terms.
+            passage_terms (list): The analyzed terms of each passage.
+
+        Returns:
+            numpy.ndarray: One score per passage.
+        """
+        query_index = {term: i for i, term in enumerate(dict.fromkeys(query_terms))}
+        num_passages = len(passage_terms)
+        num_terms = len(query_index)
+        lengths = np.fromiter((len(terms) for terms in passage_terms), dtype=np.int64, count=num_passages)
+
+        if num_passages == 0 or num_terms == 0:
+            return np.zeros(num_passages)
+
+        # Flatten every passage into one array of query term indices (-1 for other terms)
+        # and count the occurrences of each query term in each passage at once
+        flat_terms = np.fromiter((query_index.get(term, -1) for terms in passage_terms for term in terms),
+                                 dtype=np.int64, count=int(lengths.sum()))
+        owners = np.repeat(np.arange(num_passages), lengths)
+        matches = flat_terms >= 0
+        tf = np.bincount(owners[matches] * num_terms + flat_terms[matches],
+                         minlength=num_passages * num_terms).reshape(num_passages, num_terms)
+
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((num_passages - df + 0.5) / (df + 0.5))
+        average_length = lengths.mean() or 1.0
+        norms = self.k1 * (1 - self.b + self.b * lengths / average_length)
+
+        return (tf * (self.k1 + 1) / (tf + norms[:, None]) * idf).sum(axis=1)
+
+    def select(self, query_terms, passages, processed_passages, dense_scores=None):
+        """
+        Return the best passages that fit in the token budget, most relevant first.
+
+        Args:
+            query_terms (list): The analyzed query terms.
+            passages (list): The raw passage texts.
+            processed_passages (list): The analyzed text of each passage.
+            dense_scores (list): The similarity of each passage with the query embedding (NaN when
+                dense retrieval did not find it), fused with the BM25 scores when given.
+        """
+        scores = self.score(query_terms, [processed.split() for processed in processed_passages])
+
+        if dense_scores is not None:
+            scores = reciprocal_rank_fusion([np.where(scores > 0, scores, np.nan), dense_scores])
+        selected = []
+        used_tokens = 0
+
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] <= 0 or len(selected) >= self.top_k:
+                break
+
+            tokens = self.count_tokens(passages[i])
+
+            # The best passage is always kept, the QA model windows it if it is too long
+            if selected and used_tokens + tokens > self.token_budget:
+                continue
+
+            selected.append(passages[i])
+            used_tokens += tokens
+
+        return selected
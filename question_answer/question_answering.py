@@ -1,14 +1,28 @@
 import logging
-from transformers import pipeline, AutoTokenizer, AutoModelForQuestionAnswering
+
+from .inference_backends import load_pipeline
+
 logger = logging.getLogger(__name__)
 
-class QuestionAnswering:
-    def __init__(self):
-        # Initialize the tokenizer and model for question answering
-        self.tokenizer = AutoTokenizer.from_pretrained("bert-large-uncased-whole-word-masking-finetuned-squad")
-        self.model = AutoModelForQuestionAnswering.from_pretrained("bert-large-uncased-whole-word-masking-finetuned-squad")
-        self.nlp = pipeline("question-answering", model=self.model, tokenizer=self.tokenizer, top_k=1)
+DEFAULT_MODEL_NAME = "bert-large-uncased-whole-word-masking-finetuned-squad"
 
+# Smaller SQuAD checkpoint: about 40% of the parameters of bert-large, for a few points of F1
+DISTILLED_MODEL_NAME = "distilbert-base-cased-distilled-squad"
+
+
+class QuestionAnswering:
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, backend="torch", cache_dir=None, local_files_only=False,
+                 export_dir=None, max_seq_len=384, doc_stride=128):
+        # Initialize the tokenizer and model for question answering with the chosen inference backend.
+        # Contexts longer than max_seq_len tokens are split into windows overlapping by doc_stride tokens.
+        self.model_name = model_name
+        self.backend = backend
+        self.max_seq_len = max_seq_len
+        self.doc_stride = doc_stride
+        self.nlp = load_pipeline(backend, model_name, cache_dir=cache_dir, local_files_only=local_files_only,
+                                 export_dir=export_dir)
+        self.tokenizer = self.nlp.tokenizer
+        self.model = self.nlp.model
 
     def generate_answer(self, context, question):
         """
@@ -22,7 +36,8 @@ class QuestionAnswering:
             answer (str): The generated answer to the question.
             confidence (float): The confidence score associated with the answer.
         """
-        output = self.nlp(question=question, context=context)
+        output = self.nlp(question=question, context=context, max_seq_len=self.max_seq_len,
+                          doc_stride=self.doc_stride)
 
         # Check if no answer was found
         if not output['answer']:
@@ -31,3 +46,37 @@ class QuestionAnswering:
         answer = output['answer']
         confidence = output['score']
         return answer, confidence
+
+    def generate_answers(self, pairs, batch_size=8):
+        """
+        Generate answers for several (context, question) pairs in batched forward passes.
+
+        Args:
+            pairs (list): The (context, question) pairs to answer.
+            batch_size (int): The number of pairs given to the model at once.
+
+        Returns:
+            list: An (answer, confidence) tuple for every pair, in order.
+        """
+        if not pairs:
+            return []
+
+        outputs = self.nlp(context=[context for context, _ in pairs],
+                           question=[question for _, question in pairs],
+                           batch_size=batch_size,
+                           max_seq_len=self.max_seq_len,
+                           doc_stride=self.doc_stride)
+
+        # The pipeline unwraps the list when it is given a single pair
+        if isinstance(outputs, dict):
+            outputs = [outputs]
+
+        answers = []
+
+        for output in outputs:
+            if not output['answer']:
+                answers.append(("No answer found.", 0.0))
+            else:
+                answers.append((output['answer'], output['score']))
+
+        return answers
@@ -0,0 +1,342 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .document_indexer import DocumentSearcher
+from .extraction_cache import ExtractionCache
+from .extractors import ExtractionLimits
+from .inference_backends import TORCH_BACKENDS, load_tokenizer, set_torch_threads
+from .inference_server import InferenceClient
+from .instrumentation import metrics
+from .model_resources import ensure_nltk_data, ensure_spacy_model, nltk_packages
+from .question_answering import DISTILLED_MODEL_NAME, QuestionAnswering
+from .passage_ranker import PassageRanker
+from .result_cache import FileBackend, MemoryBackend, ResultCache
+from .search_backends import ElasticsearchBackend, SQLiteBackend
+from .text_analyzer import EngineAnalyzer, TextAnalyzer
+from .vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the heavy resources used to answer questions.
+
+    The text analyzer (with TEXT_ANALYSIS = 'python', the spaCy model it is built
+    on and its lemma cache), the NLTK data, the extraction and result caches, the
+    search backend (Elasticsearch connection pool or SQLite database), the sentence
+    encoder and vector index of dense retrieval (with DENSE_RETRIEVAL), the
+    question answering pipeline and its tokenizer (which the passage ranker
+    uses without the model) are loaded once per process (either lazily on
+    first use or up front through warm()) and then borrowed by every request.
+    """
+
+    RESOURCES = ("nltk", "nlp", "analyzer", "extraction_cache", "result_cache", "passage_ranker", "search_backend",
+                 "encoder", "vector_index", "answering", "tokenizer")
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._resources = {}
+
+    def _load_nltk(self):
+        # Check the NLTK data once instead of for every searcher; only download it when allowed
+        ensure_nltk_data(nltk_packages(settings.TEXT_ANALYSIS), download=not settings.QA_LOCAL_FILES_ONLY)
+        return True
+
+    def _load_nlp(self):
+        import spacy
+
+        ensure_spacy_model(settings.SPACY_MODEL, download=not settings.QA_LOCAL_FILES_ONLY)
+        return spacy.load(settings.SPACY_MODEL)
+
+    def _load_analyzer(self):
+        self.get("nltk")
+
+        if settings.TEXT_ANALYSIS == 'engine':
+            return EngineAnalyzer(cache_size=settings.ANALYZER_CACHE_SIZE)
+
+        return TextAnalyzer(self.nlp, cache_size=settings.ANALYZER_CACHE_SIZE, batch_size=settings.ANALYZER_BATCH_SIZE)
+
+    def _load_extraction_cache(self):
+        limits = ExtractionLimits(max_file_bytes=settings.EXTRACTION_MAX_FILE_BYTES,
+                                  max_pages=settings.EXTRACTION_MAX_PAGES,
+                                  max_cells=settings.EXTRACTION_MAX_CELLS,
+                                  max_passages=settings.EXTRACTION_MAX_PASSAGES)
+        return ExtractionCache(settings.EXTRACTION_CACHE_DIR, settings.EXTRACTION_CACHE_MAX_BYTES, limits)
+
+    def _load_result_cache(self):
+        if settings.RESULT_CACHE_BACKEND == 'file':
+            backend = FileBackend(settings.RESULT_CACHE_DIR, settings.RESULT_CACHE_MAX_ENTRIES, settings.RESULT_CACHE_TTL)
+        else:
+            backend = MemoryBackend(settings.RESULT_CACHE_MAX_ENTRIES, settings.RESULT_CACHE_TTL)
+
+        return ResultCache(backend, settings.INDEX_GENERATION_DIR)
+
+    def _load_passage_ranker(self):
+        # Count tokens with the QA tokenizer, loaded on the first ranking since only the answer stage needs it
+        return PassageRanker(token_budget=settings.QA_CONTEXT_TOKEN_BUDGET, top_k=settings.PASSAGES_PER_FILE,
+                             count_tokens=lambda text: len(self.tokenizer.tokenize(text)))
+
+    def _load_search_backend(self):
+        if settings.SEARCH_BACKEND == 'sqlite':
+            # FTS5 has no French analysis: with 'engine', the backend analyzes the text with the EngineAnalyzer
+            analyzer = self.analyzer if settings.TEXT_ANALYSIS == 'engine' else None
+            return SQLiteBackend(settings.SQLITE_SEARCH_DB, chunk_size=settings.INDEXING_BULK_CHUNK_SIZE,
+                                 text_analysis=settings.TEXT_ANALYSIS, analyzer=analyzer)
+
+        from elasticsearch import Elasticsearch
+
+        es = Elasticsearch(settings.ELASTICSEARCH_HOST, connections_per_node=settings.ELASTICSEARCH_CONNECTIONS)
+        return ElasticsearchBackend(es, chunk_size=settings.INDEXING_BULK_CHUNK_SIZE,
+                                    text_analysis=settings.TEXT_ANALYSIS,
+                                    max_chunk_bytes=settings.INDEXING_BULK_MAX_BYTES,
+                                    target_seconds=settings.INDEXING_BULK_TARGET_SECONDS,
+                                    max_retries=settings.INDEXING_BULK_MAX_RETRIES)
+
+    def _load_encoder(self):
+        # Imports torch, so only when dense retrieval is enabled
+        from .sentence_encoder import SentenceEncoder
+
+        return SentenceEncoder(settings.DENSE_MODEL_NAME, cache_dir=settings.QA_MODEL_CACHE_DIR,
+                               local_files_only=settings.QA_LOCAL_FILES_ONLY, batch_size=settings.DENSE_BATCH_SIZE)
+
+    def _load_vector_index(self):
+        return VectorIndex(settings.DENSE_INDEX_DIR, self.encoder.dimension, settings.DENSE_MODEL_NAME,
+                           dtype=settings.DENSE_DTYPE, ivf_lists=settings.DENSE_IVF_LISTS,
+                           ivf_probes=settings.DENSE_IVF_PROBES)
+
+    def _load_answering(self):
+        # With an inference worker, only its client (and the tokenizer) lives in the web processes
+        if settings.QA_INFERENCE_ADDRESS:
+            return InferenceClient(settings.QA_INFERENCE_ADDRESS, self.answering_model_name(),
+                                   authkey=settings.SECRET_KEY.encode(), cache_dir=settings.QA_MODEL_CACHE_DIR,
+                                   local_files_only=settings.QA_LOCAL_FILES_ONLY, timeout=settings.QA_INFERENCE_TIMEOUT)
+
+        return self.load_answering_model()
+
+    def _load_tokenizer(self):
+        # The tokenizer of the QA model alone, for the passage ranker: borrowed from the answering resource when it
+        # is loaded already or only holds a tokenizer anyway (inference worker client), never loading the model
+        answering = self._resources.get("answering")
+
+        if answering is None and settings.QA_INFERENCE_ADDRESS:
+            answering = self.answering
+
+        if answering is not None:
+            return answering.tokenizer
+
+        return load_tokenizer(self.answering_model_name(), cache_dir=settings.QA_MODEL_CACHE_DIR,
+                              local_files_only=settings.QA_LOCAL_FILES_ONLY)
+
+    def answering_model_name(self):
+        return DISTILLED_MODEL_NAME if settings.QA_USE_DISTILLED_MODEL else settings.QA_MODEL_NAME
+
+    def load_answering_model(self, torch_threads=None, torch_interop_threads=None):
+        """
+        Load the question answering model in this process, whatever QA_INFERENCE_ADDRESS says.
+
+        The torch thread counts, only used by the torch backends, default to QA_TORCH_THREADS and
+        QA_TORCH_INTEROP_THREADS.
+        """
+        # Importing torch to size its thread pools would only slow down the start of the ONNX backend
+        if settings.QA_BACKEND in TORCH_BACKENDS:
+            set_torch_threads(torch_threads or settings.QA_TORCH_THREADS,
+                              torch_interop_threads or settings.QA_TORCH_INTEROP_THREADS)
+
+        return QuestionAnswering(self.answering_model_name(), backend=settings.QA_BACKEND,
+                                 cache_dir=settings.QA_MODEL_CACHE_DIR, local_files_only=settings.QA_LOCAL_FILES_ONLY,
+                                 export_dir=settings.QA_ONNX_DIR, max_seq_len=settings.QA_MAX_SEQ_LEN,
+                                 doc_stride=settings.QA_DOC_STRIDE)
+
+    def _build(self, name):
+        start_time = time.time()
+        resource = getattr(self, f"_load_{name}")()
+        logger.info("Loaded %s in %.2f seconds", name, time.time() - start_time)
+        return resource
+
+    def get(self, name):
+        """Return the shared resource called `name`, loading it on first use."""
+        resource = self._resources.get(name)
+
+        if resource is None:
+            with self._lock:
+                resource = self._resources.get(name)
+
+                if resource is None:
+                    resource = self._build(name)
+                    self._resources[name] = resource
+
+        return resource
+
+    @property
+    def nlp(self):
+        return self.get("nlp")
+
+    @property
+    def analyzer(self):
+        return self.get("analyzer")
+
+    @property
+    def extraction_cache(self):
+        return self.get("extraction_cache")
+
+    @property
+    def result_cache(self):
+        return self.get("result_cache")
+
+    @property
+    def passage_ranker(self):
+        return self.get("passage_ranker")
+
+    @property
+    def search_backend(self):
+        return self.get("search_backend")
+
+    @property
+    def encoder(self):
+        return self.get("encoder")
+
+    @property
+    def vector_index(self):
+        return self.get("vector_index")
+
+    @property
+    def answering(self):
+        return self.get("answering")
+
+    @property
+    def tokenizer(self):
+        return self.get("tokenizer")
+
+    def searcher(self, data_directory):
+        """Return a DocumentSearcher for `data_directory` backed by the shared resources."""
+        self.get("nltk")
+        # The spaCy model is only needed to analyze the text in Python
+        nlp = self.nlp if settings.TEXT_ANALYSIS == 'python' else None
+        dense = settings.DENSE_RETRIEVAL
+        return DocumentSearcher(data_directory, search_backend=self.search_backend, nlp=nlp,
+                                analyzer=self.analyzer, extraction_cache=self.extraction_cache, result_cache=self.result_cache,
+                                passage_ranker=self.passage_ranker,
+                                spacy_model=settings.SPACY_MODEL,
+                                extraction_workers=settings.INDEXING_EXTRACTION_WORKERS,
+                                extraction_max_pending=settings.INDEXING_MAX_PENDING_FILES,
+                                pdf_pages_per_task=settings.EXTRACTION_PDF_PAGES_PER_TASK,
+                                bulk_chunk_size=settings.INDEXING_BULK_CHUNK_SIZE,
+                                passage_candidates=settings.PASSAGE_CANDIDATES_PER_FILE,
+                                text_analysis=settings.TEXT_ANALYSIS,
+                                vector_index=self.vector_index if dense else None,
+                                encoder=self.encoder if dense else None,
+                                dense_candidates=settings.DENSE_CANDIDATES,
+                                dense_min_similarity=settings.DENSE_MIN_SIMILARITY,
+                                fusion_candidates=settings.DENSE_FUSION_CANDIDATES,
+                                checkpoint_files=settings.INDEXING_CHECKPOINT_FILES)
+
+    def collect_metrics(self):
+        """Report the hit and miss counts of the caches loaded so far (see instrumentation.MetricsRegistry)."""
+        hits, misses = [], []
+        resources = dict(self._resources)
+
+        if "extraction_cache" in resources:
+            cache = resources["extraction_cache"]
+            hits.append(({"cache": "extraction"}, cache.hits))
+            misses.append(({"cache": "extraction"}, cache.misses))
+
+        if "result_cache" in resources:
+            stats = resources["result_cache"].stats()
+            hits.append(({"cache": "result"}, stats["hits"]))
+            misses.append(({"cache": "result"}, stats["misses"]))
+
+        if "analyzer" in resources:
+            info = resources["analyzer"].cache_info()
+            hits.append(({"cache": "lemma"}, info.hits))
+            misses.append(({"cache": "lemma"}, info.misses))
+
+        collected = [
+            ("askmind_cache_hits_total", "counter", "Cache hits, by cache.", hits),
+            ("askmind_cache_misses_total", "counter", "Cache misses, by cache.", misses),
+        ]
+
+        if isinstance(resources.get("answering"), InferenceClient):
+            stats = resources["answering"].stats()
+            collected.append(("askmind_inference_requests_total", "counter",
+                              "Requests sent to the inference worker, by outcome (ok, busy or error).",
+                              [({"outcome": outcome}, count) for outcome, count in sorted(stats.items())]))
+
+        return collected
+
+    def warm(self):
+        """Load every resource now so the first request does not pay for it."""
+        for name in self.RESOURCES:
+            if name == "nlp" and settings.TEXT_ANALYSIS != 'python':
+                continue  # Only the Python text analysis uses the spaCy model
+
+            if name in ("encoder", "vector_index") and not settings.DENSE_RETRIEVAL:
+                continue
+
+            try:
+                self.get(name)
+            except Exception:
+                logger.exception("Failed to warm %s, it will be loaded on first use", name)
+
+    def reload(self, *names):
+        """
+        Replace the given resources (all of them by default) with freshly loaded ones.
+
+        Each new object is built before it is swapped in, so requests already
+        holding the old one finish with it while new requests pick up the
+        replacement. Reloading the spaCy model also rebuilds the analyzer.
+        """
+        names = set(names or self.RESOURCES)
+
+        if "nlp" in names:
+            names.add("analyzer")
+
+        for name in self.RESOURCES:
+            if name not in names:
+                continue
+
+            resource = self._build(name)
+
+            with self._lock:
+                previous = self._resources.get(name)
+                self._resources[name] = resource
+
+            closable = name in ("search_backend", "vector_index") or isinstance(previous, InferenceClient)
+
+            if closable and previous is not None:
+                previous.close()
+
+    @contextmanager
+    def replaced(self, **resources):
+        """
+        Serve the given objects instead of the named resources within the block, e.g. a search backend
+        over a test corpus and a stub QA model for the load_test command, then put the previous ones back.
+
+        Nothing is closed: the caller owns the replacements, and the previous resources are kept as they were.
+        """
+        unknown = set(resources) - set(self.RESOURCES)
+
+        if unknown:
+            raise ValueError(f"Unknown resources: {', '.join(sorted(unknown))}")
+
+        with self._lock:
+            previous = {name: self._resources.get(name) for name in resources}
+            self._resources.update(resources)
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                for name, resource in previous.items():
+                    if resource is None:
+                        self._resources.pop(name, None)
+                    else:
+                        self._resources[name] = resource
+
+
+registry = ModelRegistry()
+metrics.register_collector(registry.collect_metrics)
@@ -0,0 +1,319 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .utils import directory_ancestors
+
+
+class MemoryBackend:
+    """In-process LRU store whose entries expire `ttl` seconds after they were written."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # Return (found, value)
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return False, None
+
+            expires_at, value = entry
+
+            if expires_at < time.time():
+                del self._entries[key]
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class FileBackend:
+    """
+    LRU store kept as one pickle file per entry in a local directory, so the
+    cache survives restarts and is shared by every process on the host.
+    """
+
+    SUFFIX = ".pickle"
+
+    def __init__(self, directory, max_entries, ttl):
+        self.directory = str(directory)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._count = None  # Measured on the first write
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as file:
+                expires_at, value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+
+        if expires_at < time.time():
+            self.delete(key)
+            return False, None
+
+        try:
+            os.utime(path)  # Mark the entry as recently used
+        except OSError:
+            pass
+
+        return True, value
+
+    def set(self, key, value):
+        # Write to a temporary file first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump((time.time() + self.ttl, value), file)
+        os.replace(temp_path, self._path(key))
+
+        with self._lock:
+            if self._count is None:
+                self._count = sum(1 for name in os.listdir(self.directory) if name.endswith(self.SUFFIX))
+            else:
+                self._count += 1
+
+            over_budget = self._count > self.max_entries
+
+        if over_budget:
+            self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Remove the least recently used entries until 90% of max_entries remain
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                path = os.path.join(self.directory, name)
+
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    continue
+
+        entries.sort()
+        excess = max(0, len(entries) - int(self.max_entries * 0.9))
+
+        for _, path in entries[:excess]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        with self._lock:
+            self._count = len(entries) - excess
+
+
+class _InFlight:
+    # A computation other threads asking for the same key wait for
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    Two-level cache of question answering results.
+
+    - Retrieval results (matching files, relevant paragraphs) are keyed by the
+      normalized processed query and the index generation of the directory they
+      were searched in: a marker file per directory, replaced whenever a file under
+      that directory is indexed or removed, so an indexing run invalidates the
+      results of the directories it changed (and of their ancestors) in every
+      process at once, and leaves the others cached.
+    - QA outputs are keyed by the hashes of the question and of the context they
+      were computed on: a changed file yields different passages, hence different
+      keys, and the outdated entries are never served again before they age out.
+
+    Concurrent requests for a key that is being computed wait for that computation
+    instead of starting their own.
+    """
+
+    # Markers read by every entry (replaced when the whole index is rebuilt) and by the
+    # entries searched in no particular directory (replaced on every change)
+    ALL = "all"
+    ANY = "any"
+
+    def __init__(self, backend, generation_directory):
+        self.backend = backend
+        self.generation_directory = str(generation_directory)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    @staticmethod
+    def _key(*parts):
+        return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+    def _marker(self, name):
+        return os.path.join(self.generation_directory, name)
+
+    @staticmethod
+    def _directory_marker(directory):
+        return hashlib.sha256(os.path.abspath(directory).encode("utf-8")).hexdigest()
+
+    def _read_marker(self, name):
+        try:
+            stat = os.stat(self._marker(name))
+        except OSError:
+            return "0"
+
+        return f"{stat.st_ino}-{stat.st_mtime_ns}"
+
+    def _replace_marker(self, name):
+        # Replace the marker file, which gives it a new inode and modification time
+        os.makedirs(self.generation_directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.generation_directory)
+        with os.fdopen(fd, "w") as file:
+            file.write(uuid.uuid4().hex)
+        os.replace(temp_path, self._marker(name))
+
+    def generation(self, directory=None):
+        """
+        Return a token that changes whenever a file under `directory` is indexed or removed,
+        or whenever the index changes if no directory is given.
+        """
+        scope = self.ANY if directory is None else self._directory_marker(directory)
+        return f"{self._read_marker(self.ALL)}:{self._read_marker(scope)}"
+
+    def bump_generation(self, file_paths=None):
+        """Change the generation of the directories holding the given files, or of every directory if None."""
+        if file_paths is None:
+            self._replace_marker(self.ALL)
+            return
+
+        directories = set()
+
+        for file_path in file_paths:
+            directories.update(directory_ancestors(os.path.abspath(file_path)))
+
+        for directory in directories:
+            self._replace_marker(self._directory_marker(directory))
+
+        self._replace_marker(self.ANY)
+
+    def get_or_compute(self, key, compute, should_cache=None):
+        """
+        Return the cached value of `key`, or compute, store and return it.
+
+        Args:
+            key (str): The cache key.
+            compute (callable): Computes the value on a miss.
+            should_cache (callable): Optional predicate; values it rejects are returned but not stored.
+        """
+        found, value = self.backend.get(key)
+
+        if found:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self._lock:
+            self.misses += 1
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            in_flight.done.wait()
+
+            if in_flight.error is not None:
+                raise in_flight.error
+
+            return in_flight.value
+
+        try:
+            in_flight.value = compute()
+
+            if should_cache is None or should_cache(in_flight.value):
+                self.backend.set(key, in_flight.value)
+
+            return in_flight.value
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+    def retrieval(self, parts, compute, should_cache=None, directory=None):
+        """
+        Cache a retrieval result identified by `parts` (e.g. the processed query) for the current
+        index of `directory`, the directory (or the file) the result was searched in.
+        """
+        return self.get_or_compute(self._key("retrieval", self.generation(directory), *parts), compute,
+                                   should_cache)
+
+    def _answer_key(self, question, context):
+        return self._key("answer", hashlib.sha256(question.encode("utf-8")).hexdigest(),
+                         hashlib.sha256(context.encode("utf-8")).hexdigest())
+
+    def answer(self, question, context, compute):
+        """Cache the (answer, confidence) of `question` over `context`."""
+        return self.get_or_compute(self._answer_key(question, context), compute)
+
+    def cached_answer(self, question, context):
+        """Return (found, (answer, confidence)) without computing anything."""
+        found, value = self.backend.get(self._answer_key(question, context))
+
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return found, value
+
+    def store_answer(self, question, context, value):
+        self.backend.set(self._answer_key(question, context), value)
+
+    def index_changed(self, file_paths=None):
+        """
+        Invalidate, in every process, the retrieval results of the directories holding the given
+        indexed or removed files, or every retrieval result if None.
+        """
+        self.bump_generation(file_paths)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,734 @@
+"""
+Search backends storing the indexed documents and passages.
+
+- ``elasticsearch``: a "documents" and a "passages" index on an Elasticsearch
+  cluster, for large corpora and deployments shared between several hosts.
+- ``sqlite``: an embedded SQLite database with FTS5 full-text tables ranked
+  with bm25, for small and medium corpora that should not need an external
+  service (single host, development, CI).
+
+Both have the same interface, so DocumentSearcher does not know which one it
+is talking to, but they do not rank alike: Elasticsearch scores with Lucene's
+BM25 and SQLite with the bm25() of FTS5, so scores and ties differ.
+
+With `text_analysis = "python"` both receive the terms produced by TextAnalyzer
+and index them as they are. With "engine" they receive the raw text:
+Elasticsearch analyzes documents and queries with FRENCH_ANALYSIS, while FTS5
+has no French analysis (its unicode61 tokenizer only lowercases and splits
+words), so SQLiteBackend analyzes them in Python with EngineAnalyzer, whose
+Snowball stemmer approximates the light_french stemmer of Elasticsearch, and
+indexes those terms. Any of the terms of a query may match, on both backends.
+
+Each backend records the mode its indices were built with and raises
+IndexMismatch when the configured one differs.
+"""
+import logging
+import os
+import sqlite3
+import threading
+
+from .adaptive_bulk import BulkStats, ChunkSizer, bulk_index
+from .utils import directory_ancestors, document_id
+
+logger = logging.getLogger(__name__)
+
+# French analysis run by Elasticsearch on the raw text, at index and query time alike
+FRENCH_ANALYSIS = {
+    "filter": {
+        "french_elision": {
+            "type": "elision",
+            "articles_case": True,
+            "articles": ["l", "m", "t", "qu", "n", "s", "j", "d", "c", "jusqu", "quoiqu", "lorsqu", "puisqu"]
+        },
+        "french_stop": {"type": "stop", "stopwords": "_french_"},
+        "french_stemmer": {"type": "stemmer", "language": "light_french"}
+    },
+    "analyzer": {
+        "french_text": {
+            "tokenizer": "standard",
+            "filter": ["french_elision", "lowercase", "french_stop", "french_stemmer", "asciifolding"]
+        }
+    }
+}
+
+
+# The directory of each file and all its ancestors, and its lowercase extension, so restricting a search to a
+# directory (recursively) or to extensions is a cacheable term filter instead of a prefix or wildcard query
+PATH_FIELDS = {"directories": {"type": "keyword"}, "extension": {"type": "keyword"}}
+
+
+def document_index_mappings(text_analysis):
+    # The searched text of each file is only indexed, its source is never read back
+    field = "text" if text_analysis == "engine" else "processed_text"
+    return {
+        "_meta": {"text_analysis": text_analysis},
+        "_source": {"excludes": [field]},
+        "properties": {
+            "file_path": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            **PATH_FIELDS,
+            field: {"type": "text", "analyzer": "french_text" if text_analysis == "engine" else "whitespace"}
+        }
+    }
+
+
+def passage_index_mappings(text_analysis):
+    # Passages are stored in their own index so the answer stage can fetch the best ones with a single query.
+    # Raw passages are searched directly, pre-analyzed ones through their processed_text.
+    properties = {
+        "file_id": {"type": "keyword"},
+        "file_path": {"type": "keyword"},
+        "kind": {"type": "keyword"},
+        "position": {"type": "integer"},
+        "location": {"type": "keyword", "index": False},
+    }
+
+    if text_analysis == "engine":
+        properties["text"] = {"type": "text", "analyzer": "french_text"}
+    else:
+        properties["text"] = {"type": "text", "index": False}
+        properties["processed_text"] = {"type": "text", "analyzer": "whitespace"}
+
+    return {"_meta": {"text_analysis": text_analysis}, "properties": properties}
+
+
+def path_matches(file_path, filters):
+    # Whether the file passes the "directory" and "extensions" filters of SearchBackend.search()
+    if not filters:
+        return True
+
+    if filters.get("directory") and not file_path.startswith(os.path.join(os.path.normpath(filters["directory"]), "")):
+        return False
+
+    return not filters.get("extensions") or file_path.lower().endswith(
+        tuple(extension.lower() for extension in filters["extensions"]))
+
+
+class IndexMismatch(RuntimeError):
+    """
+    Raised when an existing index was built with another TEXT_ANALYSIS mode than the configured one,
+    or without the fields the current searches need.
+    """
+
+
+class SearchBackend:
+    """
+    Storage and retrieval of the (file_path, processed_text, passages) documents.
+
+    `index` consumes the documents lazily and yields (file_path, error) once the
+    document and every passage of a file are stored, `error` being None on success.
+    """
+
+    def create_indices(self):
+        # Create the indices with their mappings, or check the existing ones (see IndexMismatch)
+        pass
+
+    def recreate_indices(self):
+        # Drop every document and passage and create empty indices with the current mappings
+        raise NotImplementedError
+
+    def index(self, documents):
+        raise NotImplementedError
+
+    def delete(self, file_paths):
+        # Remove the documents and passages of the given files
+        raise NotImplementedError
+
+    def delete_passages(self, file_paths):
+        raise NotImplementedError
+
+    def search(self, processed_query, size, filters=None):
+        # Return the best [{"file_path", "score"}] matches of the analyzed query, best first.
+        # `filters` may restrict the files to a "directory" (recursively) and to a list of "extensions".
+        raise NotImplementedError
+
+    def search_many(self, processed_queries, size, filters=None):
+        # Return the search() results of several queries, in one round trip when the backend allows it
+        return [self.search(processed_query, size, filters) for processed_query in processed_queries]
+
+    def search_passages(self, file_path, processed_query, size):
+        # Return the best (text, processed_text) passages of a file, best first
+        raise NotImplementedError
+
+    def has_passages(self, file_path):
+        raise NotImplementedError
+
+    def bulk_stats(self):
+        # Counters of the bulk requests sent so far: "requests", "actions", "bytes", "retries" and "failed"
+        return {}
+
+    def index_settings(self):
+        # {index: {setting: value}} of the settings a bulk load overrides (see the index_corpus command)
+        return {}
+
+    def update_index_settings(self, index_settings):
+        # Apply {index: {setting: value}} settings, None resetting a setting to its default
+        pass
+
+    def optimize(self, max_num_segments=1):
+        # Merge the index segments after a large load, making them visible to searches
+        pass
+
+    def close(self):
+        pass
+
+
+class ElasticsearchBackend(SearchBackend):
+    """
+    Documents and passages in the "documents" and "passages" indices of an Elasticsearch cluster.
+
+    Documents are sent with adaptive_bulk.bulk_index(): bulk requests start at
+    `chunk_size` actions and are resized to take about `target_seconds` each,
+    within `max_chunk_bytes`, and the documents a busy cluster rejects are retried
+    up to `max_retries` times.
+    """
+
+    INDICES = ("documents", "passages")
+
+    def __init__(self, es, chunk_size=500, text_analysis="engine", max_chunk_bytes=10 * 1024 ** 2,
+                 target_seconds=1.0, max_retries=8, thread_count=4):
+        self.es = es
+        self.chunk_size = chunk_size
+        self.text_analysis = text_analysis
+        self.field = "text" if text_analysis == "engine" else "processed_text"  # The searched field
+        self.sizer = ChunkSizer(chunk_size, minimum=min(50, chunk_size), max_bytes=max_chunk_bytes,
+                                target_seconds=target_seconds)
+        self.max_retries = max_retries
+        self.thread_count = thread_count
+        self.stats = BulkStats()
+        self._indices_checked = False
+
+    def create_indices(self):
+        # Indices created before the mappings were explicit have no _meta: they hold pre-analyzed text
+        if self._indices_checked:
+            return
+
+        for name, mappings in (("documents", document_index_mappings(self.text_analysis)),
+                               ("passages", passage_index_mappings(self.text_analysis))):
+            if not self.es.indices.exists(index=name):
+                self.es.indices.create(index=name, settings={"analysis": FRENCH_ANALYSIS}, mappings=mappings)
+                continue
+
+            mapping = self.es.indices.get_mapping(index=name)[name]["mappings"]
+            text_analysis = mapping.get("_meta", {}).get("text_analysis", "python")
+
+            if text_analysis != self.text_analysis:
+                raise IndexMismatch(f"The {name} index was built with TEXT_ANALYSIS = '{text_analysis}': run "
+                                    f"'python manage.py index_corpus --recreate <directory>' to rebuild the indices "
+                                    f"with '{self.text_analysis}'.")
+
+            if name == "documents" and not set(PATH_FIELDS) <= set(mapping.get("properties", {})):
+                # Its documents have no directory and extension to filter by: every filtered search would miss them
+                raise IndexMismatch("The documents index was built before the directory and extension fields: run "
+                                    "'python manage.py index_corpus --recreate <directory>' to rebuild the indices, "
+                                    "then index every other directory again.")
+
+        self._indices_checked = True
+
+    def recreate_indices(self):
+        self.es.indices.delete(index=list(self.INDICES), ignore_unavailable=True)
+        self._indices_checked = False
+        self.create_indices()
+
+    def index(self, documents):
+        # Index each document under an ID derived from its path, along with one document per passage.
+        # Actions are generated lazily so bulk_index only ever holds a few chunks of documents in memory.
+        self.create_indices()
+
+        paths = {}  # In-flight action IDs -> file paths
+        remaining = {}  # File paths -> actions not acknowledged yet
+        failed = {}  # File paths -> first error
+
+        def actions():
+            for file_path, processed_text, passages in documents:
+                file_id = document_id(file_path)
+                remaining[file_path] = len(passages) + 1
+
+                for passage, processed_passage in passages:
+                    passage_id = f"{file_id}-{passage.position}"
+                    paths[passage_id] = file_path
+                    source = {
+                        "file_id": file_id,
+                        "file_path": file_path,
+                        "kind": passage.kind,
+                        "position": passage.position,
+                        "location": passage.location,
+                        "text": passage.text
+                    }
+
+                    if self.text_analysis != "engine":
+                        source["processed_text"] = processed_passage
+
+                    yield {"_op_type": "index", "_index": "passages", "_id": passage_id, "_source": source}
+
+                paths[file_id] = file_path
+                yield {
+                    "_op_type": "index",
+                    "_index": "documents",
+                    "_id": file_id,
+                    "_source": {
+                        "file_path": file_path,
+                        "directories": directory_ancestors(file_path),
+                        "extension": os.path.splitext(file_path)[1].lower(),
+                        self.field: processed_text
+                    }
+                }
+
+        for action, error in bulk_index(self.es, actions(), self.sizer, thread_count=self.thread_count,
+                                        max_retries=self.max_retries, stats=self.stats):
+            file_path = paths.pop(action["_id"])
+
+            if error is not None:
+                failed.setdefault(file_path, error)
+
+            remaining[file_path] -= 1
+
+            if remaining[file_path] == 0:
+                del remaining[file_path]
+                yield file_path, failed.pop(file_path, None)
+
+    def delete(self, file_paths):
+        from elasticsearch.helpers import parallel_bulk
+
+        file_paths = list(file_paths)
+        actions = (
+            {"_op_type": "delete", "_index": "documents", "_id": document_id(file_path)}
+            for file_path in file_paths
+        )
+
+        for success, info in parallel_bulk(self.es, actions, index="documents", raise_on_error=False):
+            if not success and info.get("delete", {}).get("status") != 404:
+                logger.warning("Failed to delete document: %s", info)
+
+        self.delete_passages(file_paths)
+
+    def delete_passages(self, file_paths, batch_size=1000):
+        file_ids = [document_id(file_path) for file_path in file_paths]
+
+        if not file_ids or not self.es.indices.exists(index="passages"):
+            return
+
+        for start in range(0, len(file_ids), batch_size):
+            self.es.delete_by_query(index="passages", conflicts="proceed",
+                                    query={"terms": {"file_id": file_ids[start:start + batch_size]}})
+
+    def _filter_clauses(self, filters):
+        # Filter context clauses, which Elasticsearch caches and does not score
+        clauses = []
+
+        if filters.get("directory"):
+            clauses.append({"term": {"directories": os.path.normpath(filters["directory"])}})
+
+        if filters.get("extensions"):
+            clauses.append({"terms": {"extension": [extension.lower() for extension in filters["extensions"]]}})
+
+        return clauses
+
+    def _search_body(self, processed_query, size, filters):
+        query = {"match": {self.field: processed_query}}
+        clauses = self._filter_clauses(filters or {})
+
+        if clauses:
+            query = {"bool": {"must": query, "filter": clauses}}
+
+        return {
+            "query": query,
+            "size": size,
+            "sort": [
+                {
+                    "_score": {
+                        "order": "desc"  # Sort by descending score to get the most relevant results first
+                    }
+                }
+            ]
+        }
+
+    @staticmethod
+    def _file_hits(response):
+        return [{"file_path": hit["_source"]["file_path"], "score": hit["_score"]} for hit in response["hits"]["hits"]]
+
+    def search(self, processed_query, size, filters=None):
+        # Check once that the indices were built with the configured analysis mode, as SQLiteBackend does
+        self.create_indices()
+        response = self.es.search(index="documents", body=self._search_body(processed_query, size, filters))
+        return self._file_hits(response)
+
+    def search_many(self, processed_queries, size, filters=None):
+        # One msearch request for every query
+        self.create_indices()
+        searches = []
+
+        for processed_query in processed_queries:
+            searches.extend([{"index": "documents"}, self._search_body(processed_query, size, filters)])
+
+        if not searches:
+            return []
+
+        results = []
+
+        for response in self.es.msearch(searches=searches)["responses"]:
+            if "error" in response:
+                logger.warning("Search failed in a multi-search: %s", response["error"])
+                results.append([])
+            else:
+                results.append(self._file_hits(response))
+
+        return results
+
+    def search_passages(self, file_path, processed_query, size):
+        self.create_indices()
+        search_query = {
+            "bool": {
+                "must": {"match": {self.field: processed_query}},
+                "filter": {"term": {"file_id": document_id(file_path)}}
+            }
+        }
+        response = self.es.search(index="passages", query=search_query, size=size, source=["text", self.field])
+        return [(hit["_source"]["text"], hit["_source"][self.field]) for hit in response["hits"]["hits"]]
+
+    def has_passages(self, file_path):
+        self.create_indices()
+        response = self.es.count(index="passages", query={"term": {"file_id": document_id(file_path)}})
+        return response["count"] > 0
+
+    def bulk_stats(self):
+        return {**self.stats.snapshot(), "chunk_size": self.sizer.size}
+
+    def index_settings(self):
+        # Unset settings are reported as None, so restoring them resets them to their default
+        self.create_indices()
+        index_settings = {}
+
+        for name in self.INDICES:
+            values = self.es.indices.get_settings(index=name, flat_settings=True)[name]["settings"]
+            index_settings[name] = {
+                "refresh_interval": values.get("index.refresh_interval"),
+                "number_of_replicas": values.get("index.number_of_replicas"),
+            }
+
+        return index_settings
+
+    def update_index_settings(self, index_settings):
+        for name, values in index_settings.items():
+            self.es.indices.put_settings(index=name, settings={f"index.{key}": value for key, value in values.items()})
+
+    def optimize(self, max_num_segments=1):
+        # Merging a large index takes long: wait for it without the usual request timeout
+        es = self.es.options(request_timeout=24 * 60 * 60)
+        es.indices.refresh(index=",".join(self.INDICES))
+        es.indices.forcemerge(index=",".join(self.INDICES), max_num_segments=max_num_segments)
+
+    def close(self):
+        self.es.close()
+
+
+class SQLiteBackend(SearchBackend):
+    """
+    Documents and passages in a local SQLite database, searched with FTS5.
+
+    The rows live in plain tables and the FTS5 tables index their
+    processed_text as external content, kept in sync by triggers. The database
+    runs in WAL mode so searches never wait for an indexing run, documents are
+    inserted in one transaction per `chunk_size` rows, and every statement is
+    a constant string so each thread's connection reuses its prepared form.
+
+    With `text_analysis = "engine"`, processed_text holds the terms of the raw
+    text analyzed by `analyzer` (an EngineAnalyzer, built when not given), and
+    queries are analyzed the same way before they are matched.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            file_id TEXT NOT NULL UNIQUE,
+            file_path TEXT NOT NULL,
+            processed_text TEXT NOT NULL
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            processed_text, content='documents', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_fts(rowid, processed_text) VALUES (new.id, new.processed_text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, processed_text)
+            VALUES ('delete', old.id, old.processed_text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
+            INSERT INTO documents_fts(documents_fts, rowid, processed_text)
+            VALUES ('delete', old.id, old.processed_text);
+            INSERT INTO documents_fts(rowid, processed_text) VALUES (new.id, new.processed_text);
+        END;
+
+        CREATE TABLE IF NOT EXISTS passages (
+            id INTEGER PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            location TEXT NOT NULL,
+            text TEXT NOT NULL,
+            processed_text TEXT NOT NULL,
+            UNIQUE (file_id, position)
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5(
+            processed_text, content='passages', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS passages_ai AFTER INSERT ON passages BEGIN
+            INSERT INTO passages_fts(rowid, processed_text) VALUES (new.id, new.processed_text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS passages_ad AFTER DELETE ON passages BEGIN
+            INSERT INTO passages_fts(passages_fts, rowid, processed_text)
+            VALUES ('delete', old.id, old.processed_text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS passages_au AFTER UPDATE ON passages BEGIN
+            INSERT INTO passages_fts(passages_fts, rowid, processed_text)
+            VALUES ('delete', old.id, old.processed_text);
+            INSERT INTO passages_fts(rowid, processed_text) VALUES (new.id, new.processed_text);
+        END;
+    """
+
+    UPSERT_DOCUMENT = (
+        "INSERT INTO documents (file_id, file_path, processed_text) VALUES (?, ?, ?) "
+        "ON CONFLICT (file_id) DO UPDATE SET file_path = excluded.file_path, processed_text = excluded.processed_text"
+    )
+    UPSERT_PASSAGE = (
+        "INSERT INTO passages (file_id, position, kind, location, text, processed_text) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (file_id, position) DO UPDATE SET kind = excluded.kind, location = excluded.location, "
+        "text = excluded.text, processed_text = excluded.processed_text"
+    )
+    DELETE_DOCUMENT = "DELETE FROM documents WHERE file_id = ?"
+    DELETE_PASSAGES = "DELETE FROM passages WHERE file_id = ?"
+    SEARCH = (
+        "SELECT documents.file_path, bm25(documents_fts) AS rank FROM documents_fts "
+        "JOIN documents ON documents.id = documents_fts.rowid "
+        "WHERE documents_fts MATCH ?{filters} ORDER BY rank LIMIT ?"
+    )
+    PATH_LIKE = "documents.file_path LIKE ? ESCAPE '\\'"
+    SEARCH_PASSAGES = (
+        "SELECT passages.text, passages.processed_text, bm25(passages_fts) AS rank FROM passages_fts "
+        "JOIN passages ON passages.id = passages_fts.rowid "
+        "WHERE passages_fts MATCH ? AND passages.file_id = ? ORDER BY rank LIMIT ?"
+    )
+    HAS_PASSAGES = "SELECT 1 FROM passages WHERE file_id = ? LIMIT 1"
+
+    def __init__(self, path, chunk_size=500, timeout=30, text_analysis="python", analyzer=None):
+        self.path = str(path)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.text_analysis = text_analysis
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._indices_checked = False
+
+        if text_analysis == "engine":
+            if analyzer is None:
+                from .text_analyzer import EngineAnalyzer
+
+                analyzer = EngineAnalyzer()
+
+            self._analyze = analyzer.ranking_text
+        else:
+            self._analyze = None
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        # One connection per thread, in autocommit mode so transactions are delimited explicitly
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False, cached_statements=256)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")  # Durable enough in WAL mode, and much faster
+            connection.execute("PRAGMA temp_store = MEMORY")
+            self._local.connection = connection
+
+            with self._lock:
+                self._connections.append(connection)
+
+        return connection
+
+    def create_indices(self):
+        # Record the analysis mode of a new database, or check the one an existing database was built with.
+        # Databases built before the mode was recorded are only accepted while empty.
+        if self._indices_checked:
+            return
+
+        connection = self._connection()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT value FROM meta WHERE key = 'text_analysis'").fetchone()
+
+            if row is None:
+                if connection.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is not None:
+                    raise IndexMismatch(f"The SQLite index {self.path} was built before its TEXT_ANALYSIS mode was "
+                                        f"recorded: run 'python manage.py index_corpus --recreate <directory>' to "
+                                        f"rebuild it.")
+
+                connection.execute("INSERT INTO meta (key, value) VALUES ('text_analysis', ?)", (self.text_analysis,))
+            elif row[0] != self.text_analysis:
+                raise IndexMismatch(f"The SQLite index {self.path} was built with TEXT_ANALYSIS = '{row[0]}': run "
+                                    f"'python manage.py index_corpus --recreate <directory>' to rebuild it with "
+                                    f"'{self.text_analysis}'.")
+
+        self._indices_checked = True
+
+    def recreate_indices(self):
+        # Drop the tables (and their triggers) and create them again in a single transaction
+        connection = self._connection()
+        drop = "".join(f"DROP TABLE IF EXISTS {table};\n"
+                       for table in ("documents_fts", "documents", "passages_fts", "passages", "meta"))
+
+        try:
+            connection.executescript(f"BEGIN IMMEDIATE;\n{drop}{self.SCHEMA}\nCOMMIT;")
+        except BaseException:
+            if connection.in_transaction:
+                connection.rollback()
+            raise
+
+        self._indices_checked = False
+        self.create_indices()
+
+    def _terms(self, text):
+        # The indexed terms of a document, passage or query: analyzed here with TEXT_ANALYSIS = 'engine'
+        return self._analyze(text) if self._analyze is not None else text
+
+    def _match_expression(self, processed_query):
+        # Any analyzed term may match, as in Elasticsearch's match query; quoting keeps FTS5 syntax out of the terms
+        terms = dict.fromkeys(self._terms(processed_query).split())
+        return " OR ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+    def index(self, documents):
+        # Store the documents in transactions of about chunk_size rows, acknowledging their files on commit
+        self.create_indices()
+        connection = self._connection()
+        batch = []
+        rows = 0
+
+        for document in documents:
+            batch.append(document)
+            rows += len(document[2]) + 1
+
+            if rows >= self.chunk_size:
+                yield from self._write_batch(connection, batch)
+                batch = []
+                rows = 0
+
+        if batch:
+            yield from self._write_batch(connection, batch)
+
+    def _write_batch(self, connection, batch):
+        try:
+            connection.execute("BEGIN")
+
+            for file_path, processed_text, passages in batch:
+                file_id = document_id(file_path)
+                connection.executemany(self.UPSERT_PASSAGE, (
+                    (file_id, passage.position, passage.kind, passage.location, passage.text,
+                     self._terms(processed_passage))
+                    for passage, processed_passage in passages
+                ))
+                connection.execute(self.UPSERT_DOCUMENT, (file_id, file_path, self._terms(processed_text)))
+
+            connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+
+            for file_path, _, _ in batch:
+                yield file_path, e
+            return
+
+        for file_path, _, _ in batch:
+            yield file_path, None
+
+    def delete(self, file_paths):
+        file_ids = [(document_id(file_path),) for file_path in file_paths]
+        connection = self._connection()
+
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(self.DELETE_PASSAGES, file_ids)
+            connection.executemany(self.DELETE_DOCUMENT, file_ids)
+
+    def delete_passages(self, file_paths):
+        file_ids = [(document_id(file_path),) for file_path in file_paths]
+        connection = self._connection()
+
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(self.DELETE_PASSAGES, file_ids)
+
+    @staticmethod
+    def _like_pattern(text):
+        return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    def _filter_sql(self, filters):
+        # Return the SQL conditions of the filters and their parameters
+        conditions = []
+        parameters = []
+
+        if filters.get("directory"):
+            conditions.append(self.PATH_LIKE)
+            parameters.append(self._like_pattern(os.path.join(os.path.normpath(filters["directory"]), "")) + "%")
+
+        if filters.get("extensions"):
+            # LIKE is case-insensitive for ASCII, as the lowercase extension field of Elasticsearch
+            conditions.append("(" + " OR ".join([self.PATH_LIKE] * len(filters["extensions"])) + ")")
+            parameters.extend("%" + self._like_pattern(extension) for extension in filters["extensions"])
+
+        return "".join(f" AND {condition}" for condition in conditions), parameters
+
+    def search(self, processed_query, size, filters=None):
+        self.create_indices()
+        expression = self._match_expression(processed_query)
+
+        if not expression:
+            return []
+
+        # The statement only varies with the shape of the filters, so it stays in the statement cache
+        conditions, parameters = self._filter_sql(filters or {})
+        rows = self._connection().execute(self.SEARCH.format(filters=conditions), (expression, *parameters, size))
+
+        # bm25() is lower for better matches, negate it to get an Elasticsearch-like score
+        return [{"file_path": file_path, "score": -rank} for file_path, rank in rows]
+
+    def search_passages(self, file_path, processed_query, size):
+        self.create_indices()
+        expression = self._match_expression(processed_query)
+
+        if not expression:
+            return []
+
+        rows = self._connection().execute(self.SEARCH_PASSAGES, (expression, document_id(file_path), size))
+
+        # Like Elasticsearch, hand the raw text back as the processed one with 'engine': the ranker analyzes it
+        if self._analyze is not None:
+            return [(text, text) for text, _, _ in rows]
+
+        return [(text, processed_text) for text, processed_text, _ in rows]
+
+    def has_passages(self, file_path):
+        return self._connection().execute(self.HAS_PASSAGES, (document_id(file_path),)).fetchone() is not None
+
+    def optimize(self, max_num_segments=1):
+        # Merge the b-trees of each FTS5 index into one
+        connection = self._connection()
+
+        for table in ("documents_fts", "passages_fts"):
+            connection.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+
+        for connection in connections:
+            connection.close()
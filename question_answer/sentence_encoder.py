@@ -0,0 +1,67 @@
+from functools import lru_cache
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+# Small multilingual paraphrase model (384 dimensions) that handles French questions and passages
+DEFAULT_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+class SentenceEncoder:
+    """
+    Sentence embeddings for dense retrieval, computed on CPU in batches.
+
+    Embeddings are the mean of the last hidden states over the non-padding tokens,
+    L2-normalized, as sentence-transformers computes them for its models, so any
+    of their checkpoints cached locally can be used without that dependency.
+    Texts are sorted by length before batching, so each batch pads to about the
+    same length, and the embeddings of recent queries are memoized.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, cache_dir=None, local_files_only=False, batch_size=32,
+                 max_length=256, query_cache_size=1024):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir=cache_dir,
+                                                       local_files_only=local_files_only)
+        self.model = AutoModel.from_pretrained(model_name, cache_dir=cache_dir, local_files_only=local_files_only)
+        self.model.eval()
+        self.dimension = self.model.config.hidden_size
+        self._query_vector = lru_cache(maxsize=query_cache_size)(self._encode_query)
+
+    def encode(self, texts):
+        """
+        Embed several texts.
+
+        Args:
+            texts (iterable): The texts to embed.
+
+        Returns:
+            numpy.ndarray: One normalized float32 row per text, in order.
+        """
+        texts = list(texts)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                inputs = self.tokenizer([texts[i] for i in batch], padding=True, truncation=True,
+                                        max_length=self.max_length, return_tensors="pt")
+                hidden_states = self.model(**inputs).last_hidden_state
+                mask = inputs["attention_mask"].unsqueeze(-1).to(hidden_states.dtype)
+                pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                embeddings[batch] = torch.nn.functional.normalize(pooled, dim=1).numpy()
+
+        return embeddings
+
+    def _encode_query(self, query):
+        vector = self.encode([query])[0]
+        vector.flags.writeable = False  # Shared by every caller of the cache
+        return vector
+
+    def encode_query(self, query):
+        """Embed a question, through the cache of recent questions."""
+        return self._query_vector(query)
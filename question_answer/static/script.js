@@ -1,17 +1,152 @@
 document.addEventListener('DOMContentLoaded', function() {
     // Get the form element
     var form = document.querySelector('form');
+    var loadingMessage = document.getElementById('loadingMessage');
+    // Whether the current answer stream has rendered anything yet
+    var rendered = false;
+
+    // Without streaming support, let the form be submitted and rendered by the server
+    if (!form.dataset.streamUrl || !window.fetch || !window.TextDecoder || !window.ReadableStream) {
+        return;
+    }
+
+    function addText(parent, tag, text) {
+        // Append an element holding the given text (never parsed as HTML)
+        var element = document.createElement(tag);
+        element.textContent = text;
+        parent.appendChild(element);
+        return element;
+    }
+
+    function resetSection(id, parent) {
+        // Empty the section with the given id, creating it at the end of parent if needed
+        var section = document.getElementById(id);
+
+        if (!section) {
+            section = document.createElement('section');
+            section.id = id;
+            parent.appendChild(section);
+        }
+
+        section.innerHTML = '';
+        return section;
+    }
+
+    function renderResult(result) {
+        // Build the same article as index.html for one file
+        var paragraph = result.Paragraphs[0];
+        var article = document.createElement('article');
+        article.dataset.confidence = paragraph.Confidence;
+
+        addText(article, 'h3', 'Question: ' + result.Question);
+        addText(article, 'h3', 'Answer: ' + paragraph.Answer);
+        addText(article, 'p', '— Answer Processing Time: ' + result.Answer_Processing_Time + 's');
+        addText(article, 'p', 'Confidence: ' + paragraph.Confidence);
+        addText(article, 'p', 'File Path: ' + result.File_Path);
+        addText(article, 'p', '— File Processing Time: ' + result.File_Processing_Time + 's');
+        addText(article, 'p', 'Paragraph:');
+        var textarea = addText(article, 'textarea', paragraph.Paragraph);
+        textarea.rows = 5;
+        textarea.cols = 33;
+        addText(article, 'p', 'Search Processing Time: ' + paragraph.highlight_matching_processing_time + 's');
+        return article;
+    }
+
+    function insertByConfidence(section, article) {
+        // Keep the articles sorted by descending confidence as they arrive
+        var confidence = parseFloat(article.dataset.confidence);
+        var articles = section.querySelectorAll('article');
+
+        for (var i = 0; i < articles.length; i++) {
+            if (parseFloat(articles[i].dataset.confidence) < confidence) {
+                section.insertBefore(article, articles[i]);
+                return;
+            }
+        }
+
+        section.appendChild(article);
+    }
+
+    function handleEvent(event, messageSection, resultsSection, question) {
+        if (event.event === 'started') {
+            addText(messageSection, 'p', event.message);
+        } else if (event.event === 'result') {
+            insertByConfidence(resultsSection, renderResult(event.result));
+        } else if (event.event === 'error') {
+            addText(messageSection, 'p', 'Error: ' + event.error);
+        } else if (event.event === 'done') {
+            loadingMessage.style.display = 'none';
+
+            if (event.results === 0) {
+                var article = document.createElement('article');
+                addText(article, 'h3', 'Question: ' + question);
+                addText(article, 'p', 'No relevant paragraphs found for the query.');
+                resultsSection.appendChild(article);
+            }
+        }
+    }
+
+    async function streamAnswers(formData) {
+        // Read the newline-delimited JSON events of the answer stream and render them as they arrive
+        var main = document.querySelector('main');
+        var messageSection = resetSection('messageSection', form);
+        var resultsSection = resetSection('resultsSection', main);
+        addText(resultsSection, 'h2', 'Results');
+
+        var response = await fetch(form.dataset.streamUrl, {
+            method: 'POST',
+            body: formData,
+            credentials: 'same-origin'
+        });
+
+        if (!response.ok) {
+            throw new Error('The server answered ' + response.status);
+        }
+
+        var reader = response.body.getReader();
+        var decoder = new TextDecoder();
+        var buffer = '';
+
+        while (true) {
+            var chunk = await reader.read();
+
+            if (chunk.done) {
+                break;
+            }
+
+            buffer += decoder.decode(chunk.value, {stream: true});
+            var lines = buffer.split('\n');
+            buffer = lines.pop();
+
+            lines.forEach(function(line) {
+                if (line.trim()) {
+                    handleEvent(JSON.parse(line), messageSection, resultsSection, formData.get('question'));
+                    rendered = true;
+                }
+            });
+        }
+
+        loadingMessage.style.display = 'none';
+    }
 
     // Add an event listener to the form submit event
     form.addEventListener('submit', function(event) {
-        // Prevent the default form submission behavior
+        // Stream the answers instead of waiting for the whole page
         event.preventDefault();
+        rendered = false;
+
+        streamAnswers(new FormData(form)).catch(function(error) {
+            console.error(error);
 
-        // Hide the form
-        form.style.display = 'none';
+            if (!rendered) {
+                // Nothing shown yet: fall back to the regular form submission
+                form.submit();
+                return;
+            }
 
-        // Show the results section
-        var resultsSection = document.querySelector('section');
-        resultsSection.style.display = 'block';
+            // Keep the answers already shown rather than asking the whole question again
+            loadingMessage.style.display = 'none';
+            addText(document.getElementById('messageSection'), 'p', 'Error: the answer stream was interrupted (' + error.message + ').');
+        });
     });
 });
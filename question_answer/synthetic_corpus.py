@@ -0,0 +1,199 @@
+"""
+Reproducible synthetic corpora for the benchmark command.
+
+generate_corpus() writes DOCX, XLSX, PPTX and PDF files made of random
+sentences over a small vocabulary. The same seed always produces the same
+text, so timings measured on two commits are comparable. Each sentence states
+a fact ("<subject> <verb> <object> en <year>") that can be asked about, see
+generate_questions().
+"""
+import os
+import random
+
+from docx import Document
+from openpyxl import Workbook
+from pptx import Presentation
+from pptx.util import Inches
+
+VOCABULARIES = {
+    "fr": {
+        "subjects": ["Le laboratoire", "La direction", "Le service client", "L'équipe technique", "Le conseil",
+                     "La filiale de Lyon", "Le fournisseur", "Le comité qualité", "La cellule d'audit"],
+        "verbs": ["a validé", "a publié", "a livré", "a signé", "a révisé", "a financé", "a suspendu"],
+        "objects": ["le rapport annuel", "le contrat de maintenance", "la procédure de sécurité",
+                    "le budget prévisionnel", "la nouvelle gamme", "le plan de formation", "l'étude clinique"],
+        "fillers": ["après une longue discussion", "conformément aux exigences", "malgré les retards",
+                    "avec le soutien des partenaires", "pour la deuxième fois", "dans les délais prévus"],
+        "question": "Qui {verb} {object} ?",
+        "year": "en",
+    },
+    "en": {
+        "subjects": ["The laboratory", "The board", "The support team", "The engineering group", "The council",
+                     "The Lyon branch", "The supplier", "The quality committee", "The audit unit"],
+        "verbs": ["approved", "published", "delivered", "signed", "revised", "funded", "suspended"],
+        "objects": ["the annual report", "the maintenance contract", "the safety procedure", "the forecast budget",
+                    "the new product line", "the training plan", "the clinical study"],
+        "fillers": ["after a long discussion", "as required", "despite the delays", "with the partners' support",
+                    "for the second time", "on schedule"],
+        "question": "Who {verb} {object}?",
+        "year": "in",
+    },
+}
+
+FORMATS = ("docx", "xlsx", "pptx", "pdf")
+
+
+def _sentence(rng, vocabulary):
+    return (f"{rng.choice(vocabulary['subjects'])} {rng.choice(vocabulary['verbs'])} "
+            f"{rng.choice(vocabulary['objects'])} {rng.choice(vocabulary['fillers'])} "
+            f"{vocabulary['year']} {rng.randint(1990, 2023)}.")
+
+
+def _paragraphs(rng, vocabulary, count, sentences_per_paragraph):
+    return [" ".join(_sentence(rng, vocabulary) for _ in range(sentences_per_paragraph)) for _ in range(count)]
+
+
+def _write_docx(path, paragraphs):
+    document = Document()
+
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+
+    document.save(path)
+
+
+def _write_xlsx(path, paragraphs):
+    # One row per paragraph, one cell per sentence
+    workbook = Workbook()
+    sheet = workbook.active
+
+    for paragraph in paragraphs:
+        sheet.append([sentence.strip() + "." for sentence in paragraph.split(".") if sentence.strip()])
+
+    workbook.save(path)
+
+
+def _write_pptx(path, paragraphs, paragraphs_per_slide=3):
+    presentation = Presentation()
+    layout = presentation.slide_layouts[6]  # Blank
+
+    for start in range(0, len(paragraphs), paragraphs_per_slide):
+        slide = presentation.slides.add_slide(layout)
+
+        for i, paragraph in enumerate(paragraphs[start:start + paragraphs_per_slide]):
+            text_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.5 + 2 * i), Inches(9), Inches(2))
+            text_box.text_frame.word_wrap = True
+            text_box.text_frame.text = paragraph
+
+    presentation.save(path)
+
+
+def _pdf_string(text):
+    # Encode a line as a PDF literal string in the WinAnsi encoding of the standard fonts
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return b"(" + escaped.encode("cp1252", errors="replace") + b")"
+
+
+def _write_pdf(path, paragraphs, lines_per_page=40, line_width=90):
+    # Minimal PDF writer: Helvetica text, no external dependency beyond what PyPDF2 can read back
+    lines = []
+
+    for paragraph in paragraphs:
+        words = paragraph.split()
+        line = ""
+
+        for word in words:
+            if line and len(line) + len(word) + 1 > line_width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+
+        lines.extend([line, ""])
+
+    pages = [lines[start:start + lines_per_page] for start in range(0, len(lines), lines_per_page)] or [[]]
+    font_id = 3
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        font_id: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    }
+    page_ids = []
+
+    for number, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * number, 5 + 2 * number
+        stream = b"BT /F1 10 Tf 14 TL 50 800 Td " + b" ".join(_pdf_string(line) + b" '" for line in page_lines) + b" ET"
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (font_id, content_id))
+        page_ids.append(page_id)
+
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offsets[object_id] for object_id in sorted(objects))
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+
+    with open(path, "wb") as file:
+        file.write(output)
+
+
+WRITERS = {
+    "docx": _write_docx,
+    "xlsx": _write_xlsx,
+    "pptx": _write_pptx,
+    "pdf": _write_pdf,
+}
+
+
+def generate_corpus(directory, files_per_format=10, paragraphs_per_file=50, sentences_per_paragraph=3,
+                    language="fr", formats=FORMATS, seed=0):
+    """
+    Write a synthetic corpus to `directory` and return the paths of its files.
+
+    Args:
+        directory (str): The output directory, created if needed.
+        files_per_format (int): Number of files of each format.
+        paragraphs_per_file (int): Paragraphs (or rows, text boxes, PDF paragraphs) of each file.
+        sentences_per_paragraph (int): Sentences of each paragraph.
+        language (str): One of VOCABULARIES.
+        formats (iterable): The formats to generate, among FORMATS.
+        seed (int): Seed of the random generator; the same seed gives the same corpus.
+
+    Returns:
+        list: The paths of the generated files.
+    """
+    try:
+        vocabulary = VOCABULARIES[language]
+    except KeyError:
+        raise ValueError(f"Unknown language {language!r}, expected one of: {', '.join(VOCABULARIES)}")
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+
+    for file_format in formats:
+        for number in range(files_per_format):
+            path = os.path.join(directory, f"{file_format}-{number:04d}.{file_format}")
+            WRITERS[file_format](path, _paragraphs(rng, vocabulary, paragraphs_per_file, sentences_per_paragraph))
+            paths.append(path)
+
+    return paths
+
+
+def generate_questions(count, language="fr", seed=0):
+    """Return `count` reproducible questions about the facts of a corpus in `language`."""
+    vocabulary = VOCABULARIES[language]
+    rng = random.Random(seed)
+    return [
+        vocabulary["question"].format(verb=rng.choice(vocabulary["verbs"]), object=rng.choice(vocabulary["objects"]))
+        for _ in range(count)
+    ]
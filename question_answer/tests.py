@@ -1,3 +1,877 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .adaptive_bulk import BulkStats, ChunkSizer, bulk_index
+from .directory_watcher import ChangeBatcher
+from .document_indexer import DocumentSearcher
+from .extractors import Passage, extract_passages
+from .indexing_jobs import IndexingQueue
+from .management.commands.benchmark import compare_metrics, flatten_metrics, import_times, latency_stats
+from .manifest import IndexManifest
+from .middleware import InstrumentationMiddleware
+from .models import IndexedFile
+from .passage_ranker import PassageRanker
+from .result_cache import MemoryBackend, ResultCache
+from .search_backends import ElasticsearchBackend, IndexMismatch, SQLiteBackend
+from .synthetic_corpus import FORMATS, generate_corpus, generate_questions
+from .vector_index import VectorIndex
+from .views import parse_question_batch
+
+
+def temporary_directory(test):
+    # A directory removed after the test
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    return directory
+
+
+def passages(*texts):
+    # (passage, processed_passage) pairs of pre-analyzed paragraphs
+    return [(Passage("paragraph", position, f"paragraph {position + 1}", text), text)
+            for position, text in enumerate(texts)]
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class SingularAnalyzer:
+    # Stands for EngineAnalyzer, which needs the NLTK data: lowercases and drops the plural s
+    def ranking_text(self, text):
+        return " ".join(word.rstrip("s") for word in text.lower().split())
+
+
+class SyntheticCorpusTests(SimpleTestCase):
+    def test_every_format_can_be_extracted(self):
+        paths = generate_corpus(temporary_directory(self), files_per_format=1, paragraphs_per_file=6)
+
+        self.assertEqual([os.path.splitext(path)[1][1:] for path in paths], list(FORMATS))
+
+        for path in paths:
+            with self.subTest(path=os.path.basename(path)):
+                self.assertTrue(any(passage.text.strip() for passage in extract_passages(path)))
+
+    def test_same_seed_same_corpus(self):
+        first = generate_corpus(temporary_directory(self), files_per_format=1, paragraphs_per_file=3,
+                                formats=["docx"], seed=7)
+        second = generate_corpus(temporary_directory(self), files_per_format=1, paragraphs_per_file=3,
+                                 formats=["docx"], seed=7)
+
+        self.assertEqual([passage.text for passage in extract_passages(first[0])],
+                         [passage.text for passage in extract_passages(second[0])])
+        self.assertEqual(generate_questions(5, seed=3), generate_questions(5, seed=3))
+
+    def test_unknown_language(self):
+        with self.assertRaises(ValueError):
+            generate_corpus(temporary_directory(self), language="tlh")
+
+
+class BenchmarkMetricsTests(SimpleTestCase):
+    def test_latency_stats(self):
+        stats = latency_stats([0.001, 0.002, 0.003, 0.004])
+
+        self.assertEqual(stats["count"], 4)
+        self.assertEqual(stats["mean_ms"], 2.5)
+        self.assertEqual(stats["p99_ms"], 4.0)
+
+    def test_flatten_metrics_keeps_the_numbers(self):
+        self.assertEqual(flatten_metrics({"search": {"p50_ms": 1.5, "name": "bm25"}, "files": 3}),
+                         {"search.p50_ms": 1.5, "files": 3})
+
+    def test_compare_metrics_direction_and_tolerance(self):
+        previous = {"search.p50_ms": 10.0, "indexing.docs_per_second": 100.0, "answer.p95_ms": 10.0,
+                    "files": 3, "new_ms": 0}
+        current = {"search.p50_ms": 12.0, "indexing.docs_per_second": 80.0, "answer.p95_ms": 10.5,
+                   "files": 30, "new_ms": 5}
+
+        results = {name: regressed for name, _, _, _, regressed in compare_metrics(current, previous, 0.1)}
+
+        # Durations regress when they grow, rates when they fall; counts and zero baselines are not compared
+        self.assertEqual(results, {"answer.p95_ms": False, "indexing.docs_per_second": True,
+                                   "search.p50_ms": True})
+
+    def test_import_times(self):
+        report = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        450 |   json\n"
+                  "import time:        80 |        200 | django\n")
+
+        self.assertEqual(import_times(report), {"json": 450, "django": 200})
+
+
+class IndexManifestTests(TestCase):
+    def setUp(self):
+        self.directory = temporary_directory(self)
+
+    def write(self, name, content, mtime=None, directory=None):
+        path = os.path.join(directory or self.directory, name)
+
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+        return path
+
+    def scan(self, *file_paths, directory=None):
+        manifest = IndexManifest(directory or self.directory)
+        changed, deleted = manifest.scan(list(file_paths))
+        manifest.record(changed)
+        manifest.forget(deleted)
+        return [file_path for file_path, _, _, _ in changed], deleted
+
+    def test_new_files_are_changed(self):
+        a = self.write("a.docx", "a")
+        b = self.write("b.docx", "b")
+
+        self.assertEqual(self.scan(a, b), ([a, b], []))
+        self.assertEqual(self.scan(a, b), ([], []))
+
+    def test_modified_content_is_changed(self):
+        a = self.write("a.docx", "a", mtime=1000)
+        self.scan(a)
+
+        self.write("a.docx", "changed", mtime=2000)
+
+        self.assertEqual(self.scan(a), ([a], []))
+
+    def test_touched_file_with_the_same_content_is_not_changed(self):
+        a = self.write("a.docx", "a", mtime=1000)
+        self.scan(a)
+
+        os.utime(a, (2000, 2000))
+
+        self.assertEqual(self.scan(a), ([], []))
+        self.assertEqual(IndexManifest(self.directory).entries[a].mtime, 2000)
+
+    def test_missing_files_are_deleted(self):
+        a = self.write("a.docx", "a")
+        b = self.write("b.docx", "b")
+        self.scan(a, b)
+
+        self.assertEqual(self.scan(a), ([], [b]))
+        self.assertEqual(list(IndexManifest(self.directory).entries), [a])
+
+    def test_scope_of_the_manifest(self):
+        a = self.write("a.docx", "a")
+        self.scan(a)
+
+        os.makedirs(os.path.join(self.directory, "sub"))
+        other = IndexManifest(os.path.join(self.directory, "sub"))
+
+        self.assertEqual(other.entries, {})
+        self.assertEqual(list(IndexManifest(self.directory, file_paths=[a]).entries), [a])
+
+    def test_directories_differing_in_case_are_distinct(self):
+        lower = os.path.join(self.directory, "docs")
+        upper = os.path.join(self.directory, "Docs")
+        os.makedirs(lower)
+        os.makedirs(upper)
+        a = self.write("a.docx", "a", directory=lower)
+        self.scan(a, directory=lower)
+
+        self.assertEqual(IndexManifest(upper).entries, {})
+        self.assertEqual(IndexManifest(self.directory, subdirectories=[upper]).entries, {})
+        self.assertEqual(self.scan(directory=upper), ([], []))
+        self.assertTrue(IndexedFile.objects.filter(path=a).exists())
+
+    def test_clear_forgets_every_directory(self):
+        a = self.write("a.docx", "a")
+        self.scan(a)
+
+        self.assertEqual(IndexManifest.clear(), [a])
+        self.assertEqual(IndexManifest(self.directory).entries, {})
+
+
+class CollectDataTests(TestCase):
+    class Backend:
+        def delete(self, file_paths):
+            raise AssertionError("Nothing should be deleted")
+
+    def test_missing_directory_leaves_its_files_indexed(self):
+        directory = os.path.join(temporary_directory(self), "unmounted")
+        IndexedFile.objects.create(path=os.path.join(directory, "a.docx"), document_id="a", size=1, mtime=1,
+                                   content_hash="a")
+        searcher = DocumentSearcher(directory, search_backend=self.Backend(), analyzer=object(),
+                                    extraction_cache=object(), passage_ranker=object())
+
+        with self.assertRaises(FileNotFoundError):
+            searcher.collect_data()
+
+        with self.assertRaises(FileNotFoundError):
+            searcher.update_paths(directories=[directory])
+
+        self.assertEqual(IndexedFile.objects.count(), 1)
+
+
+class IndexingQueueTests(SimpleTestCase):
+    def test_refresh_reuses_pending_and_recent_jobs(self):
+        queue = IndexingQueue(0)
+        job = queue.refresh("/docs", max_age=60)
+
+        self.assertIs(queue.refresh("/docs", max_age=60), job)
+
+        job.status, job.finished_at = "done", time.time()
+        self.assertIs(queue.refresh("/docs", max_age=60), job)
+
+        job.finished_at -= 120
+        self.assertIsNot(queue.refresh("/docs", max_age=60), job)
+
+    def test_refresh_retries_failed_jobs(self):
+        queue = IndexingQueue(0)
+        job = queue.refresh("/docs", max_age=60)
+        job.status, job.finished_at = "failed", time.time()
+
+        self.assertIsNot(queue.refresh("/docs", max_age=60), job)
+
+
+class SearchQuestionViewTests(SimpleTestCase):
+    def test_missing_directory_is_refused(self):
+        directory = os.path.join(temporary_directory(self), "missing")
+
+        with mock.patch("question_answer.views.indexing_queue") as queue:
+            response = self.client.post(reverse("ask_question"),
+                                        {"documents_path": directory, "question": "Why?"})
+            stream = self.client.post(reverse("ask_question_stream"),
+                                      {"documents_path": directory, "question": "Why?"})
+
+        self.assertContains(response, "is not an existing directory")
+        self.assertEqual(stream.status_code, 400)
+        queue.refresh.assert_not_called()
+
+    def test_no_matching_file_keeps_the_message(self):
+        prepared = ("Indexing of /docs is queued.", None, None, None, None, 0)
+
+        with mock.patch("question_answer.views.prepare_question", return_value=prepared):
+            response = self.client.post(reverse("ask_question"),
+                                        {"documents_path": "/docs", "question": "Why?"})
+
+        self.assertContains(response, "Indexing of /docs is queued.")
+        self.assertContains(response, "No results yet")
+
+
+class ResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResultCache(MemoryBackend(max_entries=100, ttl=60),
+                                 os.path.join(temporary_directory(self), "generations"))
+
+    def test_retrieval_is_cached_until_the_index_changes(self):
+        calls = []
+
+        def compute():
+            calls.append(None)
+            return len(calls)
+
+        self.assertEqual(self.cache.retrieval(["chat"], compute), 1)
+        self.assertEqual(self.cache.retrieval(["chat"], compute), 1)
+
+        self.cache.index_changed()
+
+        self.assertEqual(self.cache.retrieval(["chat"], compute), 2)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 2})
+
+    def test_generation_is_shared_through_the_marker_file(self):
+        other = ResultCache(MemoryBackend(max_entries=100, ttl=60), self.cache.generation_directory)
+        generation = other.generation()
+
+        self.cache.index_changed()
+
+        self.assertNotEqual(other.generation(), generation)
+
+    def test_changes_only_invalidate_their_directories(self):
+        def compute():
+            calls.append(None)
+            return len(calls)
+
+        calls = []
+        root = temporary_directory(self)
+        docs, other = os.path.join(root, "docs"), os.path.join(root, "other")
+
+        for directory in (docs, root, other, None):
+            self.cache.retrieval([directory], compute, directory=directory)
+
+        self.cache.index_changed([os.path.join(docs, "a.docx")])
+
+        # The changed directory, its ancestors and the unscoped searches are computed again
+        self.assertEqual([self.cache.retrieval([directory], compute, directory=directory)
+                          for directory in (docs, root, other, None)], [5, 6, 3, 7])
+
+        self.cache.index_changed()
+
+        self.assertEqual(self.cache.retrieval([other], compute, directory=other), 8)
+
+    def test_rejected_values_are_not_cached(self):
+        self.cache.retrieval(["chat"], lambda: [], should_cache=bool)
+
+        self.assertEqual(self.cache.retrieval(["chat"], lambda: ["a.docx"], should_cache=bool), ["a.docx"])
+
+    def test_answers_are_keyed_by_their_context(self):
+        self.cache.answer("Qui ?", "Le chat.", lambda: ("le chat", 0.9))
+
+        self.assertEqual(self.cache.cached_answer("Qui ?", "Le chat."), (True, ("le chat", 0.9)))
+        self.assertEqual(self.cache.cached_answer("Qui ?", "Le chien."), (False, None))
+
+    def test_concurrent_requests_are_computed_once(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(None)
+            started.set()
+            release.wait(5)
+            return "value"
+
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_compute("key", compute)))
+                   for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+
+        for thread in threads[1:]:
+            thread.start()
+
+        # Every thread has missed the cache, so the followers are waiting for the leader
+        deadline = time.monotonic() + 5
+        while self.cache.stats()["misses"] < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        release.set()
+
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 3)
+
+    def test_errors_reach_the_waiting_requests(self):
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def compute():
+            started.set()
+            release.wait(5)
+            raise ValueError("failed")
+
+        def request():
+            try:
+                self.cache.get_or_compute("key", compute)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=request) for _ in range(2)]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+
+        deadline = time.monotonic() + 5
+        while self.cache.stats()["misses"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        release.set()
+
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(self.cache.backend.get("key"), (False, None))
+
+
+class PassageRankerTests(SimpleTestCase):
+    PASSAGES = ["chat chat chat", "chat chien", "chien", "chat oiseau poisson cheval"]
+
+    def select(self, ranker, query="chat"):
+        return ranker.select(query.split(), self.PASSAGES, self.PASSAGES)
+
+    def test_best_passages_first_without_the_unrelated_ones(self):
+        selected = self.select(PassageRanker(token_budget=1000, top_k=10, count_tokens=lambda text: 1))
+
+        self.assertEqual(selected, ["chat chat chat", "chat chien", "chat oiseau poisson cheval"])
+
+    def test_top_k(self):
+        selected = self.select(PassageRanker(token_budget=1000, top_k=2, count_tokens=lambda text: 1))
+
+        self.assertEqual(selected, ["chat chat chat", "chat chien"])
+
+    def test_token_budget_skips_the_passages_that_do_not_fit(self):
+        ranker = PassageRanker(token_budget=5, top_k=10, count_tokens=lambda text: len(text.split()))
+
+        # 3 + 2 tokens fit, the 4 of the last passage would not
+        self.assertEqual(self.select(ranker), ["chat chat chat", "chat chien"])
+
+    def test_best_passage_is_kept_over_the_budget(self):
+        ranker = PassageRanker(token_budget=1, top_k=10, count_tokens=lambda text: len(text.split()))
+
+        self.assertEqual(self.select(ranker), ["chat chat chat"])
+
+    def test_no_matching_passage(self):
+        self.assertEqual(self.select(PassageRanker(), query="girafe"), [])
+
+
+class SQLiteBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.path = os.path.join(temporary_directory(self), "search.sqlite3")
+        self.backend = self.open()
+
+    def open(self, **kwargs):
+        backend = SQLiteBackend(self.path, **kwargs)
+        self.addCleanup(backend.close)
+        return backend
+
+    def index(self, backend, *documents):
+        return list(backend.index(documents))
+
+    def test_index_acknowledges_every_file(self):
+        results = self.index(self.backend, ("/docs/a.docx", "chat noir", passages("chat", "noir")),
+                             ("/docs/b.pdf", "chien", passages("chien")))
+
+        self.assertEqual(results, [("/docs/a.docx", None), ("/docs/b.pdf", None)])
+        self.assertTrue(self.backend.has_passages("/docs/a.docx"))
+
+    def test_search_ranks_the_best_match_first(self):
+        self.index(self.backend, ("/docs/a.docx", "chat chien oiseau poisson", []),
+                   ("/docs/b.docx", "chat chat chien", []), ("/docs/c.docx", "cheval", []))
+
+        results = self.backend.search("chat chien", 10)
+
+        self.assertEqual([result["file_path"] for result in results], ["/docs/b.docx", "/docs/a.docx"])
+        self.assertGreater(results[0]["score"], results[1]["score"])
+        self.assertEqual(len(self.backend.search("chat", 1)), 1)
+        self.assertEqual(self.backend.search("", 10), [])
+
+    def test_search_filters_by_directory_and_extension(self):
+        self.index(self.backend, ("/docs/a/report.docx", "budget", []), ("/docs/a/sub/notes.pdf", "budget", []),
+                   ("/docs/ab/report.docx", "budget", []), ("/docs/b/table.XLSX", "budget", []))
+
+        def search(**filters):
+            return sorted(result["file_path"] for result in self.backend.search("budget", 10, filters))
+
+        self.assertEqual(search(directory="/docs/a"), ["/docs/a/report.docx", "/docs/a/sub/notes.pdf"])
+        self.assertEqual(search(extensions=[".pdf", ".xlsx"]), ["/docs/a/sub/notes.pdf", "/docs/b/table.XLSX"])
+        self.assertEqual(search(directory="/docs/a", extensions=[".docx"]), ["/docs/a/report.docx"])
+        self.assertEqual(search(directory="/docs/c"), [])
+
+    def test_search_passages_of_one_file(self):
+        self.index(self.backend, ("/docs/a.docx", "", passages("le chat dort", "le chien aboie", "chat et chat")),
+                   ("/docs/b.docx", "", passages("un autre chat")))
+
+        results = self.backend.search_passages("/docs/a.docx", "chat", 10)
+
+        self.assertEqual([text for text, _ in results], ["chat et chat", "le chat dort"])
+
+    def test_reindexing_a_file_replaces_it(self):
+        self.index(self.backend, ("/docs/a.docx", "chat", passages("chat")))
+        self.index(self.backend, ("/docs/a.docx", "chien", passages("chien")))
+
+        self.assertEqual(self.backend.search("chat", 10), [])
+        self.assertEqual(len(self.backend.search("chien", 10)), 1)
+
+    def test_delete_removes_the_document_and_its_passages(self):
+        self.index(self.backend, ("/docs/a.docx", "chat", passages("chat")), ("/docs/b.docx", "chat", []))
+
+        self.backend.delete(["/docs/a.docx"])
+
+        self.assertEqual([result["file_path"] for result in self.backend.search("chat", 10)], ["/docs/b.docx"])
+        self.assertFalse(self.backend.has_passages("/docs/a.docx"))
+
+    def test_delete_passages_keeps_the_document(self):
+        self.index(self.backend, ("/docs/a.docx", "chat", passages("chat")))
+
+        self.backend.delete_passages(["/docs/a.docx"])
+
+        self.assertFalse(self.backend.has_passages("/docs/a.docx"))
+        self.assertEqual(len(self.backend.search("chat", 10)), 1)
+
+    def test_engine_mode_analyzes_the_text_and_the_query(self):
+        backend = SQLiteBackend(os.path.join(temporary_directory(self), "engine.sqlite3"), text_analysis="engine",
+                                analyzer=SingularAnalyzer())
+        self.addCleanup(backend.close)
+        self.index(backend, ("/docs/a.docx", "Chats noirs", passages("Chats noirs", "Un chien")))
+
+        self.assertEqual(len(backend.search("chat", 10)), 1)
+        # The raw text is handed back as the processed one, for the passage ranker to analyze
+        self.assertEqual(backend.search_passages("/docs/a.docx", "noir", 10), [("Chats noirs", "Chats noirs")])
+
+    def test_other_analysis_mode_is_refused_until_recreated(self):
+        self.index(self.backend, ("/docs/a.docx", "chat", passages("chat")))
+        backend = self.open(text_analysis="engine", analyzer=SingularAnalyzer())
+
+        with self.assertRaises(IndexMismatch):
+            backend.search("chat", 10)
+
+        backend.recreate_indices()
+
+        self.assertEqual(backend.search("chat", 10), [])
+        self.index(backend, ("/docs/a.docx", "chat", []))
+        self.assertEqual(len(backend.search("chat", 10)), 1)
+
+
+class InstrumentationMiddlewareTests(SimpleTestCase):
+    def test_sync_and_async_chains(self):
+        request = RequestFactory().get("/")
+
+        def view(request):
+            return HttpResponse("sync")
+
+        async def async_view(request):
+            return HttpResponse("async")
+
+        middleware = InstrumentationMiddleware(view)
+        async_middleware = InstrumentationMiddleware(async_view)
+
+        self.assertFalse(iscoroutinefunction(middleware))
+        self.assertEqual(middleware(request).content, b"sync")
+        self.assertTrue(iscoroutinefunction(async_middleware))
+        self.assertEqual(async_to_sync(async_middleware)(request).content, b"async")
+
+
+@override_settings(API_DEFAULT_TOP_K=4, API_MAX_TOP_K=20, API_DEFAULT_PAGE_SIZE=50, API_MAX_PAGE_SIZE=200)
+class ParseQuestionBatchTests(SimpleTestCase):
+    def test_defaults(self):
+        questions, top_k, filters, latency_budget, page, page_size = parse_question_batch(
+            {"questions": ["Qui ?", {"id": "q2", "question": "Quand ?"}]})
+
+        self.assertEqual(questions, [{"id": 0, "question": "Qui ?"}, {"id": "q2", "question": "Quand ?"}])
+        self.assertEqual((top_k, latency_budget, page, page_size), (4, None, 1, 50))
+        self.assertEqual(filters, {"directory": None, "extensions": []})
+
+    def test_filters_are_normalized(self):
+        _, _, filters, _, _, _ = parse_question_batch(
+            {"questions": ["Qui ?"], "filters": {"directory": "/docs", "extensions": ["PDF", ".docx"]}})
+
+        self.assertEqual(filters, {"directory": "/docs", "extensions": [".pdf", ".docx"]})
+
+    def test_invalid_payloads(self):
+        for payload in (
+            [],
+            {"questions": []},
+            {"questions": [""]},
+            {"questions": [{"id": 1}]},
+            {"questions": ["Qui ?"], "top_k": 0},
+            {"questions": ["Qui ?"], "top_k": 21},
+            {"questions": ["Qui ?"], "top_k": "3"},
+            {"questions": ["Qui ?"], "top_k": True},
+            {"questions": ["Qui ?"], "page": False},
+            {"questions": ["Qui ?"], "page_size": 201},
+            {"questions": ["Qui ?"], "filters": {"size": 3}},
+            {"questions": ["Qui ?"], "filters": {"directory": 3}},
+            {"questions": ["Qui ?"], "filters": {"extensions": "pdf"}},
+            {"questions": ["Qui ?"], "latency_budget_ms": 0},
+        ):
+            with self.subTest(payload=payload), self.assertRaises(ValueError):
+                parse_question_batch(payload)
+
+
+class ChangeBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.root = os.path.abspath(temporary_directory(self))
+
+    def test_batch_waits_for_the_quiet_period(self):
+        batcher = ChangeBatcher([self.root], debounce=0.2, max_delay=10)
+        path = os.path.join(self.root, "a.docx")
+        batcher.add_file(path)
+        batcher.add_file(path)
+
+        self.assertIsNone(batcher.wait(timeout=0))
+
+        start_time = time.monotonic()
+        batch = batcher.wait(timeout=5)
+
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.1)
+        self.assertEqual(batch, {self.root: ([path], [])})
+        self.assertIsNone(batcher.wait(timeout=0))
+
+    def test_max_delay_releases_a_busy_batch(self):
+        batcher = ChangeBatcher([self.root], debounce=10, max_delay=0.2)
+        batcher.add_file(os.path.join(self.root, "a.docx"))
+
+        batch = batcher.wait(timeout=5)
+
+        self.assertEqual(list(batch), [self.root])
+
+    def test_unsupported_and_outside_files_are_ignored(self):
+        batcher = ChangeBatcher([self.root], debounce=0, max_delay=0)
+        batcher.add_file(os.path.join(self.root, "notes.txt"))
+        batcher.add_file(os.path.join(os.path.dirname(self.root), "other.docx"))
+
+        self.assertIsNone(batcher.wait(timeout=0.05))
+
+    def test_files_of_changed_directories_are_coalesced(self):
+        nested = os.path.join(self.root, "nested")
+        os.makedirs(nested)
+        batcher = ChangeBatcher([self.root, nested], debounce=0, max_delay=0)
+        moved = os.path.join(self.root, "moved")
+        batcher.add_directory(moved)
+        batcher.add_directory(os.path.join(moved, "sub"))
+        batcher.add_file(os.path.join(moved, "a.docx"))
+        batcher.add_file(os.path.join(self.root, "b.pdf"))
+        batcher.add_file(os.path.join(nested, "c.xlsx"))
+
+        batch = batcher.wait(timeout=5)
+
+        self.assertEqual(batch, {
+            self.root: ([os.path.join(self.root, "b.pdf")], [moved]),
+            nested: ([os.path.join(nested, "c.xlsx")], []),
+        })
+
+
+class ElasticsearchBackendTests(SimpleTestCase):
+    def test_other_analysis_mode_is_refused_on_the_first_search(self):
+        es = mock.Mock()
+        es.indices.get_mapping.side_effect = lambda index: {index: {"mappings": {
+            "_meta": {"text_analysis": "python"}, "properties": dict.fromkeys(["directories", "extension"], {})}}}
+        backend = ElasticsearchBackend(es, text_analysis="engine")
+
+        for search in (lambda: backend.search("chat", 10), lambda: backend.search_many(["chat"], 10),
+                       lambda: backend.search_passages("/docs/a.docx", "chat", 10),
+                       lambda: backend.has_passages("/docs/a.docx")):
+            with self.assertRaises(IndexMismatch):
+                search()
+
+        es.search.assert_not_called()
+        es.msearch.assert_not_called()
+        es.count.assert_not_called()
+
+
+class VectorIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = temporary_directory(self)
+        self.index = self.open()
+
+    def open(self, **kwargs):
+        index = VectorIndex(self.directory, 4, "test-model", **kwargs)
+        self.addCleanup(index.close)
+        return index
+
+    def add(self, index, file_path, *vectors):
+        index.add(file_path, list(range(len(vectors))), [f"{file_path} {i}" for i in range(len(vectors))],
+                  np.stack([unit(vector) for vector in vectors]))
+
+    def test_search_returns_the_closest_passages_first(self):
+        self.add(self.index, "/docs/a.docx", [1, 0, 0, 0], [0, 1, 0, 0])
+        self.add(self.index, "/docs/b.docx", [1, 0.5, 0, 0])
+
+        results = self.index.search(unit([1, 0, 0, 0]), 2)
+
+        self.assertEqual([(file_path, position) for file_path, position, _, _ in results],
+                         [("/docs/a.docx", 0), ("/docs/b.docx", 0)])
+        self.assertEqual(results[0][2], "/docs/a.docx 0")
+        self.assertAlmostEqual(results[0][3], 1.0, places=2)
+
+    def test_search_one_file(self):
+        self.add(self.index, "/docs/a.docx", [1, 0, 0, 0])
+        self.add(self.index, "/docs/b.docx", [0, 1, 0, 0], [0, 0, 1, 0])
+
+        results = self.index.search(unit([1, 0, 0, 0]), 10, file_path="/docs/b.docx")
+
+        self.assertEqual({file_path for file_path, _, _, _ in results}, {"/docs/b.docx"})
+        self.assertEqual(len(results), 2)
+
+    def test_search_filters(self):
+        self.add(self.index, "/docs/a/x.docx", [1, 0, 0, 0])
+        self.add(self.index, "/docs/ab/y.docx", [1, 0.1, 0, 0])
+        self.add(self.index, "/docs/a/z.pdf", [0, 1, 0, 0])
+
+        def search(**filters):
+            return [file_path for file_path, _, _, _ in self.index.search(unit([1, 0, 0, 0]), 1, filters=filters)]
+
+        self.assertEqual(search(directory="/docs/ab"), ["/docs/ab/y.docx"])
+        self.assertEqual(search(directory="/docs/a", extensions=[".PDF"]), ["/docs/a/z.pdf"])
+        self.assertEqual(search(directory="/docs/c"), [])
+
+    def test_delete(self):
+        self.add(self.index, "/docs/a.docx", [1, 0, 0, 0])
+        self.add(self.index, "/docs/b.docx", [0, 1, 0, 0])
+        self.index.search(unit([1, 0, 0, 0]), 10)  # Maps the matrix before the deletion
+
+        self.index.delete(["/docs/a.docx"])
+
+        self.assertEqual([file_path for file_path, _, _, _ in self.index.search(unit([1, 0, 0, 0]), 10)],
+                         ["/docs/b.docx"])
+
+    def test_compact_drops_the_deleted_rows(self):
+        for i in range(5):
+            self.add(self.index, f"/docs/{i}.docx", [1, i, 0, 0])
+
+        self.index.delete(["/docs/0.docx", "/docs/1.docx"])
+        self.index.compact()
+
+        results = self.index.search(unit([1, 2, 0, 0]), 10)
+        self.assertEqual(results[0][0], "/docs/2.docx")
+        self.assertEqual(sorted(file_path for file_path, _, _, _ in results),
+                         ["/docs/2.docx", "/docs/3.docx", "/docs/4.docx"])
+        self.assertEqual(self.index._load()["rows"], 3)
+
+    def test_search_maps_the_next_generation_after_a_compaction(self):
+        self.add(self.index, "/docs/a.docx", [1, 0, 0, 0])
+        self.add(self.index, "/docs/b.docx", [0, 1, 0, 0])
+        reader = self.open()
+        map_generation = reader._map
+
+        def compacted_meanwhile(generation, count):
+            # Another process compacts between the read transaction and the mapping of its files
+            if generation == 0:
+                self.index.compact()
+
+            return map_generation(generation, count)
+
+        with mock.patch.object(reader, "_map", side_effect=compacted_meanwhile) as mapped:
+            results = reader.search(unit([1, 0, 0, 0]), 10)
+
+        self.assertEqual([call.args[0] for call in mapped.call_args_list], [0, 1])
+        self.assertEqual([file_path for file_path, _, _, _ in results], ["/docs/a.docx", "/docs/b.docx"])
+
+    def test_int8_vectors(self):
+        index = VectorIndex(temporary_directory(self), 4, "test-model", dtype="int8")
+        self.addCleanup(index.close)
+        self.add(index, "/docs/a.docx", [1, 0, 0, 0], [0, 1, 0, 0])
+
+        results = index.search(unit([0, 1, 0, 0]), 1)
+
+        self.assertEqual(results[0][:2], ("/docs/a.docx", 1))
+        self.assertAlmostEqual(results[0][3], 1.0, places=2)
+
+    def test_ivf_lists_after_compaction(self):
+        index = self.open(ivf_lists=2, ivf_probes=1)
+        rng = np.random.default_rng(0)
+        clusters = [unit([1, 0, 0, 0]), unit([0, 0, 1, 0])]
+
+        for i in range(2 * 2 * VectorIndex.MIN_ROWS_PER_LIST):
+            self.add(index, f"/docs/{i % 2}/{i}.docx", clusters[i % 2] + rng.normal(0, 0.05, 4))
+
+        index.compact(train_sample_size=1000)
+
+        self.assertIsNotNone(index._load()["centroids"])
+        results = [file_path for file_path, _, _, _ in index.search(clusters[1], 5)]
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(file_path.startswith("/docs/1/") for file_path in results))
+
+        # A filter small enough is scored exactly, even outside the probed list
+        results = [file_path for file_path, _, _, _ in index.search(clusters[1], 5, filters={"directory": "/docs/0"})]
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(file_path.startswith("/docs/0/") for file_path in results))
+
+    def test_other_model_is_refused(self):
+        with self.assertRaises(ValueError):
+            VectorIndex(self.directory, 4, "other-model")
+
+    def test_documents_without_the_path_fields_are_refused(self):
+        es = mock.Mock()
+        es.indices.get_mapping.side_effect = lambda index: {index: {"mappings": {
+            "_meta": {"text_analysis": "engine"}, "properties": {"file_path": {}, "text": {}}}}}
+        backend = ElasticsearchBackend(es, text_analysis="engine")
+
+        with self.assertRaises(IndexMismatch):
+            backend.search("chat", 10, filters={"directory": "/docs"})
+
+        es.indices.put_mapping.assert_not_called()
+        es.search.assert_not_called()
+
+
+class FakeElasticsearch:
+    # Answers bulk requests with the statuses of `responses` (one list per request), then with 201
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def bulk(self, operations):
+        actions = len(operations) // 2  # A header and a source line per action
+        self.requests.append(actions)
+        statuses = self.responses.pop(0) if self.responses else [201] * actions
+        return {"items": [{"index": {"status": status, "error": f"HTTP {status}" if status >= 300 else None}}
+                          for status in statuses]}
+
+
+class ChunkSizerTests(SimpleTestCase):
+    def test_grows_while_full_chunks_are_fast(self):
+        sizer = ChunkSizer(initial=100, minimum=10, maximum=1000, target_seconds=1.0)
+
+        sizer.observe(100, 1000, 0.1, 0)
+
+        self.assertEqual(sizer.size, 150)
+
+    def test_partial_chunks_do_not_grow_it(self):
+        sizer = ChunkSizer(initial=100, minimum=10, maximum=1000, target_seconds=1.0)
+
+        sizer.observe(40, 400, 0.1, 0)
+
+        self.assertEqual(sizer.size, 100)
+
+    def test_shrinks_in_proportion_to_slow_requests(self):
+        sizer = ChunkSizer(initial=100, minimum=10, maximum=1000, target_seconds=1.0)
+
+        sizer.observe(100, 1000, 4.0, 0)
+
+        self.assertEqual(sizer.size, 25)
+
+    def test_halves_on_rejections(self):
+        sizer = ChunkSizer(initial=100, minimum=10, maximum=1000, target_seconds=1.0)
+
+        sizer.observe(100, 1000, 0.1, 3)
+
+        self.assertEqual(sizer.size, 50)
+
+    def test_bounds(self):
+        sizer = ChunkSizer(initial=100, minimum=80, maximum=120, max_bytes=10 ** 6, target_seconds=1.0)
+
+        sizer.observe(100, 1000, 0.1, 0)
+        self.assertEqual(sizer.size, 120)
+
+        sizer.observe(120, 1000, 10.0, 0)
+        self.assertEqual(sizer.size, 80)
+
+    def test_payload_limit(self):
+        sizer = ChunkSizer(initial=100, minimum=10, maximum=1000, max_bytes=10000, target_seconds=1.0)
+
+        # 1000 bytes per action: only 10 fit in max_bytes
+        sizer.observe(100, 100000, 0.1, 0)
+
+        self.assertEqual(sizer.size, 10)
+
+
+class BulkIndexTests(SimpleTestCase):
+    def actions(self, count):
+        return [{"_index": "documents", "_id": str(i), "_source": {"text": f"document {i}"}} for i in range(count)]
+
+    def test_every_action_is_acknowledged(self):
+        es = FakeElasticsearch()
+
+        results = list(bulk_index(es, self.actions(25), sizer=ChunkSizer(initial=10, minimum=10), thread_count=2))
+
+        self.assertEqual(sorted(int(action["_id"]) for action, _ in results), list(range(25)))
+        self.assertTrue(all(error is None for _, error in results))
+        self.assertEqual(sorted(es.requests), [5, 10, 10])
+
+    def test_rejected_actions_are_retried(self):
+        es = FakeElasticsearch([201, 429, 201])
+        sizer = ChunkSizer(initial=3, minimum=1)
+        stats = BulkStats()
+
+        results = list(bulk_index(es, self.actions(3), sizer=sizer, thread_count=1, initial_backoff=0, stats=stats))
+
+        self.assertEqual(sorted(action["_id"] for action, error in results if error is None), ["0", "1", "2"])
+        self.assertEqual(es.requests, [3, 1])
+        self.assertEqual(stats.snapshot()["retries"], 1)
+        self.assertEqual(sizer.size, 1)  # Halved on the rejection, within the minimum
+
+    def test_errors_and_exhausted_retries_are_reported(self):
+        es = FakeElasticsearch([400, 429], [429], [429])
+
+        results = dict((action["_id"], error) for action, error in bulk_index(
+            es, self.actions(2), sizer=ChunkSizer(initial=2, minimum=1), thread_count=1, max_retries=2,
+            initial_backoff=0))
+
+        self.assertEqual(results["0"], "HTTP 400")
+        self.assertIn("after 2 retries", results["1"])
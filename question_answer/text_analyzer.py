@@ -0,0 +1,133 @@
+import re
+from functools import lru_cache
+
+HTML_TAGS = re.compile('<.*?>')
+NON_ALPHANUMERIC = re.compile(r'[^\w\s]')
+
+# Elided articles ("l'", "qu'"...), split from their word since apostrophes are not word characters
+WORDS = re.compile(r"\w+")
+ELIDED_ARTICLES = frozenset(["l", "m", "t", "qu", "n", "s", "j", "d", "c", "jusqu", "quoiqu", "lorsqu", "puisqu"])
+
+
+class TextAnalyzer:
+    """
+    French text analysis shared by the indexing and query paths.
+
+    Texts are lemmatized with spaCy in batches (nlp.pipe, without the parser and
+    named entity recognizer, which the lemmas do not need), then every lemma is
+    tokenized, stemmed and stopword-filtered once and memoized in a bounded LRU
+    cache shared by every text analyzed with this instance.
+
+    It only depends on a loaded spaCy model, so it can run in the extraction
+    worker processes as well as in the web process. Used with TEXT_ANALYSIS =
+    'python'; see EngineAnalyzer for the default mode.
+    """
+
+    DISABLED_COMPONENTS = ("parser", "ner")
+
+    def __init__(self, nlp, cache_size=100000, batch_size=64):
+        # NLTK is only imported by the processes that analyze text
+        from nltk.corpus import stopwords
+        from nltk.stem import SnowballStemmer
+        from nltk.tokenize import word_tokenize
+
+        self.nlp = nlp
+        self.batch_size = batch_size
+        self.stemmer = SnowballStemmer("french")
+        self.word_tokenize = word_tokenize
+        self.stopwords = frozenset(stopwords.words("french"))
+        self.disabled = [name for name in self.DISABLED_COMPONENTS if name in nlp.pipe_names]
+        self._lemma_terms = lru_cache(maxsize=cache_size)(self._analyze_lemma)
+
+    def _analyze_lemma(self, lemma):
+        # Tokenize a lemma, stem its tokens and filter out the stopwords
+        stemmed_tokens = (self.stemmer.stem(token) for token in self.word_tokenize(lemma))
+        return tuple(token for token in stemmed_tokens if token not in self.stopwords)
+
+    def _clean(self, text):
+        # Clean the text by removing HTML tags and non-alphanumeric characters
+        return NON_ALPHANUMERIC.sub('', HTML_TAGS.sub('', text))
+
+    def analyze_batch(self, texts):
+        """
+        Analyze several texts at once.
+
+        Args:
+            texts (iterable): The raw texts.
+
+        Returns:
+            list: The processed text of every input, in order.
+        """
+        docs = self.nlp.pipe((self._clean(text) for text in texts),
+                             batch_size=self.batch_size, disable=self.disabled)
+        processed_texts = []
+
+        for doc in docs:
+            terms = []
+
+            for token in doc:
+                if token.is_space:
+                    continue
+
+                lemma = token.lemma_ if token.lemma_ != "-PRON-" else token.text
+                terms.extend(self._lemma_terms(lemma))
+
+            processed_texts.append(" ".join(terms))
+
+        return processed_texts
+
+    def analyze(self, text):
+        """Analyze a single text, document or query alike."""
+        return self.analyze_batch([text])[0]
+
+    def cache_info(self):
+        """Return the hits, misses and size of the lemma cache."""
+        return self._lemma_terms.cache_info()
+
+    def ranking_text(self, processed_text):
+        """Return the terms the passage pre-ranker compares: analyzed texts already are."""
+        return processed_text
+
+    # Documents and queries go through the same analysis, so matching terms line up
+    preprocess_text = analyze
+    preprocess_query = analyze
+
+
+class EngineAnalyzer:
+    """
+    Analysis for TEXT_ANALYSIS = 'engine', where the search backend analyzes the text.
+
+    Documents and queries are handed over raw, so indexing costs no Python analysis
+    at all and both sides go through the same analyzer of the backend (see
+    search_backends.FRENCH_ANALYSIS). Only the passage pre-ranker still needs terms
+    in Python, on a few dozen passages per question: ranking_text() approximates
+    the backend's analyzer (elision, lowercase, stopwords, stemming) for them,
+    without spaCy.
+    """
+
+    def __init__(self, cache_size=100000):
+        from nltk.corpus import stopwords
+        from nltk.stem import SnowballStemmer
+
+        self.stemmer = SnowballStemmer("french")
+        self.stopwords = frozenset(stopwords.words("french")) | ELIDED_ARTICLES
+        self._stem = lru_cache(maxsize=cache_size)(self.stemmer.stem)
+
+    def analyze_batch(self, texts):
+        """Return the texts unchanged: the search backend analyzes them when they are indexed."""
+        return list(texts)
+
+    def analyze(self, text):
+        return text
+
+    def ranking_text(self, text):
+        """Return the analyzed terms of a raw text for the passage pre-ranker, separated by spaces."""
+        words = WORDS.findall(HTML_TAGS.sub(" ", text).lower())
+        return " ".join(self._stem(word) for word in words if word not in self.stopwords)
+
+    def cache_info(self):
+        """Return the hits, misses and size of the stem cache."""
+        return self._stem.cache_info()
+
+    preprocess_text = analyze
+    preprocess_query = analyze
@@ -0,0 +1,33 @@
+import hashlib
+import os
+
+
+def document_id(file_path):
+    """Return the stable search index ID of the given file path."""
+    return hashlib.sha1(file_path.encode("utf-8")).hexdigest()
+
+
+def content_hash(file_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of the file content, read in chunks."""
+    digest = hashlib.sha256()
+
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def directory_ancestors(file_path):
+    """Return the directory of the file path and all of its ancestors, innermost first."""
+    directories = []
+    directory = os.path.dirname(os.path.normpath(file_path))
+
+    while True:
+        directories.append(directory)
+        parent = os.path.dirname(directory)
+
+        if parent == directory:
+            return directories
+
+        directory = parent
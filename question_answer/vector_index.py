@@ -0,0 +1,458 @@
+"""
+Dense passage vectors in local memory-mapped matrices, searched with NumPy.
+
+Vectors are L2-normalized, so the dot product with a query vector is their
+cosine similarity. They are stored as float16, or as int8 with one float32
+scale per row (half the size again), in a matrix file that only ever grows:
+rows are appended at the end and deleted rows are only dropped from the
+SQLite table describing them (file path, position and text of the passage),
+until compact() rewrites the matrix without them.
+
+Without IVF lists every live row is scored, block by block. With `ivf_lists`,
+the vectors are clustered with k-means once there are enough of them, each row
+is assigned to its closest centroid and only the rows of the `ivf_probes`
+lists closest to the query are scored. Searches filtered by directory or
+extension only score the rows of the matching files, whose mask is cached
+until the index changes.
+
+Several processes can use the same index: writes are serialized by the SQLite
+database, and readers map the matrix again whenever its version changed.
+"""
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from .search_backends import path_matches
+
+logger = logging.getLogger(__name__)
+
+DTYPES = ("float16", "int8")
+
+
+class VectorIndex:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+        CREATE TABLE IF NOT EXISTS vectors (
+            row INTEGER PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            text TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS vectors_file_path ON vectors (file_path);
+    """
+
+    BLOCK_ROWS = 65536  # Rows converted to float32 at once by a full scan
+    MIN_ROWS_PER_LIST = 64  # IVF lists are only trained once there are this many vectors per list
+    MAX_FILTER_MASKS = 32  # Row masks of the latest search filters kept until the index changes
+    LOAD_ATTEMPTS = 3  # Generations a search tries to map while compactions remove them
+
+    def __init__(self, directory, dimension, model_name, dtype="float16", ivf_lists=None, ivf_probes=8, timeout=30):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector type {dtype!r}, expected one of {', '.join(DTYPES)}.")
+
+        self.directory = str(directory)
+        self.dimension = dimension
+        self.dtype = dtype
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._version = None
+        self._state = None
+        os.makedirs(self.directory, exist_ok=True)
+
+        connection = self._connection()
+        connection.executescript(self.SCHEMA)
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+
+            for key, value in (("dimension", dimension), ("model", model_name), ("dtype", dtype)):
+                stored = self._meta(connection, key)
+
+                if stored is None:
+                    self._set_meta(connection, key, value)
+                elif stored != value:
+                    raise ValueError(f"The vector index in {self.directory} was built with {key} {stored!r}, not "
+                                     f"{value!r}: delete it and re-index the documents.")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(os.path.join(self.directory, "vectors.sqlite3"), timeout=self.timeout,
+                                         isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+
+        return connection
+
+    @staticmethod
+    def _meta(connection, key, default=None):
+        row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    @staticmethod
+    def _set_meta(connection, key, value):
+        connection.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                           "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, value))
+
+    def _bump_version(self, connection):
+        self._set_meta(connection, "version", self._meta(connection, "version", 0) + 1)
+
+    def _path(self, name, generation):
+        # Compaction writes new files under the next generation, so readers keep using the previous ones meanwhile
+        return os.path.join(self.directory, f"{name}-{generation}.bin")
+
+    def _quantize(self, vectors):
+        # Return the rows as stored, and their scales (None for float16)
+        vectors = np.asarray(vectors, dtype=np.float32)
+
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    @staticmethod
+    def _write_rows(path, start, array):
+        # Write the rows at their offset: bytes past the last committed row are leftovers of a failed write
+        mode = "r+b" if os.path.exists(path) else "w+b"
+
+        with open(path, mode) as file:
+            file.seek(start * (array.nbytes // len(array)))
+            file.write(np.ascontiguousarray(array).tobytes())
+
+    def _assign(self, vectors, centroids):
+        # Return the closest centroid of every vector
+        lists = np.empty(len(vectors), dtype=np.int32)
+
+        for start in range(0, len(vectors), self.BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + self.BLOCK_ROWS], dtype=np.float32)
+            lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        return lists
+
+    def add(self, file_path, positions, texts, vectors):
+        """Replace the vectors of a file with the given ones, one per (position, text) passage."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        connection = self._connection()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM vectors WHERE file_path = ?", (file_path,))
+
+            if len(vectors):
+                generation = self._meta(connection, "generation", 0)
+                start = self._meta(connection, "rows", 0)
+                rows, scales = self._quantize(vectors)
+                self._write_rows(self._path("matrix", generation), start, rows)
+
+                if scales is not None:
+                    self._write_rows(self._path("scales", generation), start, scales)
+
+                centroids = self._centroids(generation)
+
+                if centroids is not None:
+                    self._write_rows(self._path("lists", generation), start, self._assign(vectors, centroids))
+
+                connection.executemany(
+                    "INSERT INTO vectors (row, file_path, position, text) VALUES (?, ?, ?, ?)",
+                    ((start + i, file_path, position, text)
+                     for i, (position, text) in enumerate(zip(positions, texts))))
+                self._set_meta(connection, "rows", start + len(vectors))
+
+            self._bump_version(connection)
+
+    def delete(self, file_paths):
+        """Remove the vectors of the given files."""
+        connection = self._connection()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("DELETE FROM vectors WHERE file_path = ?", ((path,) for path in file_paths))
+            self._bump_version(connection)
+
+    def _centroids(self, generation):
+        path = os.path.join(self.directory, f"centroids-{generation}.npy")
+        return np.load(path) if os.path.exists(path) else None
+
+    def _load(self):
+        # Map the matrix again if another writer (or process) changed the index since the last search
+        connection = self._connection()
+        version = self._meta(connection, "version", 0)
+
+        if version == self._version:
+            return self._state
+
+        with self._lock:
+            if version == self._version:
+                return self._state
+
+            for attempt in range(self.LOAD_ATTEMPTS):
+                with connection:
+                    # One read transaction, so the rows match the count of the same version
+                    connection.execute("BEGIN")
+                    version = self._meta(connection, "version", 0)
+                    generation = self._meta(connection, "generation", 0)
+                    count = self._meta(connection, "rows", 0)
+                    rows = [row for row, in connection.execute("SELECT row FROM vectors") if row < count]
+
+                try:
+                    state = self._map(generation, count)
+                    break
+                except FileNotFoundError:
+                    # A compaction removed the files of this generation since it was read: read the next one
+                    if attempt == self.LOAD_ATTEMPTS - 1:
+                        raise
+
+            live = np.zeros(count, dtype=bool)
+            live[rows] = True
+            state["live"] = live
+
+            self._state = state
+            self._version = version
+            return state
+
+    def _map(self, generation, count):
+        # Map the files of the generation, the first `count` rows of which are committed
+        state = {"rows": count, "matrix": None, "scales": None, "lists": None, "centroids": None, "masks": {}}
+
+        if count:
+            state["matrix"] = np.memmap(self._path("matrix", generation), dtype=self.dtype, mode="r",
+                                        shape=(count, self.dimension))
+
+            if self.dtype == "int8":
+                state["scales"] = np.memmap(self._path("scales", generation), dtype=np.float32, mode="r",
+                                            shape=(count,))
+
+            state["centroids"] = self._centroids(generation)
+
+            if state["centroids"] is not None:
+                state["lists"] = np.memmap(self._path("lists", generation), dtype=np.int32, mode="r",
+                                           shape=(count,))
+
+        return state
+
+    @staticmethod
+    def _scores(state, rows, query):
+        # Cosine similarity of the query with the given rows of the matrix
+        scores = state["matrix"][rows].astype(np.float32) @ query
+
+        if state["scales"] is not None:
+            scores *= state["scales"][rows]
+
+        return scores
+
+    def _filter_mask(self, state, filters):
+        # The live rows of the files passing the "directory" and "extensions" filters (see path_matches)
+        key = (filters.get("directory") or "", tuple(filters.get("extensions") or ()))
+        mask = state["masks"].get(key)
+
+        if mask is None:
+            mask = np.zeros(state["rows"], dtype=bool)
+            matches = {}
+
+            for row, file_path in self._connection().execute("SELECT row, file_path FROM vectors"):
+                matched = matches.get(file_path)
+
+                if matched is None:
+                    matched = matches[file_path] = path_matches(file_path, filters)
+
+                if matched and row < state["rows"]:
+                    mask[row] = True
+
+            mask &= state["live"]
+
+            if len(state["masks"]) >= self.MAX_FILTER_MASKS:
+                state["masks"].pop(next(iter(state["masks"])))
+
+            state["masks"][key] = mask
+
+        return mask
+
+    def _scan(self, state, query, mask):
+        # Score the rows of the mask, a block at a time so only one block is ever converted to float32
+        scores = np.full(state["rows"], -np.inf, dtype=np.float32)
+
+        for start in range(0, state["rows"], self.BLOCK_ROWS):
+            stop = min(start + self.BLOCK_ROWS, state["rows"])
+
+            if mask[start:stop].any():
+                scores[start:stop] = self._scores(state, slice(start, stop), query)
+
+        scores[~mask] = -np.inf
+        return np.arange(state["rows"]), scores
+
+    def _probe(self, state, query, mask):
+        # Score the rows of the mask in the IVF lists closest to the query
+        probes = np.argsort(-(state["centroids"] @ query))[:self.ivf_probes]
+        rows = np.flatnonzero(np.isin(state["lists"], probes) & mask)
+        return rows, self._scores(state, rows, query)
+
+    def search(self, query, size, file_path=None, filters=None):
+        """
+        Return the `size` passages closest to the query vector, best first.
+
+        Args:
+            query (numpy.ndarray): The normalized query vector.
+            size (int): Number of passages to return.
+            file_path (str): Only search the passages of this file.
+            filters (dict): Only search the files of a "directory" (recursively) with one of the "extensions",
+                as in SearchBackend.search().
+
+        Returns:
+            list: (file_path, position, text, score) tuples.
+        """
+        state = self._load()
+        query = np.asarray(query, dtype=np.float32)
+        connection = self._connection()
+
+        if not state["rows"]:
+            return []
+
+        if file_path is not None:
+            rows = np.array([row for row, in connection.execute("SELECT row FROM vectors WHERE file_path = ?",
+                                                                  (file_path,))
+                             if row < state["rows"]], dtype=np.int64)
+            scores = self._scores(state, rows, query) if len(rows) else np.empty(0, dtype=np.float32)
+        else:
+            mask = self._filter_mask(state, filters) if filters else state["live"]
+
+            if filters and np.count_nonzero(mask) <= self.BLOCK_ROWS:
+                # Few enough rows to score them all, which also keeps the IVF lists from missing a small directory
+                rows = np.flatnonzero(mask)
+                scores = self._scores(state, rows, query) if len(rows) else np.empty(0, dtype=np.float32)
+            elif state["centroids"] is not None:
+                rows, scores = self._probe(state, query, mask)
+            else:
+                rows, scores = self._scan(state, query, mask)
+
+        size = min(size, int(np.count_nonzero(np.isfinite(scores))))
+
+        if size <= 0:
+            return []
+
+        best = np.argpartition(-scores, size - 1)[:size]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        selected = {int(rows[i]): float(scores[i]) for i in best}
+
+        placeholders = ", ".join("?" * len(selected))
+        passages = {
+            row: (file_path, position, text)
+            for row, file_path, position, text in connection.execute(
+                f"SELECT row, file_path, position, text FROM vectors WHERE row IN ({placeholders})", list(selected))
+        }
+        # Rows deleted since the matrix was mapped are skipped
+        return [passages[row] + (score,) for row, score in selected.items() if row in passages]
+
+    def _kmeans(self, vectors, lists, iterations=10, seed=0):
+        # Spherical k-means: centroids are normalized like the vectors
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), lists, replace=False)]
+
+        for _ in range(iterations):
+            assignments = self._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            centroids = np.where(empty[:, None], centroids, sums / np.where(norms == 0, 1, norms))
+
+        return centroids.astype(np.float32)
+
+    def maintain(self, sample_size=100000):
+        """
+        Compact the matrix once most of its rows were deleted, and (re)train the IVF
+        lists when there are enough vectors and their number doubled since the last
+        training. Cheap when there is nothing to do, so it is run after every indexing run.
+        """
+        connection = self._connection()
+        count = self._meta(connection, "rows", 0)
+        live = connection.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        trained = self._meta(connection, "trained_rows", 0)
+        retrain = (self.ivf_lists and live >= self.ivf_lists * self.MIN_ROWS_PER_LIST
+                   and (not trained or live >= 2 * trained))
+
+        if retrain or count - live > max(live, 1000):
+            self.compact(sample_size if retrain else None)
+
+    def compact(self, train_sample_size=None):
+        """Rewrite the matrix without its deleted rows, optionally training the IVF lists on a sample of it."""
+        connection = self._connection()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            generation = self._meta(connection, "generation", 0)
+            count = self._meta(connection, "rows", 0)
+            passages = connection.execute("SELECT row, file_path, position, text FROM vectors ORDER BY row").fetchall()
+            rows = np.array([row for row, _, _, _ in passages if row < count], dtype=np.int64)
+
+            matrix = np.memmap(self._path("matrix", generation), dtype=self.dtype, mode="r",
+                               shape=(count, self.dimension)) if count else None
+            scales = (np.memmap(self._path("scales", generation), dtype=np.float32, mode="r", shape=(count,))
+                      if count and self.dtype == "int8" else None)
+
+            def vectors(selected):
+                block = matrix[selected].astype(np.float32)
+                return block * scales[selected][:, None] if scales is not None else block
+
+            centroids = self._centroids(generation)
+
+            if train_sample_size and self.ivf_lists and len(rows) >= self.ivf_lists * self.MIN_ROWS_PER_LIST:
+                sample = np.sort(np.random.default_rng(0).permutation(rows)[:train_sample_size])
+                centroids = self._kmeans(vectors(sample), self.ivf_lists)
+                self._set_meta(connection, "trained_rows", len(rows))
+
+            new_generation = generation + 1
+
+            for start in range(0, len(rows), self.BLOCK_ROWS):
+                selected = rows[start:start + self.BLOCK_ROWS]
+                block = vectors(selected)
+                quantized, block_scales = self._quantize(block)
+                self._write_rows(self._path("matrix", new_generation), start, quantized)
+
+                if block_scales is not None:
+                    self._write_rows(self._path("scales", new_generation), start, block_scales)
+
+                if centroids is not None:
+                    self._write_rows(self._path("lists", new_generation), start, self._assign(block, centroids))
+
+            if centroids is not None:
+                np.save(os.path.join(self.directory, f"centroids-{new_generation}.npy"), centroids)
+
+            connection.execute("DELETE FROM vectors")
+            connection.executemany("INSERT INTO vectors (row, file_path, position, text) VALUES (?, ?, ?, ?)",
+                                   ((new_row, file_path, position, text)
+                                    for new_row, (_, file_path, position, text) in
+                                    enumerate(passage for passage in passages if passage[0] < count)))
+            self._set_meta(connection, "rows", len(rows))
+            self._set_meta(connection, "generation", new_generation)
+            self._bump_version(connection)
+
+        logger.info("Compacted the vector index to %d rows", len(rows), extra={"rows": len(rows)})
+
+        # Processes still searching the previous files keep their mapping open (they cannot be removed on Windows)
+        for name in ("matrix", "scales", "lists"):
+            try:
+                os.remove(self._path(name, generation))
+            except OSError:
+                pass
+
+        try:
+            os.remove(os.path.join(self.directory, f"centroids-{generation}.npy"))
+        except OSError:
+            pass
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -1,10 +1,21 @@
+import asyncio
+import contextvars
+import json
 import logging
+import math
 import re
 import time
 from threading import Thread
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from .document_indexer import DocumentSearcher
-from .question_answering import QuestionAnswering
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from .indexing_jobs import indexing_queue
+from .inference_server import InferenceError
+from .instrumentation import metrics, span
+from .registry import registry
 import os
 import threading
 
@@ -22,111 +33,616 @@ def clean_paragraph(paragraph):
     return paragraph
 
 
-def extract_directory_path(file_path):
-    """Extract the directory path from the given file path."""
-    directory_path = os.path.dirname(file_path)
-    return directory_path
+def is_watched(directory):
+    """Return whether the directory is under one of WATCHED_DIRECTORIES, kept indexed by watch_directories."""
+    if not directory:
+        return False
 
+    directory = os.path.abspath(directory)
 
-def process_paragraph(file_processing_time, file_path, question, indexer, answering, results, found_paragraph):
+    for watched in settings.WATCHED_DIRECTORIES:
+        watched = os.path.abspath(watched)
+
+        if directory == watched or directory.startswith(os.path.join(watched, "")):
+            return True
+
+    return False
+
+
+def normalize_question(question):
+    """Collapse the whitespace of the question, so trivially different spellings share cache entries."""
+    return " ".join(question.split())
+
+
+def find_relevant_files(indexer, question, cache=None, directory=None):
+    """
+    Search the files matching the processed question, restricted to the files under `directory` when given,
+    through the retrieval cache when given.
+    """
+    processed_query = indexer.preprocess_query(question)
+    filters = {"directory": directory} if directory else None
+
+    def search():
+        return indexer.search_files(processed_query, filters=filters, question=question)
+
+    if cache is None:
+        return search()
+
+    # Dense retrieval embeds the raw question, which the processed one does not identify
+    key = ("files", processed_query, directory)
+    return cache.retrieval(key + (question,) if indexer.dense_retrieval else key, search, directory=directory)
+
+
+def find_paragraphs(indexer, file_path, question, cache=None):
+    """Return paragraphs_containing_answer() for the file, through the retrieval cache when given."""
+    if cache is None:
+        return indexer.paragraphs_containing_answer(file_path, question)
+
+    start_time = time.time()
+    key = ("paragraphs", file_path, indexer.preprocess_query(question))
+    paragraphs, processing_time = cache.retrieval(
+        key + (question,) if indexer.dense_retrieval else key,
+        lambda: indexer.paragraphs_containing_answer(file_path, question),
+        should_cache=lambda result: result[1] is not None,  # Errors are not cached
+        directory=os.path.dirname(file_path))
+
+    if processing_time is None:
+        return paragraphs, None
+
+    return paragraphs, time.time() - start_time
+
+
+def process_paragraph(file_processing_time, file_path, question, indexer, answering, results, found_paragraph,
+                      cache=None):
     """Process a single paragraph and add the result to the results list."""
     result = get_paragraphs(file_processing_time=file_processing_time,
                             file_path=file_path,
                             question=question,
                             indexer=indexer,
-                            answering=answering)
+                            answering=answering,
+                            cache=cache)
     if result:
         results.append(result)
         found_paragraph.set()
 
 
-def get_paragraphs(file_processing_time, file_path, question, indexer, answering):
+def build_result(file_processing_time, file_path, question, paragraphs, highlight_matching_processing_time,
+                 answer, confidence, answer_processing_time):
+    """Build the result dictionary of one file, as rendered by index.html."""
+    if not answer or answer == "[CLS]":
+        answer = "No answer found."
+
+    answer_result = {
+        'Answer': answer,
+        'Confidence': round(confidence, 2),
+        'Paragraph': paragraphs,
+        'highlight_matching_processing_time': highlight_matching_processing_time
+    }
+
+    return {
+        'Question': question,
+        'File_Path': file_path,
+        'Paragraphs': [answer_result],
+        'File_Processing_Time': file_processing_time,
+        'Answer_Processing_Time': answer_processing_time
+    }
+
+
+def get_paragraphs(file_processing_time, file_path, question, indexer, answering, cache=None):
     """
     Get relevant paragraphs from the given file path and measure processing time.
 
     Returns a dictionary containing the relevant paragraphs, answer, confidence,
-    processing times, and other details.
+    processing times, and other details. Retrieval and QA results are reused from
+    the result cache when one is given.
     """
-    paragraphs, highlight_matching_processing_time = indexer.paragraphs_containing_answer(file_path, question)
+    paragraphs, highlight_matching_processing_time = find_paragraphs(indexer, file_path, question, cache)
+
+    if highlight_matching_processing_time is None:
+        # The passages of the file could not be searched: `paragraphs` holds the error, not a context
+        logger.warning("Failed to find the paragraphs of %s: %s", file_path, paragraphs)
+        return None
+
     highlight_matching_processing_time = round(highlight_matching_processing_time, 2)
 
     if paragraphs:
-        print(paragraphs)
+        logger.debug("Relevant paragraphs of %s: %s", file_path, paragraphs)
         paragraphs = clean_paragraph(paragraphs)
 
         start_time = time.time()  # Start measuring the processing time
-        answer_results = []
-
-        answer, confidence = answering.generate_answer(paragraphs, question)
 
-        if not answer or answer == "[CLS]":
-            answer = "No answer found."
+        def generate_answer():
+            with span("qa"):
+                return answering.generate_answer(paragraphs, question)
 
-        answer_result = {
-            'Answer': answer,
-            'Confidence': round(confidence, 2),
-            'Paragraph': paragraphs,
-            'highlight_matching_processing_time': highlight_matching_processing_time
-        }
-        answer_results.append(answer_result)
+        if cache is None:
+            answer, confidence = generate_answer()
+        else:
+            answer, confidence = cache.answer(normalize_question(question), paragraphs, generate_answer)
 
         end_time = time.time()  # Stop measuring the processing time
         answer_processing_time = round(end_time - start_time, 2)
 
-        result = {
-            'Question': question,
-            'File_Path': file_path,
-            'Paragraphs': answer_results,
-            'File_Processing_Time': file_processing_time,
-            'Answer_Processing_Time': answer_processing_time
-        }
-        return result
+        return build_result(file_processing_time, file_path, question, paragraphs,
+                            highlight_matching_processing_time, answer, confidence, answer_processing_time)
 
     return None
 
 
+def get_paragraphs_batched(file_processing_time, file_paths, question, indexer, answering, batch_size, cache=None):
+    """
+    Answer the question over the relevant paragraphs of several files with a single batched
+    QA pipeline call.
+
+    Returns a list with one get_paragraphs() style dictionary per file that had relevant
+    paragraphs. The answer processing time of each file is the duration of the shared batch.
+    Only the contexts missing from the result cache (when given) go through the model.
+    """
+    candidates = []
+
+    for file_path in file_paths:
+        paragraphs, highlight_matching_processing_time = find_paragraphs(indexer, file_path, question, cache)
+
+        if highlight_matching_processing_time is None:
+            # Skip the file rather than answer from the error message it returned instead of its paragraphs
+            logger.warning("Failed to find the paragraphs of %s: %s", file_path, paragraphs)
+            continue
+
+        if paragraphs:
+            candidates.append((file_path, clean_paragraph(paragraphs), round(highlight_matching_processing_time, 2)))
+
+    start_time = time.time()  # Start measuring the processing time
+
+    answers = [None] * len(candidates)
+    missing = []
+
+    for i, (_, paragraphs, _) in enumerate(candidates):
+        if cache is not None:
+            found, answers[i] = cache.cached_answer(normalize_question(question), paragraphs)
+
+            if found:
+                continue
+
+        missing.append(i)
+
+    with span("qa", batch=len(missing)):
+        computed = answering.generate_answers([(candidates[i][1], question) for i in missing],
+                                              batch_size=batch_size)
+
+    for i, answer in zip(missing, computed):
+        answers[i] = answer
+
+        if cache is not None:
+            cache.store_answer(normalize_question(question), candidates[i][1], answer)
+
+    end_time = time.time()  # Stop measuring the processing time
+    answer_processing_time = round(end_time - start_time, 2)
+
+    return [
+        build_result(file_processing_time, file_path, question, paragraphs, highlight_matching_processing_time,
+                     answer, confidence, answer_processing_time)
+        for (file_path, paragraphs, highlight_matching_processing_time), (answer, confidence)
+        in zip(candidates, answers)
+    ]
+
+
+def prepare_question(documents_path, question):
+    """
+    Queue the directory for background indexing (unless it is watched or was indexed less than
+    INDEXING_REFRESH_SECONDS ago) and search the files relevant to the question.
+
+    Returns a tuple of (message, indexer, answering, cache, file_paths, file_processing_time), where
+    file_paths is None when nothing matched and otherwise lists the matching files of the directory
+    and its subdirectories. Raises ValueError when documents_path is not an existing directory.
+    """
+    if not os.path.isdir(documents_path):
+        raise ValueError(f"{documents_path} is not an existing directory.")
+
+    # Indexing runs in the background: answer from what is already indexed
+    if is_watched(documents_path):
+        message = f"{documents_path} is kept up to date by the directory watcher."
+    else:
+        job = indexing_queue.refresh(documents_path, settings.INDEXING_REFRESH_SECONDS)
+        message = f"Indexing of {documents_path} is {job.status}. Answers use the documents indexed so far."
+
+    indexer = registry.searcher(documents_path)
+
+    answering = registry.answering
+    cache = registry.result_cache
+
+    start_time = time.time()
+    # The search backend only returns files of the directory, so every hit can be answered
+    relevant_files = find_relevant_files(indexer, question, cache, directory=documents_path)
+    end_time = time.time()
+    file_processing_time = round(end_time - start_time, 2)
+
+    file_paths = None
+
+    if relevant_files:
+        file_paths = [file['file_path'] for file in relevant_files]
+
+    return message, indexer, answering, cache, file_paths, file_processing_time
+
+
 def search_question(request):
     if request.method == 'POST':
         documents_path = request.POST.get('documents_path')  # Retrieve the directory path
         question = request.POST.get('question')
 
-        indexer = DocumentSearcher(documents_path)
-        message, indexing_time = indexer.collect_data()
+        if not documents_path or not question:
+            # Nothing to index or search: neither check the watched directories nor queue a job
+            return render(request, 'index.html', {'message': "Enter the documents path and a question."})
 
-        answering = QuestionAnswering()
-
-        start_time = time.time()
-        relevant_files = indexer.search_files(question)
-        end_time = time.time()
-        file_processing_time = round(end_time - start_time, 2)
+        try:
+            message, indexer, answering, cache, file_paths, file_processing_time = prepare_question(documents_path,
+                                                                                                    question)
+        except ValueError as e:
+            return render(request, 'index.html', {'message': str(e)})
 
         results = []
-        found_paragraph = False
 
-        if relevant_files:
-            thread_list = []
-            found_paragraph_event = threading.Event()
+        if file_paths is not None:
+            if settings.QA_ANSWER_MODE == 'batched':
+                # One batched QA pass over the paragraphs of every file
+                try:
+                    results = get_paragraphs_batched(file_processing_time, file_paths, question, indexer, answering,
+                                                     batch_size=settings.QA_BATCH_SIZE, cache=cache)
+                except InferenceError as e:
+                    # The inference worker is overloaded or down: say so rather than failing the page
+                    logger.warning("Failed to answer %r: %s", question, e)
+                    return render(request, 'index.html', {'message': f"{message} {e}."})
+            else:
+                thread_list = []
+                found_paragraph_event = threading.Event()
 
-            for file in relevant_files:
-                if documents_path == extract_directory_path(file['file_path']):
-                    thread = Thread(target=process_paragraph,
-                                    args=(file_processing_time, file['file_path'], question, indexer, answering, results, found_paragraph_event))
+                for file_path in file_paths:
+                    # Run in a copy of the request context so the thread's spans reach the request trace
+                    thread = Thread(target=contextvars.copy_context().run,
+                                    args=(process_paragraph, file_processing_time, file_path, question, indexer, answering, results, found_paragraph_event, cache))
                     thread_list.append(thread)
                     thread.start()
 
-            for thread in thread_list:
-                thread.join()
-
-            if not found_paragraph_event.is_set():
-                results.append({'Question': question, 'Answer': 'No relevant paragraphs found for the query.'})
+                for thread in thread_list:
+                    thread.join()
 
             # Sort the results by confidence
             results.sort(key=lambda x: x['Paragraphs'][0]['Confidence'], reverse=True)
 
-            context = {
-                'results': results,
-                'message': message
-            }
-            return render(request, 'index.html', context)
+            if not results:
+                results.append({'Question': question, 'Answer': 'No relevant paragraphs found for the query.'})
+        else:
+            # Nothing indexed matches yet, e.g. the directory was only just queued
+            results.append({'Question': question,
+                            'Paragraphs': [{'Answer': 'No results yet: no indexed document matches the question.'}]})
+
+        context = {
+            'results': results,
+            'message': message
+        }
+        return render(request, 'index.html', context)
 
     return render(request, 'index.html')
+
+
+def json_line(event):
+    """Serialize one event of the answer stream as a line of JSON."""
+    return json.dumps(event) + "\n"
+
+
+async def stream_answers(documents_path, question):
+    """
+    Yield the events of the answer stream of stream_question().
+
+    Retrieval and the answering of each file run in worker threads, off the event loop, and the
+    result of every file is sent as soon as its QA pass is over, whatever the order of the files.
+    """
+    message, indexer, answering, cache, file_paths, file_processing_time = await sync_to_async(
+        prepare_question, thread_sensitive=False)(documents_path, question)
+    file_paths = file_paths or []
+
+    yield json_line({'event': 'started', 'message': message, 'files': len(file_paths),
+                     'File_Processing_Time': file_processing_time})
+
+    answer_file = sync_to_async(get_paragraphs, thread_sensitive=False)
+    tasks = [
+        asyncio.ensure_future(answer_file(file_processing_time, file_path, question, indexer, answering, cache))
+        for file_path in file_paths
+    ]
+    found = 0
+
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            try:
+                result = await next_result
+            except Exception as e:
+                logger.exception("Failed to answer %r", question)
+                yield json_line({'event': 'error', 'error': str(e)})
+                continue
+
+            if result:
+                found += 1
+                yield json_line({'event': 'result', 'result': result})
+
+        yield json_line({'event': 'done', 'results': found})
+    finally:
+        # The client went away: do not start the files that are still waiting for a thread
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_question(request):
+    """
+    Answer the question of the search form, streaming each file's result as it completes.
+
+    The response is newline-delimited JSON: a `started` event with the indexing message and the
+    number of relevant files, one `result` event per answered file (shaped like the results of
+    search_question) or `error` event per failed one, then a `done` event. Files are answered
+    one QA pass each, concurrently, rather than in one batch, so the first answer does not wait
+    for the slowest file. Only ASGI servers stream the events, WSGI servers send them all at once.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    documents_path = request.POST.get('documents_path')
+    question = request.POST.get('question')
+
+    if not documents_path or not question:
+        return JsonResponse({'error': 'documents_path and question are required.'}, status=400)
+
+    if not os.path.isdir(documents_path):
+        return JsonResponse({'error': 'documents_path must be an existing directory.'}, status=400)
+
+    response = StreamingHttpResponse(stream_answers(documents_path, question), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Ask reverse proxies such as nginx not to buffer the stream
+    return response
+
+
+def answer_question_batch(indexer, answering, questions, top_k, filters, deadline, batch_size, cache=None):
+    """
+    Answer a batch of questions, sharing the retrieval and QA work between them.
+
+    The files of every question are searched in a single multi-search, then the relevant
+    paragraphs of all the (question, file) pairs go through the QA model in shared batches.
+    Once `deadline` (a time.time() value) is past, the remaining pairs are skipped and their
+    question is reported as "partial".
+
+    Args:
+        questions (list): {"id", "question"} dictionaries.
+        top_k (int): Files searched per question.
+        filters (dict): Search filters, see DocumentSearcher.search_files().
+
+    Returns:
+        tuple: (results, timings, complete), where results holds one dictionary per question
+        with its answers sorted by confidence, timings the seconds spent in each stage, and
+        complete is False when the deadline cut the work short.
+    """
+    timings = {}
+    complete = True
+    results = [{'id': item['id'], 'question': item['question'], 'status': 'answered', 'answers': []}
+               for item in questions]
+
+    start_time = time.time()
+    processed_queries = [indexer.preprocess_query(item['question']) for item in questions]
+    hits = indexer.search_files_many(processed_queries, size=top_k, filters=filters,
+                                     questions=[item['question'] for item in questions])
+    timings['retrieval'] = time.time() - start_time
+
+    start_time = time.time()
+    candidates = []  # (question index, file hit, paragraphs)
+
+    for i, (item, files) in enumerate(zip(questions, hits)):
+        for file in files:
+            if time.time() > deadline:
+                results[i]['status'] = 'partial'
+                complete = False
+                break
+
+            paragraphs, processing_time = find_paragraphs(indexer, file['file_path'], item['question'], cache)
+
+            if paragraphs and processing_time is not None:
+                candidates.append((i, file, clean_paragraph(paragraphs)))
+
+    timings['passages'] = time.time() - start_time
+
+    start_time = time.time()
+    answers = [None] * len(candidates)
+    missing = []
+
+    for j, (i, _, paragraphs) in enumerate(candidates):
+        if cache is not None:
+            found, answers[j] = cache.cached_answer(normalize_question(questions[i]['question']), paragraphs)
+
+            if found:
+                continue
+
+        missing.append(j)
+
+    for start in range(0, len(missing), batch_size):
+        if time.time() > deadline:
+            complete = False
+            break
+
+        chunk = missing[start:start + batch_size]
+
+        with span("qa", batch=len(chunk)):
+            computed = answering.generate_answers(
+                [(candidates[j][2], questions[candidates[j][0]]['question']) for j in chunk], batch_size=batch_size)
+
+        for j, answer in zip(chunk, computed):
+            answers[j] = answer
+
+            if cache is not None:
+                cache.store_answer(normalize_question(questions[candidates[j][0]]['question']), candidates[j][2],
+                                   answer)
+
+    timings['qa'] = time.time() - start_time
+
+    for (i, file, paragraphs), answer in zip(candidates, answers):
+        if answer is None:
+            results[i]['status'] = 'partial'
+            continue
+
+        answer, confidence = answer
+
+        if answer and answer != "[CLS]":
+            results[i]['answers'].append({
+                'file_path': file['file_path'],
+                'score': file['score'],
+                'answer': answer,
+                'confidence': round(confidence, 4),
+                'paragraph': paragraphs,
+            })
+
+    for result in results:
+        result['answers'].sort(key=lambda answer: answer['confidence'], reverse=True)
+
+        if result['status'] == 'answered' and not result['answers']:
+            result['status'] = 'no_answer'
+
+    return results, timings, complete
+
+
+def parse_question_batch(payload):
+    """
+    Validate the body of an answer_questions request.
+
+    Returns:
+        tuple: (questions, top_k, filters, latency_budget, page, page_size); raises ValueError
+        with a message for the client when the payload is invalid.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("The body must be a JSON object.")
+
+    questions = []
+
+    for index, item in enumerate(payload.get('questions') or []):
+        if isinstance(item, str):
+            item = {'id': index, 'question': item}
+
+        if not isinstance(item, dict) or not isinstance(item.get('question'), str) or not item['question'].strip():
+            raise ValueError(f"Question {index} must be a non-empty string or an object with a 'question'.")
+
+        questions.append({'id': item.get('id', index), 'question': item['question']})
+
+    if not questions:
+        raise ValueError("'questions' must be a non-empty list.")
+
+    top_k = payload.get('top_k', settings.API_DEFAULT_TOP_K)
+    page = payload.get('page', 1)
+    page_size = payload.get('page_size', settings.API_DEFAULT_PAGE_SIZE)
+
+    for name, value, maximum in (('top_k', top_k, settings.API_MAX_TOP_K), ('page', page, None),
+                                 ('page_size', page_size, settings.API_MAX_PAGE_SIZE)):
+        # bool is a subclass of int, but true is not a count
+        if (not isinstance(value, int) or isinstance(value, bool) or value < 1
+                or (maximum is not None and value > maximum)):
+            limit = f" and at most {maximum}" if maximum is not None else ""
+            raise ValueError(f"'{name}' must be an integer of at least 1{limit}.")
+
+    filters = payload.get('filters') or {}
+
+    if not isinstance(filters, dict) or set(filters) - {'directory', 'extensions'}:
+        raise ValueError("'filters' may only contain 'directory' and 'extensions'.")
+
+    if not isinstance(filters.get('directory', ''), str):
+        raise ValueError("'filters.directory' must be a string.")
+
+    extensions = filters.get('extensions') or []
+
+    if not isinstance(extensions, list) or not all(isinstance(extension, str) for extension in extensions):
+        raise ValueError("'filters.extensions' must be a list of strings.")
+
+    filters = {
+        'directory': filters.get('directory') or None,
+        'extensions': ['.' + extension.lstrip('.').lower() for extension in extensions],
+    }
+
+    latency_budget = payload.get('latency_budget_ms')
+
+    if latency_budget is not None and (not isinstance(latency_budget, (int, float)) or latency_budget <= 0):
+        raise ValueError("'latency_budget_ms' must be a positive number.")
+
+    return questions, top_k, filters, latency_budget, page, page_size
+
+
+@csrf_exempt
+@require_POST
+def answer_questions(request):
+    """
+    Answer a batch of questions posted as JSON.
+
+    The body holds the `questions` (strings, or {"id", "question"} objects) and optionally
+    `top_k` (files searched per question), `filters` ({"directory", "extensions"}),
+    `latency_budget_ms`, `page` and `page_size`. Only the questions of the requested page
+    are answered, so a client walks a large evaluation set by posting it again with the
+    next page until `page` reaches `pages`.
+    """
+    start_time = time.time()
+
+    try:
+        questions, top_k, filters, latency_budget, page, page_size = parse_question_batch(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    deadline = start_time + latency_budget / 1000 if latency_budget is not None else math.inf
+    page_questions = questions[(page - 1) * page_size:page * page_size]
+    results, timings, complete = [], {}, True
+
+    if page_questions:
+        indexer = registry.searcher(filters['directory'] or '')
+
+        try:
+            results, timings, complete = answer_question_batch(indexer, registry.answering, page_questions, top_k,
+                                                               filters, deadline, settings.QA_BATCH_SIZE,
+                                                               cache=registry.result_cache)
+        except InferenceError as e:
+            # The inference worker refused the questions (busy) or is down: the client should retry later
+            response = JsonResponse({'error': str(e)}, status=503)
+            response['Retry-After'] = '1'
+            return response
+
+    timings['total'] = time.time() - start_time
+
+    return JsonResponse({
+        'results': results,
+        'page': page,
+        'page_size': page_size,
+        'pages': math.ceil(len(questions) / page_size),
+        'total': len(questions),
+        'complete': complete,
+        'timings_ms': {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+    })
+
+
+@require_GET
+def metrics_view(request):
+    """Return the metrics of this process in the Prometheus text format."""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@csrf_exempt
+@require_POST
+def enqueue_indexing(request):
+    """Queue the directory given as `documents_path` for background indexing and return its job."""
+    documents_path = request.POST.get('documents_path')
+
+    if not documents_path or not os.path.isdir(documents_path):
+        return JsonResponse({'error': 'documents_path must be an existing directory.'}, status=400)
+
+    job = indexing_queue.enqueue(documents_path)
+    return JsonResponse(job.as_dict(), status=202)
+
+
+@require_GET
+def indexing_status(request, job_id=None):
+    """Return the progress of one indexing job, or of every known job."""
+    if job_id is None:
+        return JsonResponse({'jobs': [job.as_dict() for job in indexing_queue.jobs()]})
+
+    job = indexing_queue.get(job_id)
+
+    if job is None:
+        raise Http404("Unknown indexing job.")
+
+    return JsonResponse(job.as_dict())